@@ -0,0 +1,119 @@
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+# The matching engine lives next to the Flask app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flaskapp'))
+
+from matching_engine import MatchingEngine, RestingOrder
+
+CENT = Decimal('0.01')
+
+
+def generate_mids(seed, assets):
+    # One mid price per asset, shared by the resting book and the replayed flow
+    rng = random.Random(seed)
+    return {aid: rng.uniform(100, 3000) for aid in range(1, assets + 1)}
+
+
+def generate_stream(seed, count, users, mids, buy_ratio, spread, crossing, start_oid=1):
+    """
+    Seeded synthetic order flow around the given mid prices (aid -> mid);
+    orders are priced within +/- spread of their asset's mid. With
+    crossing=False bids are kept below the mid and asks above it, so the
+    orders rest without trading.
+    """
+    rng = random.Random(seed)
+    assets = len(mids)
+
+    orders = []
+    for oid in range(start_oid, start_oid + count):
+        aid = rng.randint(1, assets)
+        otype = 'Buy' if rng.random() < buy_ratio else 'Sell'
+        offset = rng.uniform(0, spread)
+        if crossing:
+            offset = rng.uniform(-spread, spread)
+        elif otype == 'Buy':
+            offset = -offset
+        price = Decimal(mids[aid] * (1 + offset)).quantize(CENT)
+        orders.append(RestingOrder(oid, rng.randint(1, users), aid, otype, price, rng.randint(1, 100)))
+    return orders
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def replay(engine, stream, incremental):
+    latencies = []
+    fill_count = 0
+    clock = time.perf_counter_ns
+
+    started = clock()
+    for order in stream:
+        t0 = clock()
+        if incremental:
+            fills = engine.submit(order)
+        else:
+            # Rest then run a full pass over every book, as MatchOrders() does
+            engine.add(order)
+            fills = engine.match()
+        latencies.append(clock() - t0)
+        fill_count += len(fills)
+    elapsed = (clock() - started) / 1e9
+
+    latencies.sort()
+    return {
+        'orders_per_sec': len(stream) / elapsed,
+        'fills_per_sec': fill_count / elapsed,
+        'fills': fill_count,
+        'p50_us': percentile(latencies, 50) / 1000,
+        'p99_us': percentile(latencies, 99) / 1000,
+    }
+
+
+def run_benchmark(args):
+    print(f"Seed {args.seed}: {args.users} users, {args.assets} assets, "
+          f"buy ratio {args.buy_ratio}, spread {args.spread:.2%}, "
+          f"{args.orders} replayed orders, mode {args.mode}")
+    print(f"{'resting':>10} {'orders/s':>12} {'fills/s':>12} {'fills':>8} {'p50 us':>9} {'p99 us':>9}")
+
+    mids = generate_mids(args.seed, args.assets)
+    for resting in args.resting:
+        engine = MatchingEngine()
+        # Resting depth is non-crossing so the book holds exactly `resting` orders
+        engine.load(generate_stream(
+            args.seed, resting, args.users, mids,
+            args.buy_ratio, args.spread, crossing=False
+        ))
+        stream = generate_stream(
+            args.seed + 1, args.orders, args.users, mids,
+            args.buy_ratio, args.spread, crossing=True, start_oid=resting + 1
+        )
+
+        result = replay(engine, stream, incremental=(args.mode == 'incremental'))
+        print(f"{resting:>10} {result['orders_per_sec']:>12,.0f} {result['fills_per_sec']:>12,.0f} "
+              f"{result['fills']:>8} {result['p50_us']:>9.1f} {result['p99_us']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic order flow through the matching engine.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--assets', type=int, default=55)
+    parser.add_argument('--buy-ratio', type=float, default=0.5, help="Share of orders that are Buys")
+    parser.add_argument('--spread', type=float, default=0.01, help="Max relative distance from the mid price")
+    parser.add_argument('--orders', type=int, default=20000, help="Orders replayed per run")
+    parser.add_argument('--resting', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Resting book sizes to measure at")
+    parser.add_argument('--mode', choices=['incremental', 'full'], default='incremental',
+                        help="incremental: match against the order's own book; full: full pass after each order")
+    run_benchmark(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ from routes.user_routes import user_bp
 from flask_cors import CORS  # Import Flask-CORS
 from flask_login import LoginManager
 import os
+import matching_client
 
 # Initialize Flask
 app = Flask(__name__)
@@ -25,6 +26,22 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
 )
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Match each new order against its own asset's book only ('0' restores the
+# full pass over every book after each order)
+app.config['INCREMENTAL_MATCHING'] = os.environ.get('INCREMENTAL_MATCHING', '1') == '1'
+
+# Accepted-order mode: place_order only queues the order in OrderIntake and the
+# matching worker (matcher.sh) owns the books
+app.config['ASYNC_ORDER_INTAKE'] = os.environ.get('ASYNC_ORDER_INTAKE', '0') == '1'
+
+# Number of matching shard processes (matcher.sh) that own the books, split by
+# aid; 0 keeps the books inside the API process
+app.config['MATCHING_SHARDS'] = int(os.environ.get('MATCHING_SHARDS', 0))
+
+# Shard connections need their shared secret; refuse to start without it
+if app.config['MATCHING_SHARDS'] or app.config['ASYNC_ORDER_INTAKE']:
+    matching_client.require_authkey()
+
 # Initialize the database with the app
 db.init_app(app)  # Use db.init_app() to bind db to Flask app
 api = Api(app)
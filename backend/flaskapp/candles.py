@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+import numpy as np
+
+# Candle resolutions served by GET /api/assets/prices/<aid>?interval=, as
+# bucket widths in seconds; buckets are aligned to local midnight
+RESOLUTIONS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '1h': 3600,
+    '1d': 86400
+}
+
+# How long the ticker keeps candles of each resolution (None: forever)
+RETENTION = {
+    '1m': timedelta(days=1),
+    '5m': timedelta(days=7),
+    '15m': timedelta(days=31),
+    '1h': timedelta(days=366),
+    '1d': None
+}
+
+# Merges a bar, or a partial candle, into its candle. open and close follow
+# the earliest and latest bar seen, so the order bars arrive in never matters;
+# high, low and volume are plain aggregates
+CANDLE_UPDATE_SQL = """
+    ON DUPLICATE KEY UPDATE
+        open_price = IF(VALUES(open_date) < open_date, VALUES(open_price), open_price),
+        close_price = IF(VALUES(close_date) >= close_date, VALUES(close_price), close_price),
+        high = GREATEST(high, VALUES(high)),
+        low = LEAST(low, VALUES(low)),
+        volume = volume + VALUES(volume),
+        open_date = LEAST(open_date, VALUES(open_date)),
+        close_date = GREATEST(close_date, VALUES(close_date))
+"""
+
+UPSERT_CANDLES_SQL = """
+    INSERT INTO PriceCandle (aid, resolution, bucket, open_price, high, low, close_price, volume, open_date, close_date)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+""" + CANDLE_UPDATE_SQL
+
+
+def bucket_start(timestamp, resolution):
+    midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    width = timedelta(seconds=RESOLUTIONS[resolution])
+    return midnight + (timestamp - midnight) // width * width
+
+
+def candle_rows(entries):
+    # Price rows (aid, date, open, close, high, low, volume) as one partial
+    # candle per bar and resolution, in PriceCandle column order
+    rows = []
+    for resolution in RESOLUTIONS:
+        buckets = {}
+        for aid, date, open_p, close_p, high, low, volume in entries:
+            bucket = buckets.get(date)
+            if bucket is None:
+                bucket = buckets[date] = bucket_start(date, resolution)
+            rows.append((aid, resolution, bucket, open_p, high, low, close_p, volume, date, date))
+    return rows
+
+
+def aggregate_candles(aids, timestamps, bars, since=None):
+    # Roll simulated Bars (assets x steps, timestamps ascending) up into
+    # candles of every resolution with segment reductions over the time axis,
+    # one candle per asset and bucket. Candles starting before since[res]
+    # are skipped. A history split across several calls yields partial
+    # candles at the seams, which CANDLE_UPDATE_SQL merges.
+    aids = np.asarray(aids).tolist()
+    open_ = np.round(bars.open, 2)
+    close = np.round(bars.close, 2)
+    high = np.round(bars.high, 2)
+    low = np.round(bars.low, 2)
+
+    # Naive datetimes as milliseconds; whole days in this scale are local midnights
+    times = np.array(timestamps, dtype='datetime64[ms]').astype(np.int64)
+    midnights = times // 86_400_000 * 86_400_000
+
+    rows = []
+    for resolution, seconds in RESOLUTIONS.items():
+        width = seconds * 1000
+        buckets = midnights + (times - midnights) // width * width
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        ends = np.append(starts[1:], len(buckets))
+        keep = np.arange(len(starts))
+        if since is not None and since.get(resolution) is not None:
+            cutoff = np.array([since[resolution]], dtype='datetime64[ms]').astype(np.int64)[0]
+            keep = keep[buckets[starts] >= cutoff]
+        if not len(keep):
+            continue
+
+        columns = [
+            open_[:, starts].tolist(),
+            np.maximum.reduceat(high, starts, axis=1).tolist(),
+            np.minimum.reduceat(low, starts, axis=1).tolist(),
+            close[:, ends - 1].tolist(),
+            np.add.reduceat(bars.volume, starts, axis=1).tolist()
+        ]
+        bucket_dates = buckets[starts].astype('datetime64[ms]').tolist()
+        open_dates = [timestamps[i] for i in starts.tolist()]
+        close_dates = [timestamps[i - 1] for i in ends.tolist()]
+        keep = keep.tolist()
+        for row, aid in enumerate(aids):
+            o, h, l, c, v = (column[row] for column in columns)
+            rows.extend(
+                (aid, resolution, bucket_dates[j], o[j], h[j], l[j], c[j], v[j], open_dates[j], close_dates[j])
+                for j in keep
+            )
+    return rows
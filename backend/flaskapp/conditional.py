@@ -0,0 +1,86 @@
+from functools import wraps
+
+from flask import Response, make_response, request
+from sqlalchemy import text
+
+import price_cache
+from extensions import db
+
+# Route argument naming the owner of each DataVersion scope
+SCOPE_KEYS = {
+    'portfolio': 'uid',
+    'watchlists': 'uid',
+    'watchlist': 'wid'
+}
+
+# Primary key lookup of one user data set's version. Triggers bump it in the
+# writing transaction, whichever process writes, so it is never stale
+VERSION_SQL = text("SELECT version, updated FROM DataVersion WHERE scope = :scope AND id = :id")
+
+
+def data_version(scope, id):
+    # (version, last change in UTC) of one user data set; (0, None) if it
+    # has never changed
+    row = db.session.execute(VERSION_SQL, {'scope': scope, 'id': id}).fetchone()
+    return (0, None) if row is None else (row.version, price_cache.to_utc(row.updated))
+
+
+def validators(scopes, kwargs):
+    # (ETag, Last-Modified) of the state a response depends on: the price
+    # tick sequence held by the price cache for 'prices', else the version
+    # of a user data set
+    parts, modified = [], []
+    for scope in scopes:
+        if scope == 'prices':
+            version, updated = price_cache.current_tick()
+        else:
+            version, updated = data_version(scope, kwargs[SCOPE_KEYS[scope]])
+        parts.append(f"{scope}.{version}")
+        if updated is not None:
+            modified.append(updated)
+    return '-'.join(parts), max(modified, default=None)
+
+
+def is_current(etag, modified):
+    # If-None-Match wins over If-Modified-Since. Last-Modified has whole
+    # seconds, so with sub-second ticks only the ETag is exact
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and modified is not None:
+        return modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def add_validators(response, etag, modified):
+    response.set_etag(etag, weak=True)
+    if modified is not None:
+        response.last_modified = modified
+    # Cacheable, but checked with the server on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def conditional_get(*scopes):
+    """
+    For GET routes whose response depends only on the given scopes: answers
+    304 Not Modified without running the view when the client's copy is
+    current, and adds ETag and Last-Modified to a 200. Prices cost no query
+    and user data one primary key lookup per scope. The validators are taken
+    before the view runs, so a change landing meanwhile only makes a client
+    fetch again. User data versions are exact. The tick sequence is the
+    price cache's, which trails the database by up to its poll interval
+    (PRICE_CACHE_POLL_INTERVAL), so a 304 for price data can be that much
+    behind the newest tick, as the cached prices themselves are.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            etag, modified = validators(scopes, kwargs)
+            if is_current(etag, modified):
+                return add_validators(Response(status=304), etag, modified)
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                add_validators(response, etag, modified)
+            return response
+        return wrapper
+    return decorator
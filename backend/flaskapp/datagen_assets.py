@@ -1,7 +1,12 @@
+import argparse
 import mysql.connector
-import random
+import numpy as np
 from datetime import datetime, timedelta
 
+from candles import RETENTION as CANDLE_RETENTION, UPSERT_CANDLES_SQL, aggregate_candles
+import price_store
+from price_simulator import PriceSimulator, asset_volatility, bar_rows, volume_ranges
+
 # --- CONFIGURATION ---
 DB_CONFIG = {
     'host': "127.0.0.1", 
@@ -26,15 +31,17 @@ COMMODITIES = ["GOLD", "SILVER", "CRUDE OIL", "NATURAL GAS", "COPPER"]
 def get_db_connection():
     return mysql.connector.connect(**DB_CONFIG)
 
-def generate_data():
+def generate_data(hours=1, interval=10, seed=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     print("Connected to DB. Starting High-Frequency Generation...")
 
     # --- STEP 0: Clean Slate ---
-    print("Clearing existing Price and Asset data...")
+    print("Clearing existing Price, LatestPrice and Asset data...")
     cursor.execute("SET FOREIGN_KEY_CHECKS=0;")
     cursor.execute("TRUNCATE TABLE Price")
+    cursor.execute("TRUNCATE TABLE LatestPrice")
+    cursor.execute("TRUNCATE TABLE PriceCandle")
     cursor.execute("TRUNCATE TABLE Asset")
     cursor.execute("SET FOREIGN_KEY_CHECKS=1;")
     conn.commit()
@@ -56,79 +63,90 @@ def generate_data():
     
     conn.commit()
 
-    # --- STEP 2: Generate Prices (Last 1 Hour, every 10 seconds) ---
-    # 1 hour = 3600 seconds. 10 second intervals = 360 points.
-    
-    print("Generating 1 hour of history (10s intervals) for ALL assets...")
+    # --- STEP 2 & 3: Generate Prices and Bulk Insert ---
+    # Default: the last 1 hour, every 10 seconds (360 intervals, 361 bars)
+    steps = int(hours * 3600 // interval) + 1
+    print(f"Generating {hours:g} hour(s) of history ({interval:g}s intervals) for ALL assets...")
     
     # Fetch all assets (both types) from DB to get their correct auto-generated IDs
     cursor.execute("SELECT aid, name, asset_type FROM Asset")
     all_assets = cursor.fetchall()
+    aids = np.array([aid for aid, _, _ in all_assets], dtype=np.int64)
+    names = [name for _, name, _ in all_assets]
+    asset_types = [asset_type for _, _, asset_type in all_assets]
 
     # End time is NOW
     end_time = datetime.now()
     # Round to nearest 10s for cleanliness
     end_time = end_time.replace(microsecond=0, second=(end_time.second // 10) * 10)
+    start_time = end_time - timedelta(seconds=(steps - 1) * interval)
+
+    # Set base price based on type for realism
+    simulator = PriceSimulator(seed)
+    is_commodity = np.array([asset_type == 'Commodity' for asset_type in asset_types])
+    start_prices = np.where(is_commodity,
+                            simulator.rng.uniform(2000, 5000, len(aids)),
+                            simulator.rng.uniform(100, 3000, len(aids)))  # Equities
+    start_prices[[i for i, name in enumerate(names) if name == 'GOLD']] = 60000
+    start_prices[[i for i, name in enumerate(names) if name == 'SILVER']] = 7000
+
+    volume_low, volume_high = volume_ranges(asset_types)
 
-    batch_data = []
-    total_points = 360 # 1 hour / 10 seconds
-
-    for aid, name, asset_type in all_assets:
-        # Set base price based on type for realism
-        if asset_type == 'Commodity':
-            if name == 'GOLD': current_price = 60000
-            elif name == 'SILVER': current_price = 7000
-            else: current_price = random.uniform(2000, 5000)
-        else:
-            current_price = random.uniform(100, 3000) # Equities
-
-        # Generate points backwards from now
-        for i in range(total_points, -1, -1):
-            # Time point: i intervals ago
-            timestamp = end_time - timedelta(seconds=i*10)
-            
-            # Random Fluctuation (smaller for 10s intervals)
-            # Volatility per 10s should be small, e.g., 0.05% to 0.2%
-            change_percent = random.uniform(-0.001, 0.001) 
-            current_price = current_price * (1 + change_percent)
-            
-            # Create OHLC bars for the 10s interval (micro-movements)
-            open_p = current_price * (1 + random.uniform(-0.0005, 0.0005))
-            high_p = max(open_p, current_price) * (1 + random.uniform(0, 0.0005))
-            low_p = min(open_p, current_price) * (1 - random.uniform(0, 0.0005))
-            
-            # Volume
-            if asset_type == 'Commodity':
-                 vol = random.randint(10, 500)
-            else:
-                 vol = random.randint(50, 5000)
-
-            # Add to batch
-            batch_data.append((
-                aid, timestamp, 
-                round(open_p, 2), round(current_price, 2), 
-                round(high_p, 2), round(low_p, 2), 
-                vol
-            ))
-
-    # --- STEP 3: Bulk Insert ---
-    print(f"Inserting {len(batch_data)} price records...")
-    
     sql = """
         INSERT INTO Price (aid, date, open_price, close_price, high, low, volume)
         VALUES (%s, %s, %s, %s, %s, %s, %s)
     """
-    
-    # Insert in chunks of 5000
+
+    # The whole (assets x steps) history is simulated in memory-sized blocks of
+    # timesteps; each block is inserted in chunks of 5000 rows
     chunk_size = 5000
-    for i in range(0, len(batch_data), chunk_size):
-        cursor.executemany(sql, batch_data[i:i + chunk_size])
-        conn.commit()
-        print(f"   Inserted batch {i} to {i+chunk_size}...")
+    inserted = 0
+    last_rows = []
+    # The columnar price store (when PRICE_STORE_DIR is set) gets the same history
+    store = price_store.open_writer(interval)
+    if store is not None:
+        store.reset()
+    # Candles older than their resolution's retention would be deleted by the ticker
+    candle_since = {resolution: None if retention is None else end_time - retention
+                    for resolution, retention in CANDLE_RETENTION.items()}
+    for first, bars in simulator.simulate_chunks(start_prices, asset_volatility(aids), steps,
+                                                 volume_low, volume_high, interval):
+        timestamps = [start_time + timedelta(seconds=(first + i) * interval) for i in range(bars.close.shape[1])]
+        batch_data = bar_rows(aids, timestamps, bars)
+        for i in range(0, len(batch_data), chunk_size):
+            cursor.executemany(sql, batch_data[i:i + chunk_size])
+            conn.commit()
+        if store is not None:
+            store.append(timestamps, aids, np.round(bars.open, 2), np.round(bars.high, 2),
+                         np.round(bars.low, 2), np.round(bars.close, 2), bars.volume)
+        # Roll the block up into 1m..1d candles
+        candle_data = aggregate_candles(aids, timestamps, bars, candle_since)
+        for i in range(0, len(candle_data), chunk_size):
+            cursor.executemany(UPSERT_CANDLES_SQL, candle_data[i:i + chunk_size])
+            conn.commit()
+        inserted += len(batch_data)
+        print(f"   Inserted {inserted} price records...")
+        last_rows = batch_data[len(timestamps) - 1::len(timestamps)]
+
+    # Seed each asset's current quote from the newest generated bar
+    cursor.executemany("""
+        INSERT INTO LatestPrice (aid, date, open_price, close_price, high, low, volume)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            date = VALUES(date), open_price = VALUES(open_price), close_price = VALUES(close_price),
+            high = VALUES(high), low = VALUES(low), volume = VALUES(volume)
+    """, last_rows)
+    cursor.execute("UPDATE TickSequence SET seq = seq + 1 WHERE id = 1")
+    conn.commit()
 
     print("Success! Database populated with high-frequency data.")
     cursor.close()
     conn.close()
 
 if __name__ == "__main__":
-    generate_data()
+    parser = argparse.ArgumentParser(description="Create the assets and their price history.")
+    parser.add_argument('--hours', type=float, default=1, help="Hours of history to generate (default 1)")
+    parser.add_argument('--interval', type=float, default=10, help="Seconds between bars (default 10)")
+    parser.add_argument('--seed', type=int, help="Random seed, for a reproducible history")
+    args = parser.parse_args()
+    generate_data(args.hours, args.interval, args.seed)
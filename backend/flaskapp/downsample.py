@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points of the
+    series (x ascending) that keep its visual shape. The first and last
+    points are always kept; each bucket in between keeps the point forming
+    the largest triangle with the point kept before it and the average of the
+    next bucket. Each pick depends on the previous one, so buckets are walked
+    in order, but all the work inside a bucket is vectorized.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    x = x - x[0]
+    y = np.asarray(y, dtype=float)
+
+    # threshold - 2 buckets over the inner points, bounded as in the reference
+    # implementation: bucket i spans floor(i * every) + 1 up to the next
+    # bucket's start, each at least one point wide since threshold < n
+    every = (n - 2) / (threshold - 2)
+    bounds = np.minimum(np.floor(np.arange(threshold) * every).astype(np.int64) + 1, n)
+    starts, ends = bounds[:-2], bounds[1:-1]
+
+    # Bucket averages from prefix sums; a bucket's third vertex is the average
+    # of the bucket after it, which for the final bucket is the last point
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    next_starts, next_ends = bounds[1:-1], bounds[2:]
+    sizes = next_ends - next_starts
+    next_x = (sum_x[next_ends] - sum_x[next_starts]) / sizes
+    next_y = (sum_y[next_ends] - sum_y[next_starts]) / sizes
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = starts[i], ends[i]
+        # Twice the triangle area; the constant factor does not change argmax
+        area = np.abs(
+            (x[a] - next_x[i]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y[i] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import mysql.connector
+
+import price_export
+
+# Database connection setup
+# Use environment variable for host if available (e.g. "db" in Docker), else localhost
+DB_CONFIG = {
+    'host': os.environ.get('DATABASE_HOST', "127.0.0.1"),
+    'user': "root",
+    'password': "linux",
+    'database': "stock_app"
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export price history as Arrow IPC or Parquet.")
+    parser.add_argument('output', help="File to write")
+    parser.add_argument('--aids', help="Comma-separated asset ids (default: every asset)")
+    parser.add_argument('--from', dest='start', type=datetime.fromisoformat, help="Start (ISO 8601)")
+    parser.add_argument('--to', dest='end', type=datetime.fromisoformat, help="End (ISO 8601)")
+    parser.add_argument('--interval', help="Export candles of this resolution instead of raw bars")
+    parser.add_argument('--format', choices=sorted(price_export.FORMATS),
+                        help="Output format (default: from the file extension, else arrow)")
+    args = parser.parse_args()
+
+    if not price_export.available():
+        sys.exit("Price export needs pyarrow: pip install pyarrow")
+    fmt = args.format or ('parquet' if args.output.endswith('.parquet') else 'arrow')
+    aids = [int(aid) for aid in args.aids.split(',') if aid.strip()] if args.aids else None
+
+    started = time.monotonic()
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        cursor = conn.cursor()
+        rows = 0
+
+        def counted(batches):
+            nonlocal rows
+            for batch in batches:
+                rows += batch.num_rows
+                yield batch
+
+        batches = price_export.export_batches(cursor, aids, args.start, args.end, args.interval)
+        for _ in price_export.write_batches(counted(batches), args.output, fmt):
+            pass
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        conn.close()
+    print(f"Exported {rows} rows to {args.output} ({fmt}) in {time.monotonic() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import threading
+from multiprocessing.connection import Client
+
+# Shard i of the matching service listens on MATCHING_SHARD_PORT + i
+SHARD_HOST = os.environ.get('MATCHING_SHARD_HOST', '127.0.0.1')
+SHARD_PORT = int(os.environ.get('MATCHING_SHARD_PORT', 6000))
+# Shared secret of the shard connections, with no default: the protocol
+# unpickles what it receives, so only holders of the key may connect
+AUTHKEY = os.environ.get('MATCHING_SHARD_AUTHKEY', '').encode()
+
+# One persistent connection per shard per request thread
+_local = threading.local()
+
+
+class ShardError(Exception):
+    pass
+
+
+def require_authkey():
+    if not AUTHKEY:
+        raise ShardError("MATCHING_SHARD_AUTHKEY must be set to talk to the matching shards")
+
+
+def shard_for(aid, shard_count):
+    return aid % shard_count
+
+
+def shard_address(index, host=SHARD_HOST):
+    return (host, SHARD_PORT + index)
+
+
+def _connection(index):
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(index)
+    if conn is None:
+        require_authkey()
+        conn = conns[index] = Client(shard_address(index), authkey=AUTHKEY)
+    return conn
+
+
+def call(aid, shard_count, request):
+    """Send a request to the shard owning `aid` and wait for its reply."""
+    return call_shard(shard_for(aid, shard_count), request)
+
+
+def call_shard(index, request):
+    try:
+        conn = _connection(index)
+        conn.send(request)
+        reply = conn.recv()
+    except (EOFError, OSError) as e:
+        # Drop the connection; the request may or may not have been applied,
+        # so it is not retried here
+        _local.conns.pop(index, None)
+        raise ShardError(f"Matching shard {index} unavailable: {str(e)}")
+
+    if 'error' in reply:
+        raise ShardError(reply['error'])
+    return reply
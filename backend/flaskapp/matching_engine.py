@@ -0,0 +1,266 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict, namedtuple
+
+# A single execution between a resting Buy and a resting Sell.
+# Order fields are captured at fill time because the book mutates qty in place.
+Fill = namedtuple('Fill', [
+    'aid',
+    'buy_oid', 'buy_uid', 'buy_price',
+    'sell_oid', 'sell_uid', 'sell_price',
+    'qty', 'price'
+])
+
+
+class RestingOrder:
+    __slots__ = ('oid', 'uid', 'aid', 'otype', 'price', 'qty', 'date', 'time')
+
+    def __init__(self, oid, uid, aid, otype, price, qty, date=None, time=None):
+        self.oid = oid
+        self.uid = uid
+        self.aid = aid
+        self.otype = otype
+        self.price = price
+        self.qty = qty
+        self.date = date
+        self.time = time
+
+    @classmethod
+    def from_row(cls, row):
+        # Row layout matches PENDING_ORDER_COLUMNS in matching_store
+        oid, uid, aid, otype, price, qty, date, time = row
+        return cls(oid, uid, aid, otype, price, qty, date, time)
+
+
+class PriceLevel(OrderedDict):
+    """
+    FIFO queue of orders at one price, keyed by oid so a cancel can unlink an
+    order from the middle of the queue in O(1). Tracks the running total
+    quantity of the level.
+    """
+    __slots__ = ('total_qty',)
+
+    def __init__(self):
+        super().__init__()
+        self.total_qty = 0
+
+    def head(self):
+        # Oldest order at this price
+        return next(iter(self.values()))
+
+
+class BookSide:
+    """One side of a book: sorted price levels, each a FIFO queue of orders."""
+
+    def __init__(self, is_bid):
+        self.is_bid = is_bid
+        self.prices = []   # ascending
+        self.levels = {}   # price -> PriceLevel
+
+    def __len__(self):
+        return len(self.prices)
+
+    def add(self, order):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = PriceLevel()
+            insort(self.prices, order.price)
+        level[order.oid] = order
+        level.total_qty += order.qty
+
+    def best_price(self):
+        if not self.prices:
+            return None
+        return self.prices[-1] if self.is_bid else self.prices[0]
+
+    def drop_level(self, price):
+        del self.levels[price]
+        del self.prices[bisect_left(self.prices, price)]
+
+    def depth(self, levels):
+        # Best `levels` price levels, best first; touches only those levels
+        prices = self.prices[-levels:][::-1] if self.is_bid else self.prices[:levels]
+        return [(price, self.levels[price].total_qty, len(self.levels[price])) for price in prices]
+
+    def remove(self, oid, price):
+        level = self.levels.get(price)
+        if level is None:
+            return None
+        order = level.pop(oid, None)
+        if order is None:
+            return None
+        level.total_qty -= order.qty
+        if not level:
+            self.drop_level(price)
+        return order
+
+
+class OrderBook:
+    """Price-time priority book for a single asset."""
+
+    def __init__(self, aid):
+        self.aid = aid
+        self.bids = BookSide(is_bid=True)
+        self.asks = BookSide(is_bid=False)
+
+    def side(self, otype):
+        return self.bids if otype == 'Buy' else self.asks
+
+    def add(self, order):
+        self.side(order.otype).add(order)
+
+    def remove(self, oid, otype, price):
+        return self.side(otype).remove(oid, price)
+
+    def depth(self, levels):
+        return {
+            'bids': self.bids.depth(levels),
+            'asks': self.asks.depth(levels)
+        }
+
+    def is_crossed(self):
+        best_bid = self.bids.best_price()
+        best_ask = self.asks.best_price()
+        return best_bid is not None and best_ask is not None and best_bid >= best_ask
+
+    def _execute(self, buy, sell):
+        # Same economics as MatchOrders: each execution trades at the sell
+        # order's price
+        qty = min(buy.qty, sell.qty)
+        buy.qty -= qty
+        sell.qty -= qty
+        return Fill(
+            self.aid,
+            buy.oid, buy.uid, buy.price,
+            sell.oid, sell.uid, sell.price,
+            qty, sell.price
+        )
+
+    def _pop_filled(self, side, price):
+        level = side.levels[price]
+        while level and level.head().qty == 0:
+            level.popitem(last=False)
+        if not level:
+            side.drop_level(price)
+
+    def match(self):
+        # Uncross the whole book; fully filled orders leave the book
+        fills = []
+        while self.is_crossed():
+            bid_price = self.bids.best_price()
+            ask_price = self.asks.best_price()
+            bid_level = self.bids.levels[bid_price]
+            ask_level = self.asks.levels[ask_price]
+            fill = self._execute(bid_level.head(), ask_level.head())
+            bid_level.total_qty -= fill.qty
+            ask_level.total_qty -= fill.qty
+            fills.append(fill)
+            self._pop_filled(self.bids, bid_price)
+            self._pop_filled(self.asks, ask_price)
+        return fills
+
+    def submit(self, order):
+        # Incremental matching: walk only the opposite side of this book from
+        # the best price and stop at the first level that does not cross.
+        # Whatever is left of the incoming order rests in the book.
+        is_buy = order.otype == 'Buy'
+        contra = self.asks if is_buy else self.bids
+        fills = []
+        while order.qty > 0 and contra.prices:
+            price = contra.best_price()
+            if (price > order.price) if is_buy else (price < order.price):
+                break
+            level = contra.levels[price]
+            if is_buy:
+                fill = self._execute(order, level.head())
+            else:
+                fill = self._execute(level.head(), order)
+            level.total_qty -= fill.qty
+            fills.append(fill)
+            self._pop_filled(contra, price)
+
+        if order.qty > 0:
+            self.add(order)
+        return fills
+
+
+class MatchingEngine:
+    """Collection of per-asset order books."""
+
+    def __init__(self):
+        self.books = {}
+        self.orders = {}   # oid -> resting order, for O(1) cancels
+
+    def book(self, aid):
+        book = self.books.get(aid)
+        if book is None:
+            book = self.books[aid] = OrderBook(aid)
+        return book
+
+    def load(self, orders):
+        # Orders must arrive in time priority (date, time, oid) so FIFO holds
+        for order in orders:
+            self.add(order)
+
+    def add(self, order):
+        self.book(order.aid).add(order)
+        self.orders[order.oid] = order
+
+    def replace_book(self, aid, orders):
+        # Swap one asset's book for a freshly loaded one, in time priority
+        book = self.books.pop(aid, None)
+        if book is not None:
+            for side in (book.bids, book.asks):
+                for level in side.levels.values():
+                    for oid in level:
+                        self.orders.pop(oid, None)
+        self.book(aid)
+        self.load(orders)
+
+    def cancel(self, oid):
+        # Direct lookup of the order, then an O(1) unlink from its level
+        order = self.orders.pop(oid, None)
+        if order is None:
+            return None
+        return self.books[order.aid].remove(oid, order.otype, order.price)
+
+    def cancel_many(self, oids):
+        return [order for order in map(self.cancel, oids) if order is not None]
+
+    def _forget_filled(self, fills):
+        # Fully filled orders have already left their levels
+        for fill in fills:
+            for oid in (fill.buy_oid, fill.sell_oid):
+                order = self.orders.get(oid)
+                if order is not None and order.qty == 0:
+                    del self.orders[oid]
+        return fills
+
+    def submit(self, order):
+        # Match a new order against its own asset's book only
+        fills = self.book(order.aid).submit(order)
+        if order.qty > 0:
+            self.orders[order.oid] = order
+        return self._forget_filled(fills)
+
+    def depth(self, aid, levels):
+        book = self.books.get(aid)
+        if book is None:
+            return {'bids': [], 'asks': []}
+        return book.depth(levels)
+
+    def resting_orders(self):
+        # Every resting order, each price level in FIFO order, so that loading
+        # the result into an empty engine rebuilds identical books
+        for book in self.books.values():
+            for side in (book.bids, book.asks):
+                for price in side.prices:
+                    yield from side.levels[price].values()
+
+    def match(self, aids=None):
+        # Full pass across every book, the equivalent of CALL MatchOrders(),
+        # or across just the books of `aids`
+        books = self.books.values() if aids is None else [self.books[aid] for aid in aids if aid in self.books]
+        fills = []
+        for book in books:
+            fills.extend(book.match())
+        return self._forget_filled(fills)
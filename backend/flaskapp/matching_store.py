@@ -0,0 +1,636 @@
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import text, bindparam
+from matching_engine import MatchingEngine, RestingOrder
+from order_journal import OrderJournal, order_to_record
+from settlement import lock_users, settle_fills
+
+# Column order expected by RestingOrder.from_row
+PENDING_ORDER_COLUMNS = "oid, uid, aid, otype, price, qty, date, time"
+
+# Directory for the order journal and book snapshots; unset keeps the books
+# purely in memory and rebuilds them from the Orders table on restart
+JOURNAL_DIR = os.environ.get('MATCHING_JOURNAL_DIR')
+
+# Slice of the assets whose books this process owns (aid % SHARD_COUNT)
+SHARD_INDEX = 0
+SHARD_COUNT = 1
+
+# MySQL errors after which a whole unit of work is retried
+LOCK_CONFLICT_ERRORS = (1213, 1205)   # ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+DEADLOCK_RETRIES = int(os.environ.get('MATCHING_DEADLOCK_RETRIES', 3))
+
+
+class BooksLock:
+    """
+    Per-asset locks over the books. A unit of work names the aids it touches
+    and takes all of them at once, so units on different assets run in
+    parallel and two units can never each hold a lock the other waits for.
+    A unit that needs every book (aids=None) waits for the others to drain
+    and holds the books exclusively; waiting exclusive units go first.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._held = set()
+        self._exclusive = False
+        self._exclusive_waiting = 0
+
+    def acquire(self, aids):
+        with self._cond:
+            if aids is None:
+                self._exclusive_waiting += 1
+                self._cond.wait_for(lambda: not self._exclusive and not self._held)
+                self._exclusive_waiting -= 1
+                self._exclusive = True
+            else:
+                self._cond.wait_for(
+                    lambda: not self._exclusive and not self._exclusive_waiting and self._held.isdisjoint(aids)
+                )
+                self._held.update(aids)
+
+    def release(self, aids):
+        with self._cond:
+            if aids is None:
+                self._exclusive = False
+            else:
+                self._held.difference_update(aids)
+            self._cond.notify_all()
+
+
+_engine = MatchingEngine()
+_fresh_all = False   # every book has been loaded (from Orders or the journal)
+_fresh = set()       # aids loaded one by one since the last full load
+_stale = set()       # aids whose books a failed unit left untrustworthy
+_seq = None          # MatchingWatermark.seq the books reflect
+_generation = 0      # bumped whenever another writer is found to have moved the watermark
+_journal = None
+_books_lock = BooksLock()
+_commit_lock = threading.Lock()   # orders this process's watermark reads and bumps
+
+
+class StaleBooks(RuntimeError):
+    """The books may be behind the database; the unit is retried after a reload."""
+
+
+def configure_shard(index, count):
+    global SHARD_INDEX, SHARD_COUNT
+    SHARD_INDEX = index
+    SHARD_COUNT = count
+    reset_engine()
+
+
+def load_engine(session):
+    # One scan of the pending orders, in time priority, rebuilds every book
+    result = session.execute(text(f"""
+        SELECT {PENDING_ORDER_COLUMNS}
+        FROM Orders
+        WHERE status = 'Pending' AND qty > 0 AND MOD(aid, :shard_count) = :shard_index
+        ORDER BY date ASC, time ASC, oid ASC
+    """), {'shard_count': SHARD_COUNT, 'shard_index': SHARD_INDEX})
+    engine = MatchingEngine()
+    engine.load(RestingOrder.from_row(row) for row in result)
+    return engine
+
+
+def load_books(session, engine, aids):
+    # Reload just the books of `aids`, each in time priority
+    result = session.execute(text(f"""
+        SELECT {PENDING_ORDER_COLUMNS}
+        FROM Orders
+        WHERE status = 'Pending' AND qty > 0 AND aid IN :aids
+        ORDER BY date ASC, time ASC, oid ASC
+    """).bindparams(bindparam('aids', expanding=True)), {'aids': list(aids)})
+    by_aid = {aid: [] for aid in aids}
+    for row in result:
+        order = RestingOrder.from_row(row)
+        by_aid[order.aid].append(order)
+    for aid, orders in by_aid.items():
+        engine.replace_book(aid, orders)
+
+
+def fetch_order(session, oid):
+    row = session.execute(text(f"""
+        SELECT {PENDING_ORDER_COLUMNS}
+        FROM Orders
+        WHERE oid = :oid
+    """), {'oid': oid}).fetchone()
+    return RestingOrder.from_row(row) if row else None
+
+
+def refund_pending_orders(session, oids):
+    # Refund each order's open value to the fund column of its asset type and
+    # close the orders: one aggregated UPDATE plus two set-based writes however
+    # many orders there are
+    lock_users(session, [row.uid for row in session.execute(text("""
+        SELECT DISTINCT uid FROM Orders WHERE oid IN :oids
+    """).bindparams(bindparam('oids', expanding=True)), {'oids': oids})])
+    session.execute(text("""
+        UPDATE `User` u
+        JOIN (
+            SELECT o.uid,
+                   SUM(IF(a.asset_type = 'Equity', o.qty * o.price, 0)) AS equity_refund,
+                   SUM(IF(a.asset_type = 'Commodity', o.qty * o.price, 0)) AS commodity_refund
+            FROM Orders o
+            JOIN Asset a ON o.aid = a.aid
+            WHERE o.oid IN :oids
+            GROUP BY o.uid
+        ) r ON u.uid = r.uid
+        SET u.equity_funds = u.equity_funds + r.equity_refund,
+            u.commodity_funds = u.commodity_funds + r.commodity_refund
+    """).bindparams(bindparam('oids', expanding=True)), {'oids': oids})
+    # Untouched orders go away; partly filled ones keep their fills (which
+    # Transaction rows reference) and are Completed with nothing left open
+    session.execute(
+        text("DELETE FROM Orders WHERE filled_qty = 0 AND oid IN :oids").bindparams(bindparam('oids', expanding=True)),
+        {'oids': oids}
+    )
+    session.execute(
+        text("""
+            UPDATE Orders SET qty = 0, status = 'Completed' WHERE filled_qty > 0 AND oid IN :oids
+        """).bindparams(bindparam('oids', expanding=True)),
+        {'oids': oids}
+    )
+
+
+def reset_engine():
+    global _engine, _seq, _fresh_all
+    _engine = MatchingEngine()
+    _fresh_all = False
+    _fresh.clear()
+    _stale.clear()
+    _seq = None
+
+
+def invalidate(aids):
+    # Books to reload before their next use; None drops every book
+    if aids is None:
+        reset_engine()
+    else:
+        _stale.update(aids)
+        _fresh.difference_update(aids)
+
+
+def needs_load(aid):
+    return aid in _stale or not (_fresh_all or aid in _fresh)
+
+
+def is_lock_conflict(error):
+    args = getattr(getattr(error, 'orig', None), 'args', None)
+    return bool(args) and args[0] in LOCK_CONFLICT_ERRORS
+
+
+def retry_on_deadlock(func):
+    # Re-run a whole unit of work when InnoDB chose it as a deadlock victim,
+    # it timed out waiting on a row lock or another writer committed under
+    # its books; open_books has already rolled it back and marked its books
+    # for reload
+    @functools.wraps(func)
+    def wrapper(session, *args, **kwargs):
+        for attempt in range(DEADLOCK_RETRIES):
+            try:
+                return func(session, *args, **kwargs)
+            except Exception as e:
+                if attempt + 1 >= DEADLOCK_RETRIES or not (is_lock_conflict(e) or isinstance(e, StaleBooks)):
+                    raise
+                logging.warning(f"Lock conflict in {func.__name__}, retrying: {str(e)}")
+                session.rollback()
+                time.sleep(random.uniform(0, 0.02 * 2 ** attempt))
+    return wrapper
+
+
+def get_journal():
+    global _journal
+    if _journal is None and JOURNAL_DIR:
+        directory = JOURNAL_DIR
+        if SHARD_COUNT > 1:
+            directory = os.path.join(JOURNAL_DIR, f"shard-{SHARD_INDEX}")
+        _journal = OrderJournal(directory)
+    return _journal
+
+
+def read_watermark(session):
+    # One watermark row per shard (id = shard index + 1), created on first use.
+    # A plain read: the units that bump it never wait on a lock taken here
+    query = text("SELECT seq FROM MatchingWatermark WHERE id = :id")
+    seq = session.execute(query, {'id': SHARD_INDEX + 1}).scalar()
+    if seq is None:
+        session.execute(text("""
+            INSERT IGNORE INTO MatchingWatermark (id, seq) VALUES (:id, 0)
+        """), {'id': SHARD_INDEX + 1})
+        seq = session.execute(query, {'id': SHARD_INDEX + 1}).scalar() or 0
+    return seq
+
+
+def advance_watermark(session, seq):
+    # Optimistic check that nobody else committed a matching unit since the
+    # books were loaded; bumps the sequence in the unit's own transaction
+    result = session.execute(text("""
+        UPDATE MatchingWatermark SET seq = :next WHERE id = :id AND seq = :seq
+    """), {'id': SHARD_INDEX + 1, 'seq': seq, 'next': seq + 1})
+    if result.rowcount != 1:
+        raise StaleBooks("Order books are behind the database; reloading")
+    return seq + 1
+
+
+def sync_watermark(conn):
+    """
+    Compare the committed watermark with the one the books reflect. Every
+    writer that matches orders bumps it (other API workers, the matcher,
+    CALL MatchOrders()), so if it has moved the books may be behind and every
+    one of them is marked for reload; units still running on other books
+    then fail their commit check and are retried. Returns the generation of
+    the books, which a unit checks again before it commits.
+    """
+    global _seq, _fresh_all, _generation
+    with _commit_lock:
+        db_seq = read_watermark(conn)
+        if db_seq != _seq:
+            if _seq is not None:
+                logging.info(f"Order books are at seq {_seq}, database is at {db_seq}; reloading")
+                _generation += 1
+                _fresh_all = False
+                _fresh.clear()
+            _seq = db_seq
+        return _generation
+
+
+def recover_engine(session, journal):
+    # Snapshot plus journal tail, trusted only if it ends exactly at the
+    # committed watermark; otherwise fall back to a full Orders scan
+    db_seq = read_watermark(session)
+    try:
+        engine, seq = journal.recover()
+    except Exception as e:
+        logging.error(f"Order journal recovery failed: {str(e)}")
+        engine, seq = None, None
+    if engine is not None and seq == db_seq:
+        return engine, seq, False
+    if engine is not None:
+        logging.warning(f"Order journal ends at seq {seq}, database is at {db_seq}; rebuilding from Orders")
+    return load_engine(session), db_seq, True
+
+
+class BookSession:
+    """Changes made to the books inside one open_books() block."""
+
+    def __init__(self, session, engine):
+        self.session = session
+        self.engine = engine
+        self.fills = []
+        self.ops = []   # journal record of what was applied to the books
+
+    def submit(self, oid, incremental=True):
+        # In incremental mode only the opposite side of the order's own book
+        # is walked; otherwise the order rests and every book gets a full pass
+        order = fetch_order(self.session, oid)
+        if order is None:
+            return []
+        return self.submit_order(order, incremental)
+
+    def submit_batch(self, orders):
+        # Rest every order first, then one matching pass over just the books
+        # the batch touched
+        self.ops.append(['batch', [order_to_record(order) for order in orders]])
+        self.engine.load(orders)
+        fills = self.engine.match(sorted({order.aid for order in orders}))
+        self.fills.extend(fills)
+        return fills
+
+    def submit_order(self, order, incremental=True):
+        self.ops.append(['submit', order_to_record(order), incremental])
+        if incremental:
+            fills = self.engine.submit(order)
+        else:
+            self.engine.add(order)
+            fills = self.engine.match()
+        self.fills.extend(fills)
+        return fills
+
+    def cancel(self, oid):
+        self.ops.append(['cancel', oid])
+        return self.engine.cancel(oid)
+
+    def cancel_many(self, oids):
+        self.ops.append(['cancel_many', oids])
+        return self.engine.cancel_many(oids)
+
+
+def ensure_loaded(session, journal, scope):
+    """
+    Load the books a unit needs: everything for scope None, else any of the
+    scope's books not loaded yet, invalidated by a failed unit or left behind
+    by another writer. Returns (rebuilt, aids, generation), where aids None
+    means every book was rebuilt.
+    """
+    global _engine, _seq, _fresh_all
+    # Read on a fresh connection: the caller's transaction may already hold
+    # a read snapshot older than the last book commit. Books are loaded from
+    # the same snapshot as the watermark.
+    with session.get_bind().connect() as conn:
+        generation = sync_watermark(conn)
+        if scope is None:
+            if _fresh_all and not _stale:
+                conn.commit()
+                return False, None, generation
+            if journal is not None:
+                _engine, _seq, rebuilt = recover_engine(conn, journal)
+            else:
+                _engine, rebuilt = load_engine(conn), True
+            conn.commit()
+            _fresh_all = True
+            _fresh.clear()
+            _stale.clear()
+            return rebuilt, None, generation
+
+        missing = sorted(aid for aid in scope if needs_load(aid))
+        if missing:
+            load_books(conn, _engine, missing)
+        conn.commit()
+    if not missing:
+        return False, [], generation
+    _fresh.update(missing)
+    _stale.difference_update(missing)
+    return True, missing, generation
+
+
+@contextmanager
+def open_books(session, aids=None):
+    """
+    Hold the order books for one unit of work. `aids` names the books the
+    unit touches: units on different assets run in parallel, while
+    aids=None (a full matching pass) holds every book. In journal mode every
+    unit holds every book, since units share one sequence. Fills produced
+    inside the block are persisted and committed together with the caller's
+    own writes on exit. Books are loaded on first use and reloaded after a
+    failed unit or a commit by another writer (checked against the
+    MatchingWatermark, which every unit advances), so they never drift from
+    what was committed: from the snapshot and journal when
+    MATCHING_JOURNAL_DIR is set, else from Orders.
+    """
+    global _seq
+    journal = get_journal()
+    scope = None if aids is None or journal is not None else frozenset(aids)
+    _books_lock.acquire(scope)
+    try:
+        try:
+            rebuilt, rebuilt_aids, generation = ensure_loaded(session, journal, scope)
+            books = BookSession(session, _engine)
+            if rebuilt:
+                # Orders written outside the engine (seed scripts, MatchOrders
+                # callers) may have left a book crossed; settle those first
+                books.fills.extend(_engine.match(rebuilt_aids))
+
+            yield books
+
+            settle_fills(session, books.fills)
+            with _commit_lock:
+                if generation != _generation:
+                    raise StaleBooks("Order books were reloaded during the unit; retrying")
+                seq = advance_watermark(session, _seq)
+                session.commit()
+                _seq = seq
+        except Exception:
+            session.rollback()
+            invalidate(scope)
+            raise
+
+        if journal is not None:
+            try:
+                # A rebuilt book has no journal history to replay from
+                if journal.append(seq, books.ops, books.fills) or rebuilt:
+                    journal.write_snapshot(_engine, seq)
+            except Exception as e:
+                # The unit is committed; without its journal line the next
+                # recovery sees the watermark gap and rebuilds from Orders
+                logging.error(f"Failed to write order journal: {str(e)}")
+    finally:
+        _books_lock.release(scope)
+
+
+def book_depth(session, aid, levels):
+    # Aggregated price levels straight from the live book: O(levels), no
+    # query against Orders once the book is loaded, only the watermark check
+    with session.get_bind().connect() as conn:
+        sync_watermark(conn)
+        conn.commit()
+    if needs_load(aid):
+        # First use: load (and settle) the book like any other unit of work
+        with open_books(session, [aid]):
+            pass
+    scope = frozenset([aid])
+    _books_lock.acquire(scope)
+    try:
+        if needs_load(aid):
+            raise RuntimeError("Order books are being reloaded")
+        return _engine.depth(aid, levels)
+    finally:
+        _books_lock.release(scope)
+
+
+@retry_on_deadlock
+def place_order(session, uid, aid, qty, otype, incremental=True):
+    # Insert through the place_order procedure (current price) and match the
+    # new order; the insert commits together with its fills. Incremental
+    # matching only needs this asset's book, a full pass needs them all.
+    with open_books(session, [aid] if incremental else None) as books:
+        lock_users(session, [uid])
+        session.execute(text("CALL place_order(:uid, :aid, :qty, :otype)"), {
+            'uid': uid,
+            'aid': aid,
+            'qty': qty,
+            'otype': otype
+        })
+        oid = session.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+        fills = books.submit(oid, incremental)
+    return oid, fills
+
+
+def check_margins(session, orders):
+    """
+    Margin check for priced orders (dicts of uid, aid, qty, price), run
+    inside a unit that already holds the users' locks. Each user and asset
+    class must cover the total cost of its orders under the funds_status
+    rule, 100000 + funds - reserved (pending cost), read with the ledger rows
+    locked so no concurrent unit can reserve the same margin. Returns, in
+    input order, None for each order that passes, else the reason it fails.
+    """
+    aids = sorted({order['aid'] for order in orders})
+    asset_types = dict(session.execute(text("""
+        SELECT aid, asset_type FROM Asset WHERE aid IN :aids
+    """).bindparams(bindparam('aids', expanding=True)), {'aids': aids}).fetchall())
+
+    margins = {}
+    rows = session.execute(text("""
+        SELECT u.uid,
+               100000 + u.equity_funds - COALESCE(le.reserved, 0) AS equity_margin,
+               100000 + u.commodity_funds - COALESCE(lc.reserved, 0) AS commodity_margin
+        FROM `User` u
+        LEFT JOIN FundsLedger le ON le.uid = u.uid AND le.asset_type = 'Equity'
+        LEFT JOIN FundsLedger lc ON lc.uid = u.uid AND lc.asset_type = 'Commodity'
+        WHERE u.uid IN :uids
+        FOR UPDATE
+    """).bindparams(bindparam('uids', expanding=True)), {'uids': sorted({order['uid'] for order in orders})})
+    for row in rows:
+        margins[(row.uid, 'Equity')] = row.equity_margin
+        margins[(row.uid, 'Commodity')] = row.commodity_margin
+
+    keys = [(order['uid'], asset_types.get(order['aid'])) for order in orders]
+    cost = {}
+    for key, order in zip(keys, orders):
+        cost[key] = cost.get(key, 0) + order['qty'] * order['price']
+
+    errors = []
+    for key in keys:
+        if key[1] is None:
+            errors.append('Asset not found')
+        elif key not in margins:
+            errors.append('User not found')
+        elif cost[key] > margins[key]:
+            errors.append('Order exceeds available margin')
+        else:
+            errors.append(None)
+    return errors
+
+
+def insert_orders(session, orders):
+    # One multi-row INSERT of priced orders; returns them as RestingOrders
+    values = []
+    params = {}
+    for i, order in enumerate(orders):
+        values.append(f"(:uid{i}, :aid{i}, :qty{i}, :price{i}, :otype{i}, 'Pending', CURDATE(), CURTIME())")
+        for key in ('uid', 'aid', 'qty', 'price', 'otype'):
+            params[f"{key}{i}"] = order[key]
+
+    first_oid = session.execute(text(
+        "INSERT INTO Orders (uid, aid, qty, price, otype, status, date, time) VALUES "
+        + ", ".join(values)
+    ), params).lastrowid
+
+    # A single-statement insert gets consecutive ids; read the rows back
+    # to confirm before they enter the books
+    rows = session.execute(text(f"""
+        SELECT {PENDING_ORDER_COLUMNS}
+        FROM Orders
+        WHERE oid BETWEEN :first AND :last
+        ORDER BY oid
+    """), {'first': first_oid, 'last': first_oid + len(orders) - 1}).fetchall()
+    new_orders = [RestingOrder.from_row(row) for row in rows]
+    if len(new_orders) != len(orders) or any(
+        (placed.uid, placed.aid, placed.otype) != (order['uid'], order['aid'], order['otype'])
+        for placed, order in zip(new_orders, orders)
+    ):
+        raise RuntimeError("Batch insert did not receive consecutive order ids")
+    return new_orders
+
+
+@retry_on_deadlock
+def place_orders(session, orders):
+    """
+    Insert a batch of priced orders (dicts of uid, aid, qty, otype, price)
+    with one multi-row INSERT and match them in a single pass over the
+    affected books. Margin is checked in the same unit, after the users are
+    locked. Returns, in input order, the new oids (None where an order was
+    rejected) and the rejection reasons (None where it was placed), then the
+    fills.
+    """
+    with open_books(session, {order['aid'] for order in orders}) as books:
+        lock_users(session, {order['uid'] for order in orders})
+        errors = check_margins(session, orders)
+        accepted = [order for order, error in zip(orders, errors) if error is None]
+        new_orders = []
+        if accepted:
+            new_orders = insert_orders(session, accepted)
+            books.submit_batch(new_orders)
+    placed = iter(order.oid for order in new_orders)
+    oids = [next(placed) if error is None else None for error in errors]
+    return oids, errors, books.fills
+
+
+def filled_quantities(fills):
+    # Total executed quantity per order id
+    filled = {}
+    for fill in fills:
+        filled[fill.buy_oid] = filled.get(fill.buy_oid, 0) + fill.qty
+        filled[fill.sell_oid] = filled.get(fill.sell_oid, 0) + fill.qty
+    return filled
+
+
+def cancel_order(session, books, oid):
+    # Re-read the order inside the books lock: it may have filled since the
+    # caller last looked. Returns False if it is no longer pending.
+    order = session.execute(text("""
+        SELECT status, uid, qty, aid, price, otype FROM Orders WHERE oid = :oid FOR UPDATE
+    """), {'oid': oid}).fetchone()
+    if not order or order.status != 'Pending':
+        return False
+
+    refund_pending_orders(session, [oid])
+    books.cancel(oid)
+    return True
+
+
+def pending_filters(uid=None, aid=None, otype=None):
+    # WHERE clause for this shard's pending orders matching the filters
+    filters = ["status = 'Pending'", "MOD(aid, :shard_count) = :shard_index"]
+    params = {'shard_count': SHARD_COUNT, 'shard_index': SHARD_INDEX}
+    for column, value in (('uid', uid), ('aid', aid), ('otype', otype)):
+        if value is not None:
+            filters.append(f"{column} = :{column}")
+            params[column] = value
+    return " AND ".join(filters), params
+
+
+def cancel_orders(session, books, uid=None, aid=None, otype=None, aids=None):
+    """
+    Cancel every pending order in this process's books matching the given
+    filters (all of a user's orders, one asset, one side), limited to the
+    books in `aids` if given, in one set-based refund and delete. Returns
+    the cancelled oids.
+    """
+    where, params = pending_filters(uid, aid, otype)
+    query = text(f"SELECT oid FROM Orders WHERE {where} FOR UPDATE")
+    if aids is not None:
+        query = text(f"SELECT oid FROM Orders WHERE {where} AND aid IN :aids FOR UPDATE").bindparams(
+            bindparam('aids', expanding=True)
+        )
+        params['aids'] = list(aids)
+
+    # Lock the rows so none of them can fill or be cancelled underneath us
+    oids = [row.oid for row in session.execute(query, params)]
+    if oids:
+        refund_pending_orders(session, oids)
+        books.cancel_many(oids)
+    return oids
+
+
+@retry_on_deadlock
+def cancel(session, oid, aid):
+    # Cancel one pending order on asset `aid`; False if it is no longer pending
+    with open_books(session, [aid]) as books:
+        cancelled = cancel_order(session, books, oid)
+    return cancelled
+
+
+@retry_on_deadlock
+def cancel_matching(session, uid=None, aid=None, otype=None):
+    # Holds just the books involved: the one asset, or each asset the user
+    # has pending orders on right now (orders placed on other assets after
+    # this point are not part of the cancel)
+    if aid is not None:
+        aids = [aid]
+    else:
+        where, params = pending_filters(uid, aid, otype)
+        aids = [row.aid for row in session.execute(text(f"SELECT DISTINCT aid FROM Orders WHERE {where}"), params)]
+        if not aids:
+            session.rollback()
+            return []
+
+    with open_books(session, aids) as books:
+        oids = cancel_orders(session, books, uid=uid, aid=aid, otype=otype, aids=aids)
+    return oids
@@ -61,6 +61,17 @@ class Price(db.Model):
     # Relationships
     asset = db.relationship('Asset', back_populates='prices')
 
+# 4b. LatestPrice Model (each asset's most recent bar)
+class LatestPrice(db.Model):
+    __tablename__ = 'LatestPrice'
+    aid = db.Column(db.Integer, db.ForeignKey('Asset.aid'), primary_key=True)
+    date = db.Column(db.DateTime)
+    open_price = db.Column(db.Numeric(10, 2))
+    close_price = db.Column(db.Numeric(10, 2))
+    high = db.Column(db.Numeric(10, 2))
+    low = db.Column(db.Numeric(10, 2))
+    volume = db.Column(db.BigInteger)
+
 # 5. Orders Model
 class Orders(db.Model):
     __tablename__ = 'Orders'
@@ -68,7 +79,8 @@ class Orders(db.Model):
     uid = db.Column(db.Integer, db.ForeignKey('User.uid'))
     aid = db.Column(db.Integer, db.ForeignKey('Asset.aid'))  # Added Link to Asset
     price = db.Column(db.Numeric(10, 2))
-    qty = db.Column(db.Integer)
+    qty = db.Column(db.Integer)  # Quantity still open
+    filled_qty = db.Column(db.Integer, default=0)  # Executed so far; fills are in Transaction
     date = db.Column(db.Date)
     time = db.Column(db.Time)
     otype = db.Column(db.String(50))  # Buy or Sell
@@ -0,0 +1,169 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+from matching_engine import MatchingEngine, RestingOrder
+
+SNAPSHOT_FILE = 'snapshot.json'
+SEGMENT_PATTERN = 'journal-*.log'
+
+
+def order_to_record(order):
+    return [order.oid, order.uid, order.aid, order.otype, str(order.price), order.qty]
+
+
+def order_from_record(record):
+    oid, uid, aid, otype, price, qty = record
+    return RestingOrder(oid, uid, aid, otype, Decimal(price), qty)
+
+
+def apply_op(engine, op):
+    # Replays one journaled book operation; the engine is deterministic, so
+    # re-running the operations reproduces the same books and fills
+    kind = op[0]
+    if kind == 'submit':
+        order = order_from_record(op[1])
+        if op[2]:
+            engine.submit(order)
+        else:
+            engine.add(order)
+            engine.match()
+    elif kind == 'batch':
+        orders = [order_from_record(record) for record in op[1]]
+        engine.load(orders)
+        engine.match(sorted({order.aid for order in orders}))
+    elif kind == 'cancel':
+        engine.cancel(op[1])
+    elif kind == 'cancel_many':
+        engine.cancel_many(op[1])
+    else:
+        raise ValueError(f"Unknown journal operation: {kind}")
+
+
+class OrderJournal:
+    """
+    Append-only journal of committed book operations plus periodic snapshots.
+
+    Each matching unit is written after its database commit as one JSON line
+    carrying the unit's sequence number, the operations applied to the books
+    and the resulting fills. Lines are flushed immediately but fsynced in
+    groups (every fsync_interval seconds or fsync_batch units). A snapshot
+    holds the full book state at a sequence number; taking one starts a new
+    journal segment and drops the older ones, so recovery reads one snapshot
+    and a bounded journal tail.
+    """
+
+    def __init__(self, directory, fsync_interval=0.05, fsync_batch=256, snapshot_every=10000):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.snapshot_every = snapshot_every
+
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._since_snapshot = 0
+        self._io_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        # Background group commit so a quiet period never leaves lines unsynced
+        threading.Thread(target=self._sync_loop, daemon=True).start()
+
+    # --- Recovery ---
+
+    def recover(self):
+        """Return (engine, seq) rebuilt from the snapshot and journal tail, or (None, None)."""
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if not os.path.exists(snapshot_path):
+            return None, None
+
+        with open(snapshot_path) as f:
+            snapshot = json.load(f)
+        engine = MatchingEngine()
+        engine.load(order_from_record(record) for record in snapshot['orders'])
+        seq = snapshot['seq']
+
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN))):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        unit = json.loads(line)
+                    except ValueError:
+                        # Torn final write from a crash; nothing after it is valid
+                        break
+                    if unit['seq'] <= seq:
+                        continue
+                    if unit['seq'] != seq + 1:
+                        break
+                    for op in unit['ops']:
+                        apply_op(engine, op)
+                    seq = unit['seq']
+                    replayed += 1
+
+        logging.info(f"Recovered order books at seq {seq} ({replayed} journal units replayed)")
+        self._since_snapshot = replayed
+        return engine, seq
+
+    # --- Writing ---
+
+    def append(self, seq, ops, fills):
+        line = json.dumps({
+            'seq': seq,
+            'ops': ops,
+            'fills': [[f.buy_oid, f.sell_oid, f.qty, str(f.price)] for f in fills]
+        }, separators=(',', ':'))
+
+        with self._io_lock:
+            if self._file is None:
+                self._file = self._open_segment(seq)
+            self._file.write(line + '\n')
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+        self._since_snapshot += 1
+        return self._since_snapshot >= self.snapshot_every
+
+    def write_snapshot(self, engine, seq):
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp_path = snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'seq': seq,
+                'orders': [order_to_record(order) for order in engine.resting_orders()]
+            }, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+
+        # Everything up to seq is now in the snapshot; start a fresh segment
+        with self._io_lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+            for path in glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)):
+                os.remove(path)
+        self._since_snapshot = 0
+
+    def _open_segment(self, first_seq):
+        path = os.path.join(self.directory, f"journal-{first_seq:012d}.log")
+        return open(path, 'a')
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._io_lock:
+                if self._unsynced:
+                    self._sync()
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import text
+from extensions import db
+
+# Seconds between checks of the tick sequence by the background poller
+POLL_INTERVAL = float(os.environ.get('PRICE_CACHE_POLL_INTERVAL', 1))
+
+PRICES_SQL = text("""
+    SELECT a.aid, a.name, a.asset_type, lp.close_price, lp.date, lp.open_price, lp.high, lp.low, lp.volume
+    FROM Asset a
+    JOIN LatestPrice lp ON a.aid = lp.aid
+    ORDER BY a.aid
+""")
+
+SEQUENCE_SQL = text("SELECT seq FROM TickSequence WHERE id = 1")
+
+
+def to_utc(date):
+    # Naive local database time to an aware UTC datetime (None stays None)
+    return None if date is None else datetime.fromtimestamp(date.timestamp(), timezone.utc)
+
+
+class CachedPrice:
+    # price is the latest close; date to volume describe the bar it closed
+    __slots__ = ('aid', 'name', 'asset_type', 'price', 'date', 'open_price', 'high', 'low', 'volume')
+
+    def __init__(self, aid, name, asset_type, price, date, open_price, high, low, volume):
+        self.aid = aid
+        self.name = name
+        self.asset_type = asset_type
+        self.price = price
+        self.date = date
+        self.open_price = open_price
+        self.high = high
+        self.low = low
+        self.volume = volume
+
+
+class PriceCache:
+    """
+    Latest price of every asset, shared by the request handlers of this
+    process. Every writer of LatestPrice bumps TickSequence once its bars
+    are committed and in the price store; a background thread polls that one row and reloads all
+    prices in bulk only when it has moved, so handlers never query MySQL
+    for a current price between ticks. The poller is also the fan-out point
+    for streaming clients: they wait on one condition it notifies per tick.
+    """
+
+    def __init__(self):
+        self.seq = None
+        self.prices = {}   # aid -> CachedPrice, in aid order
+        self.modified = None   # date of the newest bar, UTC
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._poller = None
+
+    def refresh(self, connection):
+        # One round-trip when nothing changed, two when a tick landed
+        seq = connection.execute(SEQUENCE_SQL).scalar()
+        if seq is not None and seq == self.seq:
+            return False
+        prices = {row.aid: CachedPrice(*row) for row in connection.execute(PRICES_SQL)}
+        modified = to_utc(max((price.date for price in prices.values()), default=None))
+        # Readers take a reference to the dict, so swapping it is enough
+        with self._changed:
+            self.prices = prices
+            self.modified = modified
+            self.seq = seq
+            self._changed.notify_all()
+        return True
+
+    def wait_for_tick(self, seq, timeout):
+        # Block until the sequence moves past seq or timeout; returns the
+        # current (seq, prices) either way
+        with self._changed:
+            self._changed.wait_for(lambda: self.seq != seq, timeout)
+            return self.seq, self.prices
+
+    def _poll(self, app):
+        with app.app_context():
+            while True:
+                time.sleep(POLL_INTERVAL)
+                try:
+                    with db.engine.connect() as connection:
+                        self.refresh(connection)
+                except Exception as e:
+                    logging.error(f"Price cache refresh failed: {e}")
+
+    def ensure_loaded(self, app):
+        # First use in this process: load synchronously and start the poller
+        # (lazily, so the debug reloader's parent process never polls)
+        if self._poller is not None and self.seq is not None:
+            return
+        with self._lock:
+            if self.seq is None:
+                with db.engine.connect() as connection:
+                    self.refresh(connection)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, args=(app,), daemon=True, name='price-cache')
+                self._poller.start()
+
+
+_cache = PriceCache()
+
+
+def get_prices():
+    # Snapshot of aid -> CachedPrice; consistent for the whole request
+    _cache.ensure_loaded(current_app._get_current_object())
+    return _cache.prices
+
+
+def get_price(aid):
+    cached = get_prices().get(aid)
+    return None if cached is None else cached.price
+
+
+def current_sequence():
+    get_prices()
+    return _cache.seq
+
+
+def current_tick():
+    # (seq, date of the newest bar) of the cached prices
+    get_prices()
+    return _cache.seq, _cache.modified
+
+
+def wait_for_tick(seq, timeout):
+    # For streams, after a first get_prices() in the request has started the poller
+    return _cache.wait_for_tick(seq, timeout)
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import candles
+import price_store
+
+# pyarrow is optional: without it the export route answers 501 and the rest
+# of the app is unaffected
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Output formats and their media types
+FORMATS = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# Rows per SQL page and per written batch (a Parquet row group)
+BATCH_ROWS = 65536
+
+# Earliest date a range without ?from= starts at
+EPOCH = datetime(1970, 1, 1)
+
+ASSETS_SQL = "SELECT aid FROM Asset ORDER BY aid"
+
+# Keyset pages over the (aid, date) and (aid, resolution, bucket) keys
+PRICES_PAGE_SQL = """
+    SELECT date, open_price, high, low, close_price, volume
+    FROM Price
+    WHERE aid = %(aid)s AND date > %(after)s AND date <= %(end)s
+    ORDER BY date
+    LIMIT %(limit)s
+"""
+
+CANDLES_PAGE_SQL = """
+    SELECT bucket, open_price, high, low, close_price, volume
+    FROM PriceCandle
+    WHERE aid = %(aid)s AND resolution = %(resolution)s AND bucket > %(after)s AND bucket <= %(end)s
+    ORDER BY bucket
+    LIMIT %(limit)s
+"""
+
+
+def available():
+    return pa is not None
+
+
+def schema():
+    return pa.schema([
+        ('aid', pa.int32()),
+        ('date', pa.timestamp('ms')),
+        ('open_price', pa.float64()),
+        ('high', pa.float64()),
+        ('low', pa.float64()),
+        ('close_price', pa.float64()),
+        ('volume', pa.int64())
+    ])
+
+
+def make_batch(aid, times, open_, high, low, close, volume):
+    # times as int64 ms or datetimes; prices and volume as arrays or lists
+    return pa.RecordBatch.from_arrays([
+        pa.array(np.full(len(times), aid, dtype=np.int32)),
+        pa.array(times, type=pa.timestamp('ms')),
+        pa.array(np.asarray(open_, dtype=np.float64)),
+        pa.array(np.asarray(high, dtype=np.float64)),
+        pa.array(np.asarray(low, dtype=np.float64)),
+        pa.array(np.asarray(close, dtype=np.float64)),
+        pa.array(np.asarray(volume, dtype=np.int64))
+    ], schema=schema())
+
+
+def stored_batches(reader, aid, start, end):
+    # One asset's raw bars from the price store, or None when it holds none
+    series = reader.read_bars(aid, start=start, end=end)
+    if series is None:
+        return None
+    times, values = series
+    return [
+        make_batch(aid, times[i:i + BATCH_ROWS], *(values[column][i:i + BATCH_ROWS]
+                                                   for column in price_store.PRICE_COLUMNS + ('volume',)))
+        for i in range(0, len(times), BATCH_ROWS)
+    ]
+
+
+def sql_batches(cursor, aid, start, end, interval):
+    # One asset's bars (or candles) from the database, a page at a time
+    if interval is None:
+        sql, params = PRICES_PAGE_SQL, {'aid': aid}
+        step = timedelta(milliseconds=1)
+    else:
+        sql, params = CANDLES_PAGE_SQL, {'aid': aid, 'resolution': interval}
+        step = timedelta(seconds=1)
+    params.update(after=(start or EPOCH) - step, end=end or datetime.max, limit=BATCH_ROWS)
+    while True:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        dates, open_, high, low, close, volume = zip(*rows)
+        yield make_batch(aid, dates, open_, high, low, close, volume)
+        if len(rows) < BATCH_ROWS:
+            return
+        params['after'] = dates[-1]
+
+
+def export_batches(cursor, aids=None, start=None, end=None, interval=None):
+    """
+    OHLCV of the given assets (default: all) between start and end inclusive
+    as Arrow record batches, asset by asset in time order. Raw bars come from
+    the price store when it is enabled, else from Price; with an interval,
+    from the PriceCandle rollups. Only one page per asset is held at a time.
+    """
+    if interval is not None and interval not in candles.RESOLUTIONS:
+        raise ValueError(f"interval must be one of {', '.join(candles.RESOLUTIONS)}")
+    if aids is None:
+        cursor.execute(ASSETS_SQL)
+        aids = [row[0] for row in cursor.fetchall()]
+
+    reader = price_store.get_reader() if interval is None else None
+    for aid in aids:
+        batches = stored_batches(reader, aid, start, end) if reader is not None else None
+        if batches is None:
+            batches = sql_batches(cursor, aid, start, end, interval)
+        yield from batches
+
+
+def write_batches(batches, sink, fmt):
+    # Writes the batches to sink (a path or a writable file) in the given
+    # format, coalesced to about BATCH_ROWS rows per write; yields after each
+    # write so a caller can hand the bytes on
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema(), compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(sink, schema())
+    pending, rows = [], 0
+    with writer:
+        for batch in batches:
+            pending.append(batch)
+            rows += batch.num_rows
+            if rows >= BATCH_ROWS:
+                writer.write_table(pa.Table.from_batches(pending, schema()).combine_chunks())
+                pending, rows = [], 0
+                yield
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending, schema()).combine_chunks())
+    yield
+
+
+class ChunkSink:
+    """Write-only file that keeps what was written until taken."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream(batches, fmt):
+    # The export as byte chunks, produced while the batches are read
+    sink = ChunkSink()
+    for _ in write_batches(batches, pa.PythonFile(sink, mode='w'), fmt):
+        data = sink.take()
+        if data:
+            yield data
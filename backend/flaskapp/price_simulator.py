@@ -0,0 +1,103 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Bar length the volatility and OHLC spreads below are expressed for (seconds)
+BASE_INTERVAL = 10.0
+
+# Standard deviation of one 10 second log return; the same as the
+# uniform(-0.1%, +0.1%) step the generators used before
+BASE_VOLATILITY = 0.001 / math.sqrt(3)
+
+# Open sits within +/- SPREAD of the close; high and low reach up to SPREAD
+# beyond the body of the bar
+SPREAD = 0.0005
+
+# Volume range of one 10 second bar by asset class
+VOLUME_RANGES = {
+    'Equity': (50, 5000),
+    'Commodity': (10, 500)
+}
+
+# Upper bound on assets x steps simulated at once by simulate_chunks
+CHUNK_VALUES = 2_000_000
+
+# OHLCV arrays of shape (assets, steps), unrounded except for volume
+Bars = namedtuple('Bars', ['open', 'high', 'low', 'close', 'volume'])
+
+
+def asset_volatility(aids):
+    # Fixed per-asset volatility between 0.5x and 1.5x BASE_VOLATILITY,
+    # derived from the aid so it stays the same across runs and processes
+    aids = np.asarray(aids, dtype=np.uint64)
+    spread = (aids * np.uint64(2654435761) % np.uint64(1000)).astype(float) / 1000
+    return BASE_VOLATILITY * (0.5 + spread)
+
+
+def volume_ranges(asset_types):
+    # (low, high) arrays for a sequence of asset types
+    ranges = np.array([VOLUME_RANGES.get(asset_type, VOLUME_RANGES['Equity']) for asset_type in asset_types],
+                      dtype=np.int64).reshape(-1, 2)
+    return ranges[:, 0], ranges[:, 1]
+
+
+class PriceSimulator:
+    """
+    Geometric Brownian motion (zero drift) for many assets at once. Each call
+    produces whole (assets x steps) OHLCV arrays; the same seed replays the
+    same paths.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def simulate(self, start_prices, volatility, steps, volume_low, volume_high, interval=BASE_INTERVAL):
+        start_prices = np.asarray(start_prices, dtype=float)
+        count = len(start_prices)
+        scale = math.sqrt(interval / BASE_INTERVAL)
+        rng = self.rng
+
+        # Close: cumulative log returns from the start price; -sigma^2/2 keeps
+        # the expected price flat. Draws are float32 (ample for noise at these
+        # scales), the price path is float64
+        sigma = (np.asarray(volatility, dtype=float) * scale)[:, None]
+        returns = rng.standard_normal((count, steps), dtype=np.float32) * sigma - 0.5 * sigma ** 2
+        close = start_prices[:, None] * np.exp(np.cumsum(returns, axis=1))
+
+        def noise(low, high):
+            return rng.random((count, steps), dtype=np.float32) * ((high - low) * scale) + low * scale
+
+        open_ = close * (1 + noise(-SPREAD, SPREAD))
+        high = np.maximum(open_, close) * (1 + noise(0, SPREAD))
+        low = np.minimum(open_, close) * (1 - noise(0, SPREAD))
+
+        # Volume: uniform integers in each asset's range, growing with the bar length
+        volume_low = np.asarray(volume_low)[:, None]
+        width = np.asarray(volume_high)[:, None] - volume_low + 1
+        volume = volume_low + (rng.random((count, steps), dtype=np.float32) * width).astype(np.int64)
+        if interval != BASE_INTERVAL:
+            volume = np.maximum(1, np.rint(volume * (interval / BASE_INTERVAL))).astype(np.int64)
+
+        return Bars(open_, high, low, close, volume)
+
+    def simulate_chunks(self, start_prices, volatility, steps, volume_low, volume_high, interval=BASE_INTERVAL):
+        # Long histories in blocks of steps that fit in memory; yields
+        # (first step, Bars), each block continuing from the last close
+        prices = np.asarray(start_prices, dtype=float)
+        chunk = max(1, CHUNK_VALUES // max(1, len(prices)))
+        for first in range(0, steps, chunk):
+            bars = self.simulate(prices, volatility, min(chunk, steps - first), volume_low, volume_high, interval)
+            prices = bars.close[:, -1]
+            yield first, bars
+
+
+def bar_rows(aids, timestamps, bars):
+    # Flatten Bars into Price rows (aid, date, open, close, high, low, volume),
+    # each asset's bars in time order, prices rounded to cents
+    columns = [np.round(bars.open, 2).tolist(), np.round(bars.close, 2).tolist(),
+               np.round(bars.high, 2).tolist(), np.round(bars.low, 2).tolist(), bars.volume.tolist()]
+    rows = []
+    for i, aid in enumerate(np.asarray(aids).tolist()):
+        rows.extend(zip([aid] * len(timestamps), timestamps, *(column[i] for column in columns)))
+    return rows
@@ -0,0 +1,267 @@
+import glob
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+# Directory of the columnar price store; unset disables it and chart reads
+# go to the Price table
+STORE_DIR = os.environ.get('PRICE_STORE_DIR')
+
+SEGMENT_PATTERN = 'segment-*'
+
+# Seconds of ticks per segment; expired history is dropped a segment at a time
+SEGMENT_SECONDS = 600
+
+PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+
+# meta.i8 layout
+COUNT, ASSETS, ASSET_CAPACITY, STEP_CAPACITY = range(4)
+
+
+def to_ms(timestamps):
+    # Naive datetimes to int64 milliseconds, read back the same way
+    return np.array(timestamps, dtype='datetime64[ms]').astype(np.int64)
+
+
+class Segment:
+    """
+    One block of the store in its own directory: up to STEP_CAPACITY tick
+    times shared by up to ASSET_CAPACITY assets. Each column is an
+    (assets x steps) memory-mapped matrix, so one asset's history inside a
+    segment is a contiguous row that readers slice without copying. The
+    writer fills values first and bumps the row count in meta last, so
+    readers in other processes never see a partly written tick.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.meta = np.memmap(os.path.join(path, 'meta.i8'), dtype=np.int64, mode=mode)
+        assets, steps = int(self.meta[ASSET_CAPACITY]), int(self.meta[STEP_CAPACITY])
+        self.times = np.memmap(os.path.join(path, 'times.i8'), dtype=np.int64, mode=mode, shape=(steps,))
+        self.aids = np.memmap(os.path.join(path, 'aids.i8'), dtype=np.int64, mode=mode, shape=(assets,))
+        self.columns = {
+            name: np.memmap(os.path.join(path, f"{name}.f8"), dtype=np.float64, mode=mode, shape=(assets, steps))
+            for name in PRICE_COLUMNS
+        }
+        self.columns['volume'] = np.memmap(os.path.join(path, 'volume.i8'), dtype=np.int64, mode=mode,
+                                           shape=(assets, steps))
+        self._slots = None
+        self._slots_known = 0
+
+    @classmethod
+    def create(cls, directory, first_time, assets, steps):
+        path = os.path.join(directory, f"segment-{first_time:016d}")
+        os.makedirs(path)
+        np.memmap(os.path.join(path, 'times.i8'), dtype=np.int64, mode='w+', shape=(steps,)).flush()
+        np.memmap(os.path.join(path, 'aids.i8'), dtype=np.int64, mode='w+', shape=(assets,)).flush()
+        for name in PRICE_COLUMNS:
+            np.memmap(os.path.join(path, f"{name}.f8"), dtype=np.float64, mode='w+', shape=(assets, steps)).flush()
+        np.memmap(os.path.join(path, 'volume.i8'), dtype=np.int64, mode='w+', shape=(assets, steps)).flush()
+        # meta last: a reader skips a segment until it exists
+        meta = np.memmap(os.path.join(path, 'meta.tmp'), dtype=np.int64, mode='w+', shape=(4,))
+        meta[ASSET_CAPACITY] = assets
+        meta[STEP_CAPACITY] = steps
+        meta.flush()
+        del meta
+        os.replace(os.path.join(path, 'meta.tmp'), os.path.join(path, 'meta.i8'))
+        return cls(path, 'r+')
+
+    @property
+    def count(self):
+        return int(self.meta[COUNT])
+
+    @property
+    def free_steps(self):
+        return int(self.meta[STEP_CAPACITY]) - self.count
+
+    def last_time(self):
+        count = self.count
+        return int(self.times[count - 1]) if count else None
+
+    def slots(self):
+        # aid -> row, refreshed only when assets were added
+        known = int(self.meta[ASSETS])
+        if self._slots is None or known != self._slots_known:
+            self._slots = {aid: slot for slot, aid in enumerate(self.aids[:known].tolist())}
+            self._slots_known = known
+        return self._slots
+
+    def add_assets(self, aids):
+        # Writer only; False when the segment has no room for them
+        slots = self.slots()
+        new = [aid for aid in aids if aid not in slots]
+        known = int(self.meta[ASSETS])
+        if known + len(new) > int(self.meta[ASSET_CAPACITY]):
+            return False
+        self.aids[known:known + len(new)] = new
+        self.meta[ASSETS] = known + len(new)
+        return True
+
+    def flush(self):
+        for column in self.columns.values():
+            column.flush()
+        self.times.flush()
+        self.aids.flush()
+        self.meta.flush()
+
+
+class PriceStoreWriter:
+    """Appends ticks to the newest segment, starting a new one when it is full."""
+
+    def __init__(self, directory, steps_per_segment):
+        self.directory = directory
+        self.steps = max(1, int(steps_per_segment))
+        os.makedirs(directory, exist_ok=True)
+        paths = segment_paths(directory)
+        self.segment = Segment(paths[-1], 'r+') if paths else None
+
+    def append(self, timestamps, aids, open_, high, low, close, volume):
+        # timestamps ascending; price and volume arrays are (assets x steps)
+        # in the order of aids. Ticks not newer than the last stored one are
+        # skipped, so readers can binary search the times.
+        times = to_ms(timestamps)
+        aids = np.asarray(aids).tolist()
+        block = dict(zip(PRICE_COLUMNS + ('volume',), (open_, high, low, close, volume)))
+        last = self.segment.last_time() if self.segment is not None else None
+        first = 0 if last is None else int(np.searchsorted(times, last, side='right'))
+
+        while first < len(times):
+            segment = self.segment
+            if segment is None or segment.free_steps == 0 or not segment.add_assets(aids):
+                if segment is not None:
+                    segment.flush()
+                segment = self.segment = Segment.create(
+                    self.directory, int(times[first]), max(64, 2 * len(aids)), self.steps
+                )
+                segment.add_assets(aids)
+
+            slots = segment.slots()
+            rows = np.array([slots[aid] for aid in aids], dtype=np.int64)
+            count = segment.count
+            take = min(segment.free_steps, len(times) - first)
+            for name, values in block.items():
+                segment.columns[name][rows, count:count + take] = np.asarray(values)[:, first:first + take]
+            segment.times[count:count + take] = times[first:first + take]
+            segment.meta[COUNT] = count + take
+            first += take
+
+    def drop_before(self, cutoff):
+        # Delete whole segments whose newest tick is older than cutoff
+        cutoff = int(to_ms([cutoff])[0])
+        dropped = 0
+        for path in segment_paths(self.directory):
+            if self.segment is not None and path == self.segment.path:
+                break
+            last = Segment(path).last_time()
+            if last is not None and last >= cutoff:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            dropped += 1
+        return dropped
+
+    def reset(self):
+        self.segment = None
+        for path in glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def segment_paths(directory):
+    # Complete segments in time order (names carry the first tick time)
+    return sorted(
+        path for path in glob.glob(os.path.join(directory, SEGMENT_PATTERN))
+        if os.path.exists(os.path.join(path, 'meta.i8'))
+    )
+
+
+class PriceStoreReader:
+    """Keeps the segments mapped between reads; picks up new and dropped ones."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = {}
+        self._lock = threading.Lock()
+
+    def _current(self):
+        paths = segment_paths(self.directory)
+        with self._lock:
+            segments = {}
+            for path in paths:
+                segment = self.segments.get(path)
+                if segment is None:
+                    try:
+                        segment = Segment(path)
+                    except (OSError, ValueError) as e:
+                        logging.error(f"Skipping price store segment {path}: {e}")
+                        continue
+                segments[path] = segment
+            self.segments = segments
+        return list(segments.values())
+
+    def read(self, aid, column='close', start=None, end=None):
+        """
+        (times in ms, values) of one asset between start and end inclusive,
+        or None when the store holds nothing for it. A range inside one
+        segment is returned as views of the mapped files.
+        """
+        series = self.read_bars(aid, (column,), start, end)
+        if series is None:
+            return None
+        times, values = series
+        return times, values[column]
+
+    def read_bars(self, aid, columns=PRICE_COLUMNS + ('volume',), start=None, end=None):
+        # Like read, for several columns at once: (times in ms, {column: values})
+        start = None if start is None else int(to_ms([start])[0])
+        end = None if end is None else int(to_ms([end])[0])
+        found = False
+        times, values = [], {column: [] for column in columns}
+        for segment in self._current():
+            count = segment.count
+            slot = segment.slots().get(aid)
+            if slot is None or not count:
+                continue
+            found = True
+            segment_times = segment.times[:count]
+            if (start is not None and segment_times[-1] < start) or (end is not None and segment_times[0] > end):
+                continue
+            lo = 0 if start is None else int(np.searchsorted(segment_times, start, side='left'))
+            hi = count if end is None else int(np.searchsorted(segment_times, end, side='right'))
+            segment_times = segment_times[lo:hi]
+            segment_values = {column: segment.columns[column][slot, lo:hi] for column in columns}
+            # Ticks from before the asset joined the segment hold zero prices
+            closes = segment.columns['close'][slot, lo:hi]
+            if len(closes) and not closes.all():
+                present = closes != 0
+                segment_times = segment_times[present]
+                segment_values = {column: column_values[present] for column, column_values in segment_values.items()}
+            times.append(segment_times)
+            for column in columns:
+                values[column].append(segment_values[column])
+
+        if not found:
+            return None
+        if len(times) == 1:
+            return times[0], {column: column_values[0] for column, column_values in values.items()}
+        if not times:
+            return np.empty(0, dtype=np.int64), {column: np.empty(0) for column in columns}
+        return np.concatenate(times), {column: np.concatenate(column_values) for column, column_values in values.items()}
+
+_reader = None
+
+
+def get_reader():
+    global _reader
+    if _reader is None and STORE_DIR:
+        _reader = PriceStoreReader(STORE_DIR)
+    return _reader
+
+
+def open_writer(interval):
+    # Writer for a process ticking every `interval` seconds, or None when the
+    # store is disabled
+    if not STORE_DIR:
+        return None
+    return PriceStoreWriter(STORE_DIR, SEGMENT_SECONDS / interval)
@@ -1,28 +1,41 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
 from extensions import db  # Import db from extensions
 from sqlalchemy import text
+from datetime import datetime
+import json
+import threading
+import numpy as np
+import candles
+from conditional import conditional_get
+import matching_client
+import matching_store
+import price_cache
+import price_export
+import price_store
+from downsample import lttb
 
 # Define the blueprint
 asset_bp = Blueprint('asset_bp', __name__)
 
 # Define a route within the blueprint
 @asset_bp.route('/assets/search', methods=['GET'])
+@conditional_get('prices')
 def search_assets():
     try:
         query = request.args.get('q', '')
 
+        # Served from the price cache; no database round-trip between ticks
+        assets = price_cache.get_prices().values()
+
         # If the query is empty, fetch all assets or limit it for performance
         if not query:
-            sql_query = text("SELECT aid, name, current_price FROM AssetPriceView LIMIT 50")
-            result = db.session.execute(sql_query)
+            assets = list(assets)[:50]
         else:
-            # Raw SQL query using AssetPriceView with a LIKE clause for search
-            sql_query = text("SELECT aid, name, current_price FROM AssetPriceView WHERE name LIKE :query")
-            result = db.session.execute(sql_query, {'query': f'%{query}%'})
+            # Case-insensitive substring match, like the LIKE '%q%' it replaces
+            query = query.lower()
+            assets = [asset for asset in assets if query in asset.name.lower()]
 
-        # Fetch results and construct the response
-        assets = result.fetchall()
-        assets_list = [{'aid': row[0], 'name': row[1], 'price': row[2]} for row in assets]
+        assets_list = [{'aid': asset.aid, 'name': asset.name, 'price': asset.price} for asset in assets]
 
         return jsonify(assets_list)
 
@@ -33,15 +46,14 @@ def search_assets():
 
 # Route to get details of a single asset by aid
 @asset_bp.route('/assets/<int:aid>', methods=['GET'])
+@conditional_get('prices')
 def get_asset(aid):
     try:
-        # SQL query to fetch a single asset's details
-        sql_query = text("SELECT aid, name, current_price FROM AssetPriceView WHERE aid = :aid")
-        result = db.session.execute(sql_query, {'aid': aid})
-        asset = result.fetchone()
+        # A single asset's details, from the price cache
+        asset = price_cache.get_prices().get(aid)
 
         if asset:
-            asset_data = {'aid': asset[0], 'name': asset[1], 'price': asset[2]}
+            asset_data = {'aid': asset.aid, 'name': asset.name, 'price': asset.price}
             return jsonify(asset_data), 200
         else:
             return jsonify({'error': 'Asset not found'}), 404
@@ -50,23 +62,123 @@ def get_asset(aid):
         print(f"Error occurred while fetching asset: {str(e)}")
         return jsonify({'error': 'An error occurred while fetching the asset.'}), 500
 
-# Route to get historical prices of an asset
+def format_price_date(date):
+    # Whole-second bars keep the original format; sub-second ticks add milliseconds
+    text_date = date.strftime('%Y-%m-%d %H:%M:%S')
+    if date.microsecond:
+        text_date += f".{date.microsecond // 1000:03d}"
+    return text_date
+
+
+def parse_history_args():
+    # from / to (ISO 8601), limit and max_points of the price history routes;
+    # a ValueError carries the message for the client
+    args = {}
+    for name in ('from', 'to'):
+        value = request.args.get(name)
+        if value is not None:
+            try:
+                args[name] = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"{name} must be an ISO 8601 date and time")
+    for name, minimum in (('limit', 1), ('max_points', 3)):
+        value = request.args.get(name)
+        if value is not None:
+            if not value.isdigit() or int(value) < minimum:
+                raise ValueError(f"{name} must be an integer of at least {minimum}")
+            args[name] = int(value)
+    return args
+
+
+def fetch_history(select, date_column, params, args):
+    # One asset's series in time order, read as a range of its (aid, date)
+    # key: only [from, to], and with limit only the most recent rows. With
+    # max_points, longer series are downsampled by LTTB on the close price.
+    where = ""
+    if 'from' in args:
+        where += f" AND {date_column} >= :date_from"
+        params['date_from'] = args['from']
+    if 'to' in args:
+        where += f" AND {date_column} <= :date_to"
+        params['date_to'] = args['to']
+
+    if 'limit' in args:
+        params['limit'] = args['limit']
+        rows = db.session.execute(text(f"{select}{where} ORDER BY {date_column} DESC LIMIT :limit"), params).fetchall()
+        rows.reverse()
+    else:
+        rows = db.session.execute(text(f"{select}{where} ORDER BY {date_column} ASC"), params).fetchall()
+
+    max_points = args.get('max_points')
+    if max_points and len(rows) > max_points:
+        times = np.array([row[0] for row in rows], dtype='datetime64[ms]').astype(np.int64)
+        closes = np.array([row.close_price for row in rows], dtype=float)
+        rows = [rows[i] for i in lttb(times, closes, max_points)]
+    return rows
+
+
+def encode_prices(times, closes):
+    # JSON of [{'date', 'close_price'}, ...] built column by column, dates in
+    # the format of format_price_date
+    if not len(times):
+        return '[]'
+    dates = np.datetime_as_string(times.astype('datetime64[ms]'), unit='ms')
+    dates = np.char.replace(np.char.replace(dates, 'T', ' '), '.000', '')
+    rows = np.char.add(np.char.add('{"date": "', dates), '", "close_price": ')
+    rows = np.char.add(rows, closes.astype(str))
+    return '[' + '}, '.join(rows.tolist()) + '}]'
+
+
+def stored_history(aid, args):
+    # Raw closes from the memory-mapped price store as a JSON body: slices of
+    # the mapped columns and one encode, no SQL. None when the store is off
+    # or holds nothing for the asset.
+    reader = price_store.get_reader()
+    if reader is None:
+        return None
+    series = reader.read(aid, 'close', args.get('from'), args.get('to'))
+    if series is None:
+        return None
+    times, closes = series
+    if 'limit' in args:
+        times, closes = times[-args['limit']:], closes[-args['limit']:]
+    max_points = args.get('max_points')
+    if max_points and len(times) > max_points:
+        keep = lttb(times, closes, max_points)
+        times, closes = times[keep], closes[keep]
+    return encode_prices(times, closes)
+
+
+# Route to get historical prices of an asset: raw closes, or with
+# ?interval=1m|5m|15m|1h|1d the OHLCV candles the ticker keeps rolled up.
+# Both take ?from=&to= (ISO 8601), ?limit= (most recent rows) and
+# ?max_points= (shape-preserving downsampling)
 @asset_bp.route('/assets/prices/<int:aid>', methods=['GET'])
+@conditional_get('prices')
 def get_asset_prices(aid):
     try:
-        sql_query = text("""
+        args = parse_history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    interval = request.args.get('interval')
+    if interval is not None:
+        return get_asset_candles(aid, interval, args)
+
+    try:
+        body = stored_history(aid, args)
+        if body is not None:
+            return Response(body, mimetype='application/json'), 200
+
+        prices = fetch_history("""
             SELECT date, close_price
             FROM Price
-            WHERE aid = :aid
-            ORDER BY date ASC
-        """)
-        result = db.session.execute(sql_query, {'aid': aid})
-        prices = result.fetchall()
+            WHERE aid = :aid""", 'date', {'aid': aid}, args)
 
         # Convert SQLAlchemy result to JSON serializable format
         price_data = [
             {
-                'date': row.date.strftime('%Y-%m-%d %H:%M:%S'),
+                'date': format_price_date(row.date),
                 'close_price': float(row.close_price)
             }
             for row in prices
@@ -76,3 +188,159 @@ def get_asset_prices(aid):
     except Exception as e:
         print(f"Error fetching asset prices: {e}")
         return jsonify({'error': 'Failed to fetch asset prices'}), 500
+
+def get_asset_candles(aid, interval, args):
+    if interval not in candles.RESOLUTIONS:
+        return jsonify({'error': f"interval must be one of {', '.join(candles.RESOLUTIONS)}"}), 400
+
+    try:
+        result = fetch_history("""
+            SELECT bucket, open_price, high, low, close_price, volume
+            FROM PriceCandle
+            WHERE aid = :aid AND resolution = :resolution""", 'bucket', {'aid': aid, 'resolution': interval}, args)
+
+        candle_data = [
+            {
+                'date': format_price_date(row.bucket),
+                'open_price': float(row.open_price),
+                'high': float(row.high),
+                'low': float(row.low),
+                'close_price': float(row.close_price),
+                'volume': row.volume
+            }
+            for row in result
+        ]
+        return jsonify(candle_data), 200
+
+    except Exception as e:
+        print(f"Error fetching asset candles: {e}")
+        return jsonify({'error': 'Failed to fetch asset candles'}), 500
+
+# Bulk export of OHLCV history for ?aids=1,2,3 (default: every asset) between
+# ?from= and ?to=, raw bars or with ?interval= candles, as an Arrow IPC stream
+# (?format=arrow, the default) or a Parquet file (?format=parquet). The body
+# is written batch by batch while the history is read.
+@asset_bp.route('/assets/export', methods=['GET'])
+@conditional_get('prices')
+def export_prices():
+    if not price_export.available():
+        return jsonify({'error': 'Price export needs pyarrow, which is not installed'}), 501
+
+    fmt = request.args.get('format', 'arrow')
+    if fmt not in price_export.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(price_export.FORMATS)}"}), 400
+    interval = request.args.get('interval')
+    if interval is not None and interval not in candles.RESOLUTIONS:
+        return jsonify({'error': f"interval must be one of {', '.join(candles.RESOLUTIONS)}"}), 400
+    aids_arg = request.args.get('aids', '')
+    try:
+        aids = [int(aid) for aid in aids_arg.split(',') if aid.strip()] or None
+    except ValueError:
+        return jsonify({'error': 'aids must be a comma-separated list of asset ids'}), 400
+    try:
+        args = parse_history_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        # Raw driver cursor: the pages are read and encoded without ORM rows
+        cursor = db.session.connection().connection.cursor()
+        try:
+            batches = price_export.export_batches(cursor, aids, args.get('from'), args.get('to'), interval)
+            yield from price_export.stream(batches, fmt)
+        finally:
+            cursor.close()
+
+    filename = 'prices.parquet' if fmt == 'parquet' else 'prices.arrow'
+    return Response(stream_with_context(generate()), mimetype=price_export.FORMATS[fmt],
+                    headers={'Content-Disposition': f"attachment; filename={filename}"})
+
+# Seconds between keep-alive comments on an idle price stream
+STREAM_HEARTBEAT = 15
+
+# Latest bar of every asset as SSE-ready JSON, built once per tick and shared
+# by every stream in this process: (seq, {aid: json})
+_stream_events = (None, {})
+_stream_events_lock = threading.Lock()
+
+def stream_events(seq, prices):
+    global _stream_events
+    with _stream_events_lock:
+        if _stream_events[0] == seq:
+            return _stream_events[1]
+    events = {
+        aid: json.dumps({
+            'aid': aid,
+            'date': format_price_date(price.date),
+            'open_price': float(price.open_price),
+            'high': float(price.high),
+            'low': float(price.low),
+            'close_price': float(price.price),
+            'volume': price.volume
+        })
+        for aid, price in prices.items()
+    }
+    with _stream_events_lock:
+        if _stream_events[0] is None or seq > _stream_events[0]:
+            _stream_events = (seq, events)
+    return events
+
+# Server-Sent Events feed of the latest bar of ?aids=1,2,3 (default: every
+# asset): a snapshot on connect, then one 'prices' event per tick. Streams
+# wait on the price cache, whose poller is the only reader of the database,
+# so the load does not grow with the number of clients.
+@asset_bp.route('/stream/prices', methods=['GET'])
+def stream_prices():
+    aids_arg = request.args.get('aids', '')
+    try:
+        aids = [int(aid) for aid in aids_arg.split(',') if aid.strip()] or None
+    except ValueError:
+        return jsonify({'error': 'aids must be a comma-separated list of asset ids'}), 400
+
+    # Loads the cache and starts its poller on first use in this process
+    price_cache.get_prices()
+
+    def generate():
+        seq = None
+        while True:
+            new_seq, prices = price_cache.wait_for_tick(seq, STREAM_HEARTBEAT)
+            if new_seq == seq:
+                yield ": keep-alive\n\n"
+                continue
+            seq = new_seq
+            events = stream_events(seq, prices)
+            bars = [events[aid] for aid in (aids or events) if aid in events]
+            yield f"id: {seq}\nevent: prices\ndata: [{','.join(bars)}]\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Route to get the aggregated order book (resting liquidity) of an asset
+@asset_bp.route('/assets/<int:aid>/depth', methods=['GET'])
+def get_asset_depth(aid):
+    try:
+        levels = request.args.get('levels', 10, type=int)
+        if levels < 1:
+            return jsonify({'error': 'levels must be a positive integer'}), 400
+        levels = min(levels, 500)
+
+        # Served from the live book: the owning matching shard when the books
+        # live in the matching service, else this process
+        shard_count = current_app.config['MATCHING_SHARDS']
+        if shard_count or current_app.config['ASYNC_ORDER_INTAKE']:
+            depth = matching_client.call(aid, shard_count or 1, {'op': 'depth', 'aid': aid, 'levels': levels})
+        else:
+            depth = matching_store.book_depth(db.session, aid, levels)
+
+        def format_levels(side):
+            return [{'price': price, 'qty': qty, 'orders': count} for price, qty, count in side]
+
+        return jsonify({
+            'aid': aid,
+            'bids': format_levels(depth['bids']),
+            'asks': format_levels(depth['asks'])
+        }), 200
+
+    except Exception as e:
+        print(f"Error fetching order book depth: {e}")
+        return jsonify({'error': 'Failed to fetch order book depth'}), 500
@@ -1,7 +1,10 @@
-from flask import Blueprint, jsonify, request
-from sqlalchemy import text
+from flask import Blueprint, jsonify, request, current_app
+from sqlalchemy import text, bindparam
 from extensions import db
+import matching_client
+import matching_store
 import logging
+import time
 
 # Create the blueprint for orders-related routes
 orders_bp = Blueprint('orders_bp', __name__)
@@ -9,24 +12,33 @@ orders_bp = Blueprint('orders_bp', __name__)
 # Define the API route to get orders for a specific user
 @orders_bp.route('/orders/<int:uid>', methods=['GET'])
 def get_orders(uid):
-    # SQL query to fetch orders for the given user ID
+    # SQL query to fetch orders for the given user ID: open orders as they
+    # stand, plus one Completed entry per fill assembled from Transaction
+    # (orders track fills in place rather than as Completed copy rows). Only
+    # order rows carry an oid to cancel by; fill entries carry their tid
     sql_query = text("""
-        SELECT 
-            o.oid, 
-            o.otype, 
-            o.qty, 
-            o.price, 
-            o.status, 
-            o.date, 
-            a.name AS asset_name 
-        FROM 
-            Orders o
-        JOIN 
-            Asset a ON o.aid = a.aid 
-        WHERE 
-            o.uid = :uid
-        ORDER BY 
-            o.date DESC;
+        SELECT o.oid, NULL AS tid, o.otype, o.qty, o.price, o.status, o.date, a.name AS asset_name
+        FROM Orders o
+        JOIN Asset a ON o.aid = a.aid
+        WHERE o.uid = :uid AND (o.status = 'Pending' OR o.filled_qty = 0)
+
+        UNION ALL
+
+        SELECT NULL, t.tid, o.otype, t.qty, o.price, 'Completed', t.date, a.name
+        FROM Transaction t
+        JOIN Orders o ON o.oid = t.buy_oid
+        JOIN Asset a ON o.aid = a.aid
+        WHERE t.buy_uid = :uid AND o.filled_qty > 0
+
+        UNION ALL
+
+        SELECT NULL, t.tid, o.otype, t.qty, o.price, 'Completed', t.date, a.name
+        FROM Transaction t
+        JOIN Orders o ON o.oid = t.sell_oid
+        JOIN Asset a ON o.aid = a.aid
+        WHERE t.sell_uid = :uid AND o.filled_qty > 0
+
+        ORDER BY date DESC;
     """)
     
     # Execute the query
@@ -37,6 +49,7 @@ def get_orders(uid):
     orders_list = [
         {
             'oid': row.oid,
+            'tid': row.tid,
             'otype': row.otype,
             'qty': row.qty,
             'price': row.price,
@@ -64,26 +77,32 @@ def place_order():
         if not uid or not aid or not qty or not otype:
             return jsonify({'error': 'Missing required fields (uid, aid, qty, otype).'}), 400
 
-        # Prepare the call to the stored procedure
-        sql_query = text("CALL place_order(:uid, :aid, :qty, :otype)")
-
-        # Debugging: Print SQL query and parameters
-        print("Executing SQL:", sql_query)
-        print("With parameters:", {'uid': uid, 'aid': aid, 'qty': qty, 'otype': otype})
-        
-        # Execute the stored procedure with given parameters
-        db.session.execute(sql_query, {
-            'uid': uid,
-            'aid': aid,
-            'qty': qty,
-            'otype': otype
-        })
-
-        sql_query_match_orders = text("CALL MatchOrders()")
-        db.session.execute(sql_query_match_orders)
-        
-        # Commit the transaction
-        db.session.commit()
+        if otype not in ('Buy', 'Sell'):
+            return jsonify({'error': 'Order type must be Buy or Sell.'}), 400
+
+        # Accepted-order mode: queue the order for the matching worker and
+        # hand back a ticket the client can poll
+        if current_app.config['ASYNC_ORDER_INTAKE']:
+            return enqueue_order(uid, aid, qty, otype)
+
+        # Sharded mode: the shard owning this asset's book places and matches
+        shard_count = current_app.config['MATCHING_SHARDS']
+        if shard_count:
+            matching_client.call(aid, shard_count, {
+                'op': 'place', 'uid': uid, 'aid': aid, 'qty': qty, 'otype': otype,
+                'incremental': current_app.config['INCREMENTAL_MATCHING']
+            })
+            return jsonify({'message': 'Order placed successfully!'}), 200
+
+        # Debugging: Print parameters
+        print("Placing order with parameters:", {'uid': uid, 'aid': aid, 'qty': qty, 'otype': otype})
+
+        # CALL place_order, then match against the in-memory order books
+        # instead of CALL MatchOrders(); the insert commits with its fills
+        matching_store.place_order(
+            db.session, uid, aid, qty, otype,
+            incremental=current_app.config['INCREMENTAL_MATCHING']
+        )
 
         # Return a success response
         return jsonify({'message': 'Order placed successfully!'}), 200
@@ -101,18 +120,126 @@ def place_order():
 
 
 
+# Define the API route to place several orders in one request
+@orders_bp.route('/orders/batch', methods=['POST'])
+def place_orders_batch():
+    try:
+        data = request.get_json()
+        orders = data.get('orders') if isinstance(data, dict) else data
+        if not isinstance(orders, list) or not orders:
+            return jsonify({'error': 'Expected a non-empty list of orders.'}), 400
+
+        # Per-order results, in request order
+        results = [{'index': i, 'status': 'rejected'} for i in range(len(orders))]
+        valid = []
+        for i, order in enumerate(orders):
+            if not isinstance(order, dict) or not all(order.get(k) for k in ('uid', 'aid', 'qty', 'otype')):
+                results[i]['error'] = 'Missing required fields (uid, aid, qty, otype).'
+            elif order['otype'] not in ('Buy', 'Sell'):
+                results[i]['error'] = 'Order type must be Buy or Sell.'
+            elif not isinstance(order['qty'], int) or order['qty'] <= 0:
+                results[i]['error'] = 'Quantity must be a positive integer.'
+            else:
+                valid.append(i)
+
+        # Current prices for every asset in the batch, one query
+        aids = sorted({orders[i]['aid'] for i in valid})
+        assets = {}
+        if aids:
+            price_query = text("""
+                SELECT aid, current_price FROM AssetPriceView WHERE aid IN :aids
+            """).bindparams(bindparam('aids', expanding=True))
+            assets = {row.aid: row for row in db.session.execute(price_query, {'aids': aids})}
+
+        priced = []
+        for i in valid:
+            asset = assets.get(orders[i]['aid'])
+            if asset is None:
+                results[i]['error'] = 'Asset not found'
+            else:
+                priced.append(i)
+
+        # Margin (once per user and asset class, under the funds_status rule)
+        # is checked where the orders are placed, with the users locked: in
+        # the matching unit, the owning shard or the intake worker
+        to_place = [{
+            'uid': orders[i]['uid'],
+            'aid': orders[i]['aid'],
+            'qty': orders[i]['qty'],
+            'otype': orders[i]['otype'],
+            'price': assets[orders[i]['aid']].current_price
+        } for i in priced]
+
+        if to_place:
+            if current_app.config['ASYNC_ORDER_INTAKE']:
+                qids = enqueue_orders(to_place)
+                for i, qid in zip(priced, qids):
+                    results[i] = {'index': i, 'status': 'queued', 'order_id': qid}
+            else:
+                for i, result in zip(priced, place_priced_orders(to_place)):
+                    results[i] = {'index': i, **result}
+        else:
+            db.session.rollback()
+
+        return jsonify({'results': results}), 200
+
+    except Exception as e:
+        logging.error(f"Error placing order batch: {str(e)}")
+        return jsonify({'error': f'Failed to place orders: {str(e)}'}), 500
+
+
+def placement_results(oids, errors, filled):
+    return [
+        {'status': 'rejected', 'error': error} if error is not None
+        else {'status': 'placed', 'oid': oid, 'filled_qty': filled.get(oid, 0)}
+        for oid, error in zip(oids, errors)
+    ]
+
+
+def place_priced_orders(to_place):
+    # One multi-row insert and one matching pass per owner of the books:
+    # this process, or each matching shard for its share of the batch.
+    # Returns a result per order, in order
+    shard_count = current_app.config['MATCHING_SHARDS']
+    if not shard_count:
+        oids, errors, fills = matching_store.place_orders(db.session, to_place)
+        return placement_results(oids, errors, matching_store.filled_quantities(fills))
+
+    db.session.rollback()
+    by_shard = {}
+    for position, order in enumerate(to_place):
+        by_shard.setdefault(matching_client.shard_for(order['aid'], shard_count), []).append(position)
+
+    # Each shard commits its share on its own, so a failed shard must not
+    # hide the orders the others have already placed: its orders fail
+    # individually and the rest of the results stand
+    results = [None] * len(to_place)
+    for positions in by_shard.values():
+        shard_orders = [to_place[p] for p in positions]
+        try:
+            reply = matching_client.call(shard_orders[0]['aid'], shard_count, {'op': 'batch', 'orders': shard_orders})
+        except matching_client.ShardError as e:
+            logging.error(f"Matching shard failed on {len(positions)} batch orders: {str(e)}")
+            for position in positions:
+                results[position] = {'status': 'failed', 'error': str(e)}
+            continue
+        for position, result in zip(positions, placement_results(reply['oids'], reply['errors'], reply['filled'])):
+            results[position] = result
+    return results
+
+
 @orders_bp.route('/orders/<int:order_id>', methods=['DELETE'])
 def delete_order(order_id):
     try:
         # Check if the order exists and get its status
-        order_query = text("SELECT status, uid, qty, aid, price FROM Orders WHERE oid = :order_id")
+        order_query = text("SELECT status, uid, qty, aid, price, otype FROM Orders WHERE oid = :order_id")
         order_result = db.session.execute(order_query, {'order_id': order_id}).fetchone()
 
         if not order_result:
             return jsonify({'error': 'Order not found'}), 404
 
         # Destructure the result
-        status, uid, qty, aid, price = order_result
+        status, uid, qty, aid, price, otype = order_result
 
         # If the order is "Completed," skip fund adjustment and simply delete
         if status == "Completed":
@@ -121,29 +248,191 @@ def delete_order(order_id):
             db.session.commit()
             return jsonify({'message': 'Completed order deleted successfully'}), 200
 
-        # For pending orders, adjust the user's funds and then delete
-        # Determine the asset type and update funds accordingly
-        asset_type_query = text("SELECT asset_type FROM Asset WHERE aid = :aid")
-        asset_type = db.session.execute(asset_type_query, {'aid': aid}).scalar()
+        # In accepted-order mode the matching worker owns the books, so the
+        # cancel is queued behind any orders already waiting for it
+        if current_app.config['ASYNC_ORDER_INTAKE']:
+            qid = db.session.execute(text("""
+                INSERT INTO OrderIntake (action, uid, aid, oid)
+                VALUES ('Cancel', :uid, :aid, :oid)
+            """), {'uid': uid, 'aid': aid, 'oid': order_id}).lastrowid
+            db.session.commit()
+            return jsonify({'message': 'Cancel accepted', 'order_id': qid, 'status': 'Queued'}), 202
 
-        if asset_type == "Equity":
-            fund_update_query = text("UPDATE `User` SET equity_funds = equity_funds + :amount WHERE uid = :uid")
-        elif asset_type == "Commodity":
-            fund_update_query = text("UPDATE `User` SET commodity_funds = commodity_funds + :amount WHERE uid = :uid")
+        # For pending orders, adjust the user's funds, delete the order and
+        # drop it from its in-memory book (held by the owning shard if sharded)
+        shard_count = current_app.config['MATCHING_SHARDS']
+        if shard_count:
+            cancelled = matching_client.call(aid, shard_count, {'op': 'cancel', 'oid': order_id, 'aid': aid})['cancelled']
         else:
-            raise ValueError("Invalid asset type")
-
-        # Calculate the total amount for the funds adjustment
-        amount = qty * price
-        db.session.execute(fund_update_query, {'amount': amount, 'uid': uid})
+            cancelled = matching_store.cancel(db.session, order_id, aid)
 
-        # Delete the order after updating funds
-        delete_query = text("DELETE FROM Orders WHERE oid = :order_id")
-        db.session.execute(delete_query, {'order_id': order_id})
-        db.session.commit()
+        if not cancelled:
+            return jsonify({'error': 'Order is no longer pending'}), 409
 
         return jsonify({'message': 'Order deleted successfully'}), 200
 
     except Exception as e:
         # Detailed logging of the exception for troubleshooting
         return jsonify({'error': f"Failed to delete order: {str(e)}"}), 500
+
+
+# Define the API route to cancel pending orders in bulk, e.g.
+# DELETE /api/orders?uid=3&aid=12&otype=Buy
+@orders_bp.route('/orders', methods=['DELETE'])
+def cancel_orders():
+    uid = request.args.get('uid', type=int)
+    aid = request.args.get('aid', type=int)
+    otype = request.args.get('otype')
+
+    if uid is None and aid is None:
+        return jsonify({'error': 'At least one of uid or aid is required'}), 400
+    if otype is not None and otype not in ('Buy', 'Sell'):
+        return jsonify({'error': 'Invalid order type'}), 400
+
+    return bulk_cancel(uid, aid, otype)
+
+
+# Define the API route to cancel all pending orders of a user
+@orders_bp.route('/orders/user/<int:uid>', methods=['DELETE'])
+def cancel_user_orders(uid):
+    return bulk_cancel(uid, None, None)
+
+
+def bulk_cancel(uid, aid, otype):
+    try:
+        filters = ["status = 'Pending'"]
+        params = {}
+        for column, value in (('uid', uid), ('aid', aid), ('otype', otype)):
+            if value is not None:
+                filters.append(f"{column} = :{column}")
+                params[column] = value
+
+        # In accepted-order mode queue one cancel per matching order with a
+        # single INSERT ... SELECT; the worker applies them in arrival order
+        if current_app.config['ASYNC_ORDER_INTAKE']:
+            queued = db.session.execute(text(f"""
+                INSERT INTO OrderIntake (action, uid, aid, oid)
+                SELECT 'Cancel', uid, aid, oid FROM Orders WHERE {' AND '.join(filters)}
+            """), params).rowcount
+            db.session.commit()
+            return jsonify({'message': 'Cancels accepted', 'queued': queued, 'status': 'Queued'}), 202
+
+        # Otherwise one refund and delete per owner of the books: this
+        # process, the shard owning `aid`, or every shard for a user-wide cancel
+        shard_count = current_app.config['MATCHING_SHARDS']
+        if not shard_count:
+            oids = matching_store.cancel_matching(db.session, uid=uid, aid=aid, otype=otype)
+        else:
+            db.session.rollback()
+            request_body = {'op': 'cancel_many', 'uid': uid, 'aid': aid, 'otype': otype}
+            if aid is not None:
+                oids = matching_client.call(aid, shard_count, request_body)['oids']
+            else:
+                oids = []
+                for index in range(shard_count):
+                    oids.extend(matching_client.call_shard(index, request_body)['oids'])
+
+        return jsonify({'message': f'{len(oids)} orders cancelled', 'cancelled': sorted(oids)}), 200
+
+    except Exception as e:
+        logging.error(f"Error cancelling orders: {str(e)}")
+        return jsonify({'error': f"Failed to cancel orders: {str(e)}"}), 500
+
+
+def enqueue_order(uid, aid, qty, otype):
+    # Validate against current data, then durably queue the order at the
+    # current price (the same price CALL place_order would have used)
+    user_exists = db.session.execute(text("SELECT uid FROM `User` WHERE uid = :uid"), {'uid': uid}).fetchone()
+    if not user_exists:
+        return jsonify({'error': 'User not found'}), 404
+
+    price = db.session.execute(
+        text("SELECT current_price FROM AssetPriceView WHERE aid = :aid LIMIT 1"),
+        {'aid': aid}
+    ).scalar()
+    if price is None:
+        return jsonify({'error': 'Asset not found'}), 404
+
+    qid = db.session.execute(text("""
+        INSERT INTO OrderIntake (action, uid, aid, qty, otype, price)
+        VALUES ('Place', :uid, :aid, :qty, :otype, :price)
+    """), {'uid': uid, 'aid': aid, 'qty': qty, 'otype': otype, 'price': price}).lastrowid
+    db.session.commit()
+
+    return jsonify({'message': 'Order accepted', 'order_id': qid, 'status': 'Queued'}), 202
+
+
+def enqueue_orders(to_place):
+    # One multi-row insert into the intake queue; returns the queue ids
+    values = []
+    params = {}
+    for i, order in enumerate(to_place):
+        values.append(f"('Place', :uid{i}, :aid{i}, :qty{i}, :otype{i}, :price{i})")
+        for key in ('uid', 'aid', 'qty', 'otype', 'price'):
+            params[f"{key}{i}"] = order[key]
+
+    first_qid = db.session.execute(text(
+        "INSERT INTO OrderIntake (action, uid, aid, qty, otype, price) VALUES " + ", ".join(values)
+    ), params).lastrowid
+
+    # A single-statement insert gets consecutive ids; confirm before handing them out
+    rows = db.session.execute(text("""
+        SELECT qid, uid, aid, otype FROM OrderIntake WHERE qid BETWEEN :first AND :last ORDER BY qid
+    """), {'first': first_qid, 'last': first_qid + len(to_place) - 1}).fetchall()
+    if [(row.uid, row.aid, row.otype) for row in rows] != [(o['uid'], o['aid'], o['otype']) for o in to_place]:
+        raise RuntimeError("Batch insert did not receive consecutive queue ids")
+
+    db.session.commit()
+    return [row.qid for row in rows]
+
+
+def fetch_intake_status(order_id):
+    return db.session.execute(text("""
+        SELECT qid, action, oid, aid, otype, qty, price, status, filled_qty, error
+        FROM OrderIntake
+        WHERE qid = :qid
+    """), {'qid': order_id}).fetchone()
+
+
+# Define the API route to check on an accepted (queued) order
+@orders_bp.route('/orders/status/<int:order_id>', methods=['GET'])
+def get_order_status(order_id):
+    try:
+        # ?wait=N long-polls for up to N seconds until the status or the
+        # filled quantity moves past what the client already has
+        wait = min(request.args.get('wait', 0, type=float), 30)
+        known_status = request.args.get('status')
+        known_filled = request.args.get('filled_qty', type=int)
+
+        row = fetch_intake_status(order_id)
+        if not row:
+            return jsonify({'error': 'Order not found'}), 404
+
+        deadline = time.monotonic() + wait
+        while (
+            time.monotonic() < deadline
+            and row.status in ('Queued', 'Pending')
+            and (known_status is None or row.status == known_status)
+            and (known_filled is None or row.filled_qty == known_filled)
+        ):
+            time.sleep(0.25)
+            # End the read transaction so the next query sees the worker's commits
+            db.session.rollback()
+            row = fetch_intake_status(order_id)
+
+        return jsonify({
+            'order_id': row.qid,
+            'action': row.action,
+            'oid': row.oid,
+            'aid': row.aid,
+            'otype': row.otype,
+            'qty': row.qty,
+            'price': row.price,
+            'status': row.status,
+            'filled_qty': row.filled_qty,
+            'error': row.error
+        }), 200
+
+    except Exception as e:
+        logging.error(f"Error fetching order status: {str(e)}")
+        return jsonify({'error': f'Failed to fetch order status: {str(e)}'}), 500
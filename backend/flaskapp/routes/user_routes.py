@@ -2,71 +2,16 @@ from flask import Blueprint, jsonify, request, abort
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import text
 from extensions import db
+import updateprices_catchup
 
-from datetime import datetime, timedelta
-import random
-from decimal import Decimal
+from datetime import datetime
 
 def update_prices_to_today():
+    # Daily bars for every asset from its latest price up to now, generated
+    # in parallel and bulk-written by the backfill engine
     today = datetime.now().date()
-
-    # Fetch all assets with their latest price details
-    result = db.session.execute("""
-        SELECT p.aid, p.date, p.close_price, p.high, p.low
-        FROM Price p
-        INNER JOIN (
-            SELECT aid, MAX(date) AS latest_date
-            FROM Price
-            GROUP BY aid
-        ) latest
-        ON p.aid = latest.aid AND p.date = latest.latest_date
-    """)
-    asset_prices = result.fetchall()
-
-    updates = []
-    for aid, latest_date, close_price, high, low in asset_prices:
-        latest_date = latest_date.date()
-        close_price = Decimal(close_price)
-        high = Decimal(high)
-        low = Decimal(low)
-
-        # If prices are already up to date, skip
-        if latest_date >= today:
-            continue
-
-        # Update prices for missing dates
-        current_date = latest_date + timedelta(days=1)
-        while current_date <= today:
-            percent_change = Decimal(random.uniform(-0.02, 0.02))  # +/- 2% change
-            new_close_price = round(close_price * (1 + percent_change), 2)
-            new_high = round(max(new_close_price, high * (1 + abs(percent_change))), 2)
-            new_low = round(min(new_close_price, low * (1 - abs(percent_change))), 2)
-            new_open_price = round((new_high + new_low) / 2, 2)
-            new_volume = random.randint(50000, 1000000)
-
-            updates.append((aid, current_date, new_open_price, new_close_price, new_high, new_low, new_volume))
-
-            # Prepare for the next day's data
-            close_price, high, low = new_close_price, new_high, new_low
-            current_date += timedelta(days=1)
-
-    # Insert updated prices into the database
-    for update in updates:
-        db.session.execute("""
-            INSERT INTO Price (aid, date, open_price, close_price, high, low, volume)
-            VALUES (:aid, :date, :open_price, :close_price, :high, :low, :volume)
-        """, {
-            'aid': update[0],
-            'date': update[1],
-            'open_price': update[2],
-            'close_price': update[3],
-            'high': update[4],
-            'low': update[5],
-            'volume': update[6],
-        })
-
-    db.session.commit()
-    print(f"Updated prices for {len(updates)} entries up to {today}.")
+    bars = updateprices_catchup.backfill(datetime.now(), 86400)
+    print(f"Updated prices for {bars} entries up to {today}.")
 
 
 user_bp = Blueprint('user_bp', __name__)
@@ -330,43 +275,29 @@ def update_password(uid):
 @user_bp.route('/api/user/<int:uid>/funds_status', methods=['GET'])
 def get_funds_status(uid):
     try:
-        # Call the GetTotalPendingCostEquity function to get total pending cost for equity orders
-        result_equity = db.session.execute(text(""" 
-            SELECT GetTotalPendingCostEquity(:uid) AS total_pending_cost_equity; 
-        """), {'uid': uid})
-
-        # Call the GetTotalPendingCostCommodity function to get total pending cost for commodity orders
-        result_commodity = db.session.execute(text(""" 
-            SELECT GetTotalPendingCostCommodity(:uid) AS total_pending_cost_commodity; 
-        """), {'uid': uid})
-
-        # Call the GetTotalCostEquity function to get total cost for equity orders
-        result_total_cost_equity = db.session.execute(text(""" 
-            SELECT GetTotalCostEquity(:uid) AS total_cost_equity; 
-        """), {'uid': uid})
-
-        # Call the GetTotalCostCommodity function to get total cost for commodity orders
-        result_total_cost_commodity = db.session.execute(text(""" 
-            SELECT GetTotalCostCommodity(:uid) AS total_cost_commodity; 
-        """), {'uid': uid})
-
-        # Retrieve the results from each query
-        total_pending_cost_equity = result_equity.fetchone()[0]
-        total_pending_cost_commodity = result_commodity.fetchone()[0]
-        total_cost_equity = result_total_cost_equity.fetchone()[0]
-        total_cost_commodity = result_total_cost_commodity.fetchone()[0]
-
-        # Fetch the equity funds available for the user
-        result_equity_funds = db.session.execute(text("""
-            SELECT equity_funds FROM `User` WHERE uid = :uid
-        """), {'uid': uid})
-        equity_funds = result_equity_funds.fetchone()[0]
-
-        # Fetch the commodity funds available for the user
-        result_commodity_funds = db.session.execute(text("""
-            SELECT commodity_funds FROM `User` WHERE uid = :uid
-        """), {'uid': uid})
-        commodity_funds = result_commodity_funds.fetchone()[0]
+        # Funds and the per-asset-class ledger rows in one primary key lookup;
+        # the ledger is kept current by the Orders triggers
+        funds = db.session.execute(text("""
+            SELECT u.equity_funds,
+                   u.commodity_funds,
+                   COALESCE(le.reserved, 0) AS total_pending_cost_equity,
+                   COALESCE(lc.reserved, 0) AS total_pending_cost_commodity,
+                   COALESCE(le.spent, 0) AS total_cost_equity,
+                   COALESCE(lc.spent, 0) AS total_cost_commodity
+            FROM `User` u
+            LEFT JOIN FundsLedger le ON le.uid = u.uid AND le.asset_type = 'Equity'
+            LEFT JOIN FundsLedger lc ON lc.uid = u.uid AND lc.asset_type = 'Commodity'
+            WHERE u.uid = :uid
+        """), {'uid': uid}).fetchone()
+        if not funds:
+            return jsonify({'error': 'User not found'}), 404
+
+        equity_funds = funds.equity_funds
+        commodity_funds = funds.commodity_funds
+        total_pending_cost_equity = funds.total_pending_cost_equity
+        total_pending_cost_commodity = funds.total_pending_cost_commodity
+        total_cost_equity = funds.total_cost_equity
+        total_cost_commodity = funds.total_cost_commodity
 
         # Calculate available margin for equity and commodity
         available_margin_equity = 100000 + equity_funds - total_pending_cost_equity
@@ -1,12 +1,15 @@
 from flask import Blueprint, jsonify, request
 from sqlalchemy import text
 from models import db
+import price_cache
+from conditional import conditional_get
 
 # Blueprint setup for asset-related routes
 watchlist_bp = Blueprint('watchlist', __name__)
 
 # Fetch all watchlists for a specific user
 @watchlist_bp.route('/watchlists/<int:uid>', methods=['GET'])
+@conditional_get('watchlists')
 def get_watchlists(uid):
     try:
         sql_query = text("""
@@ -29,24 +32,26 @@ def get_watchlists(uid):
 
 # Fetch assets in a specific watchlist
 @watchlist_bp.route('/watchlists/<int:wid>/assets', methods=['GET'])
+@conditional_get('prices', 'watchlist')
 def get_watchlist_assets(wid):
     try:
         sql_query = text("""
-            SELECT a.aid, a.name, apv.current_price
-            FROM Watchlist_Asset wa
-            JOIN Asset a ON wa.aid = a.aid
-            JOIN AssetPriceView apv ON wa.aid = apv.aid
-            WHERE wa.wid = :wid
+            SELECT aid
+            FROM Watchlist_Asset
+            WHERE wid = :wid
         """)
         result = db.session.execute(sql_query, {'wid': wid})
-        assets = result.fetchall()
+
+        # Names and prices come from the price cache
+        prices = price_cache.get_prices()
+        assets = [prices[row.aid] for row in result if row.aid in prices]
 
         if not assets:
             return jsonify([])
 
         return jsonify([
-            {'aid': row.aid, 'name': row.name, 'current_price': row.current_price}
-            for row in assets
+            {'aid': asset.aid, 'name': asset.name, 'current_price': asset.price}
+            for asset in assets
         ])
 
     except Exception as e:
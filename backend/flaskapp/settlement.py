@@ -0,0 +1,142 @@
+from sqlalchemy import text, bindparam
+
+
+def rows_table(alias, columns, rows):
+    """
+    Inline a list of row tuples as a derived table, (SELECT ... UNION ALL
+    SELECT ...) AS alias, for set-based joins. Returns (sql, params).
+    """
+    selects = []
+    params = {}
+    for i, row in enumerate(rows):
+        fields = []
+        for column, value in zip(columns, row):
+            key = f"{alias}_{column}{i}"
+            params[key] = value
+            fields.append(f":{key} AS {column}" if i == 0 else f":{key}")
+        selects.append("SELECT " + ", ".join(fields))
+    return "(" + " UNION ALL ".join(selects) + f") AS {alias}", params
+
+
+def lock_users(session, uids):
+    # Take the User row locks a unit needs in ascending uid order, before any
+    # write that would otherwise take them piecemeal, so units on different
+    # assets sharing users queue instead of deadlocking
+    if uids:
+        session.execute(text("""
+            SELECT uid FROM `User` WHERE uid IN :uids ORDER BY uid FOR UPDATE
+        """).bindparams(bindparam('uids', expanding=True)), {'uids': sorted(set(uids))})
+
+
+def net_fills(fills):
+    """
+    Net a matching pass down to one delta per key:
+      positions: (uid, aid) -> [buy_qty, buy_cost, sell_qty, sell_price]
+      funds:     (uid, aid) -> cash delta (buyer pays, seller receives)
+      filled:    original oid -> executed qty
+    """
+    positions = {}
+    funds = {}
+    filled = {}
+    for fill in fills:
+        value = fill.qty * fill.price
+
+        buyer = positions.setdefault((fill.buy_uid, fill.aid), [0, 0, 0, None])
+        buyer[0] += fill.qty
+        buyer[1] += fill.qty * fill.buy_price
+        seller = positions.setdefault((fill.sell_uid, fill.aid), [0, 0, 0, None])
+        seller[2] += fill.qty
+        seller[3] = fill.sell_price
+
+        funds[(fill.buy_uid, fill.aid)] = funds.get((fill.buy_uid, fill.aid), 0) - value
+        funds[(fill.sell_uid, fill.aid)] = funds.get((fill.sell_uid, fill.aid), 0) + value
+
+        filled[fill.buy_oid] = filled.get(fill.buy_oid, 0) + fill.qty
+        filled[fill.sell_oid] = filled.get(fill.sell_oid, 0) + fill.qty
+    return positions, funds, filled
+
+
+def settle_fills(session, fills):
+    """
+    Settlement stage for one matching pass. Applies the same row effects as
+    MatchOrders(): one Transaction row per fill, portfolio positions, funds
+    and the open/filled qty of the orders that traded. Positions and funds
+    are netted per user and asset first, so a pass costs a fixed handful of
+    statements however many fills it produced.
+    """
+    if not fills:
+        return
+
+    lock_users(session, {fill.buy_uid for fill in fills} | {fill.sell_uid for fill in fills})
+
+    # Record Transactions against the orders that traded
+    values = []
+    params = {}
+    for i, fill in enumerate(fills):
+        values.append(f"(CURDATE(), :buy_oid{i}, :sell_oid{i}, :buy_uid{i}, :sell_uid{i}, :price{i}, :qty{i})")
+        params.update({
+            f"buy_oid{i}": fill.buy_oid, f"sell_oid{i}": fill.sell_oid,
+            f"buy_uid{i}": fill.buy_uid, f"sell_uid{i}": fill.sell_uid,
+            f"price{i}": fill.price, f"qty{i}": fill.qty
+        })
+    session.execute(text(
+        "INSERT INTO Transaction (date, buy_oid, sell_oid, buy_uid, sell_uid, price, qty) VALUES "
+        + ", ".join(values)
+    ), params)
+
+    positions, funds, filled = net_fills(fills)
+
+    # Update Portfolios: buys move the average price as MatchOrders does,
+    # sells only reduce the quantity
+    table, params = rows_table(
+        's', ('uid', 'aid', 'buy_qty', 'buy_cost', 'sell_qty', 'sell_price'),
+        [key + tuple(delta) for key, delta in positions.items()]
+    )
+    session.execute(text(f"""
+        INSERT INTO Portfolio_Asset (pid, aid, qty, buy_price)
+        SELECT p.pid, s.aid, s.buy_qty - s.sell_qty, IF(s.buy_qty > 0, s.buy_cost / s.buy_qty, s.sell_price)
+        FROM {table}
+        JOIN Portfolio p ON p.uid = s.uid
+        ON DUPLICATE KEY UPDATE
+            buy_price = IF(s.buy_qty > 0,
+                ((Portfolio_Asset.buy_price * Portfolio_Asset.qty) + s.buy_cost) / (Portfolio_Asset.qty + s.buy_qty),
+                Portfolio_Asset.buy_price),
+            qty = Portfolio_Asset.qty + s.buy_qty - s.sell_qty
+    """), params)
+
+    # Move funds: one update per user, netted by asset class
+    table, params = rows_table('d', ('uid', 'aid', 'amount'), [key + (amount,) for key, amount in funds.items()])
+    session.execute(text(f"""
+        UPDATE `User` u
+        JOIN (
+            SELECT d.uid,
+                   SUM(IF(a.asset_type = 'Equity', d.amount, 0)) AS equity_delta,
+                   SUM(IF(a.asset_type = 'Commodity', d.amount, 0)) AS commodity_delta
+            FROM {table}
+            JOIN Asset a ON a.aid = d.aid
+            GROUP BY d.uid
+        ) r ON r.uid = u.uid
+        SET u.equity_funds = u.equity_funds + r.equity_delta,
+            u.commodity_funds = u.commodity_funds + r.commodity_delta
+    """), params)
+
+    # Track the fills on the orders; those with nothing left open are
+    # Completed in place. Every filled order must still have the quantity the
+    # books traded against: a missing or short row means the books drifted
+    # from Orders, so fail the unit (rolling it back and reloading the books)
+    # rather than drive a quantity negative
+    table, params = rows_table('f', ('oid', 'qty'), list(filled.items()))
+    result = session.execute(text(f"""
+        UPDATE Orders o
+        JOIN {table} ON f.oid = o.oid
+        SET o.qty = o.qty - f.qty,
+            o.filled_qty = o.filled_qty + f.qty
+        WHERE o.qty >= f.qty
+    """), params)
+    if result.rowcount != len(filled):
+        raise RuntimeError(
+            f"Fills touched {result.rowcount} of {len(filled)} orders; order books are behind the database"
+        )
+    session.execute(text("""
+        UPDATE Orders SET status = 'Completed' WHERE qty = 0 AND status = 'Pending' AND oid IN :oids
+    """).bindparams(bindparam('oids', expanding=True)), {'oids': list(filled)})
@@ -1,107 +1,506 @@
+import argparse
+import logging
 import mysql.connector
-import random
+import numpy as np
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
 import os
 
+import price_store
+from candles import RETENTION as CANDLE_RETENTION, UPSERT_CANDLES_SQL, aggregate_candles, candle_rows
+from price_simulator import BASE_INTERVAL, Bars, PriceSimulator, asset_volatility, bar_rows, volume_ranges
+
 # Database connection setup
 # Use environment variable for host if available (e.g. "db" in Docker), else localhost
 DB_CONFIG = {
-    'host': os.environ.get('DATABASE_HOST', "127.0.0.1"), 
+    'host': os.environ.get('DATABASE_HOST', "127.0.0.1"),
     'user': "root",
-    'password': "linux", 
+    'password': "linux",
     'database': "stock_app"
 }
 
+# Seconds between ticks (sub-second values are fine; Price.date keeps milliseconds)
+TICK_INTERVAL = float(os.environ.get('TICK_INTERVAL', 10))
+
+# Keep slightly more than 60 minutes of history
+RETENTION = timedelta(minutes=65)
+
+# The resident ticker rolls the Price partitions and re-reads the latest
+# prices this often (seconds) instead of on every tick
+MAINTENANCE_INTERVAL = float(os.environ.get('TICK_MAINTENANCE_INTERVAL', 60))
+
+# Width of one Price partition; expired history is dropped a partition at a
+# time, so rows outlive RETENTION by up to this much
+PARTITION_WIDTH = timedelta(minutes=int(os.environ.get('PRICE_PARTITION_MINUTES', 5)))
+
+# Partitions are created this far ahead of the clock
+PARTITION_LEAD = timedelta(minutes=30)
+
+# Processes a backfill spreads its assets over; jobs smaller than
+# BACKFILL_POOL_MIN bars run in the calling process
+BACKFILL_WORKERS = int(os.environ.get('PRICE_BACKFILL_WORKERS', os.cpu_count() or 1))
+BACKFILL_POOL_MIN = 200_000
+
+# Rows per multi-row INSERT
+INSERT_CHUNK = 5000
+
+# Seconds between attempts of a failed start-up backfill
+BACKFILL_RETRY_DELAY = 5
+
 def get_db_connection():
     return mysql.connector.connect(**DB_CONFIG)
 
-def tick():
+INSERT_PRICE_SQL = """
+    INSERT INTO Price (aid, date, open_price, close_price, high, low, volume)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Moves each asset's LatestPrice row forward; an older bar never replaces a newer one
+UPSERT_LATEST_SQL = """
+    INSERT INTO LatestPrice (aid, date, open_price, close_price, high, low, volume)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        open_price = IF(VALUES(date) >= date, VALUES(open_price), open_price),
+        close_price = IF(VALUES(date) >= date, VALUES(close_price), close_price),
+        high = IF(VALUES(date) >= date, VALUES(high), high),
+        low = IF(VALUES(date) >= date, VALUES(low), low),
+        volume = IF(VALUES(date) >= date, VALUES(volume), volume),
+        date = GREATEST(date, VALUES(date))
+"""
+
+BUMP_SEQUENCE_SQL = "UPDATE TickSequence SET seq = seq + 1 WHERE id = 1"
+
+class LatestPrices:
+    """
+    The latest close of every asset as arrays, in one fixed asset order, with
+    each asset's volatility and volume range. next_bars advances it in place.
+    """
+
+    def __init__(self, rows):
+        self.aids = np.array([aid for aid, _, _ in rows], dtype=np.int64)
+        self.prices = np.array([price for _, price, _ in rows], dtype=float)
+        self.volatility = asset_volatility(self.aids)
+        self.volume_low, self.volume_high = volume_ranges([asset_type for _, _, asset_type in rows])
+
+    def __len__(self):
+        return len(self.aids)
+
+def fetch_latest_prices(cursor):
+    # 1. Get the latest price for EVERY asset (one row per asset in LatestPrice)
+    cursor.execute("""
+        SELECT lp.aid, lp.close_price, a.asset_type
+        FROM LatestPrice lp
+        JOIN Asset a ON lp.aid = a.aid
+    """)
+    return LatestPrices([(aid, float(close_price), asset_type) for aid, close_price, asset_type in cursor.fetchall()])
+
+def next_bars(latest, timestamp, simulator, interval=BASE_INTERVAL):
+    # 2. One bar for every asset in a single vectorized step; moves scale with
+    # sqrt(interval) so the volatility per unit of time does not depend on the
+    # tick rate
+    if not len(latest):
+        return []
+    bars = simulator.simulate(latest.prices, latest.volatility, 1, latest.volume_low, latest.volume_high, interval)
+    # Continue from the stored (rounded) close, as a re-fetch would
+    latest.prices = np.round(bars.close[:, -1], 2)
+    return bar_rows(latest.aids, [timestamp], bars)
+
+def insert_bars(cursor, new_entries):
+    # 3. Insert new prices (executemany turns this into one multi-row INSERT)
+    cursor.executemany(INSERT_PRICE_SQL, new_entries)
+    # Same transaction: readers of the current price never see it lag the history
+    cursor.executemany(UPSERT_LATEST_SQL, new_entries)
+    # Fold each bar into its 1m..1d candles as it closes
+    cursor.executemany(UPSERT_CANDLES_SQL, candle_rows(new_entries))
+
+def bump_sequence(conn, cursor):
+    # Tell the API's price caches that the latest prices moved. Runs once the
+    # bars are committed and in the price store, so a response tagged with
+    # the new sequence never lacks them
+    cursor.execute(BUMP_SEQUENCE_SQL)
+    conn.commit()
+
+def store_bars(store, timestamp, new_entries):
+    # 5. Append the tick to the columnar price store the charts read from,
+    # after the commit so it never holds bars the database rolled back
+    aids, _, open_p, close_p, high, low, volume = zip(*new_entries)
+
+    def column(values):
+        return np.array(values)[:, None]
+
+    store.append([timestamp], aids, column(open_p), column(high), column(low), column(close_p), column(volume))
+
+def partition_start(timestamp):
+    # Start of the partition-width bucket containing timestamp
+    midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + (timestamp - midnight) // PARTITION_WIDTH * PARTITION_WIDTH
+
+def fetch_partitions(cursor):
+    # [(name, upper bound)] of Price in bound order; pmax has bound None
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Price' AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    return [
+        (name, None if bound == 'MAXVALUE' else datetime.fromisoformat(bound.strip("'")))
+        for name, bound in cursor.fetchall()
+    ]
+
+def roll_partitions(cursor, timestamp):
+    # 4. Cleanup: drop the partitions that only hold rows older than the
+    # retention window (~1 hour), and split new ones off pmax to stay
+    # PARTITION_LEAD ahead. Both are metadata operations whose cost does not
+    # grow with the amount of history. DDL commits implicitly, so this runs
+    # outside the tick's transaction.
+    partitions = fetch_partitions(cursor)
+    cutoff = timestamp - RETENTION
+
+    expired = [name for name, bound in partitions if bound is not None and bound <= cutoff]
+    if expired:
+        cursor.execute(f"ALTER TABLE Price DROP PARTITION {', '.join(expired)}")
+
+    bounds = [bound for _, bound in partitions if bound is not None]
+    # Never backfill partitions for a long outage: older rows share the first new one
+    bound = max(bounds[-1], partition_start(cutoff)) if bounds else partition_start(cutoff)
+    bound += PARTITION_WIDTH
+    new_bounds = []
+    while bound <= partition_start(timestamp + PARTITION_LEAD) + PARTITION_WIDTH:
+        new_bounds.append(bound)
+        bound += PARTITION_WIDTH
+    if new_bounds:
+        definitions = [
+            f"PARTITION p{(bound - PARTITION_WIDTH):%Y%m%d%H%M} VALUES LESS THAN ('{bound:%Y-%m-%d %H:%M:%S}')"
+            for bound in new_bounds
+        ]
+        cursor.execute(
+            "ALTER TABLE Price REORGANIZE PARTITION pmax INTO ("
+            + ", ".join(definitions) + ", PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+        )
+    return len(expired), len(new_bounds)
+
+def delete_expired_candles(cursor, timestamp):
+    # Candles are kept per resolution (idx_candle_retention); each pass only
+    # removes the few buckets that expired since the last one
+    for resolution, retention in CANDLE_RETENTION.items():
+        if retention is not None:
+            cursor.execute("DELETE FROM PriceCandle WHERE resolution = %s AND bucket < %s",
+                           (resolution, timestamp - retention))
+
+def tick(seed=None):
+    # One-shot tick on its own connection
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        # 1. Get the latest price for EVERY asset
-        # We use a correlated subquery or join to find the row with the MAX(date)
-        cursor.execute("""
-            SELECT p.aid, p.close_price, a.asset_type
-            FROM Price p
-            JOIN (
-                SELECT aid, MAX(date) as max_date
-                FROM Price
-                GROUP BY aid
-            ) latest ON p.aid = latest.aid AND p.date = latest.max_date
-            JOIN Asset a ON p.aid = a.aid
-        """)
-        
-        latest_prices = cursor.fetchall()
-        
+
+        latest_prices = fetch_latest_prices(cursor)
         timestamp = datetime.now().replace(microsecond=0)
-        new_entries = []
-        
-        # 2. Calculate new price for each asset
-        for aid, current_price, asset_type in latest_prices:
-            current_price = float(current_price)
-            
-            # Generate random delta
-            # Volatility: 0.05% to 0.1% per 10 seconds
-            change_percent = random.uniform(-0.001, 0.001)
-            
-            new_price = current_price * (1 + change_percent)
-            
-            # Generate OHLC for this 10s bar
-            open_p = new_price * (1 + random.uniform(-0.0005, 0.0005))
-            high_p = max(open_p, new_price) * (1 + random.uniform(0, 0.0005))
-            low_p = min(open_p, new_price) * (1 - random.uniform(0, 0.0005))
-            
-            # Volume
-            if asset_type == 'Commodity':
-                 vol = random.randint(10, 500)
-            else:
-                 vol = random.randint(50, 5000)
-
-            new_entries.append((
-                aid, timestamp, 
-                round(open_p, 2), round(new_price, 2), 
-                round(high_p, 2), round(low_p, 2), 
-                vol
-            ))
-            
+        new_entries = next_bars(latest_prices, timestamp, PriceSimulator(seed))
+
         if not new_entries:
             print("No assets found to update.")
             return
 
-        # 3. Insert new prices
-        insert_sql = """
-            INSERT INTO Price (aid, date, open_price, close_price, high, low, volume)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.executemany(insert_sql, new_entries)
-        
-        # 4. Cleanup: Remove oldest entry for each asset to keep window fixed (e.g. ~360 points)
-        # This is a bit expensive to do DELETE with LIMIT per group in MySQL.
-        # Alternative: Delete anything older than 1 hour + buffer.
-        
-        cutoff_time = timestamp - (timedelta(hours=1) + timedelta(minutes=5))
-        # Using a simple DELETE based on time is much faster than finding rank per group
-        
-        # However, the user asked to "pop the oldest value". 
-        # Strict "pop" means exactly maintaining count. 
-        # Let's try a DELETE older than X approach for efficiency, 
-        # assuming the generator runs consistently.
-        
-        cutoff_timestamp = timestamp - timedelta(minutes=65) # Keep slightly more than 60 mins
-        
-        cursor.execute("DELETE FROM Price WHERE date < %s", (cutoff_timestamp,))
-        
+        insert_bars(cursor, new_entries)
+        conn.commit()
+
+        store = price_store.open_writer(TICK_INTERVAL)
+        if store is not None:
+            store_bars(store, timestamp, new_entries)
+            store.drop_before(timestamp - RETENTION)
+        bump_sequence(conn, cursor)
+        roll_partitions(cursor, timestamp)
+        delete_expired_candles(cursor, timestamp)
         conn.commit()
         print(f"Tick {timestamp}: Updated {len(new_entries)} assets. Old data cleaned.")
-        
+
     except mysql.connector.Error as err:
         print(f"Database Error: {err}")
     finally:
         if 'cursor' in locals(): cursor.close()
         if 'conn' in locals(): conn.close()
 
+def fetch_gaps(cursor):
+    # Assets grouped by the time of their latest bar: {date: [(aid, close, asset_type)]}
+    cursor.execute("""
+        SELECT lp.aid, lp.date, lp.close_price, a.asset_type
+        FROM LatestPrice lp
+        JOIN Asset a ON lp.aid = a.aid
+        ORDER BY lp.aid
+    """)
+    groups = {}
+    for aid, date, close_price, asset_type in cursor.fetchall():
+        groups.setdefault(date, []).append((aid, float(close_price), asset_type))
+    return groups
+
+def write_chunked(cursor, sql, rows):
+    # Several multi-row statements; committing is up to the caller
+    for i in range(0, len(rows), INSERT_CHUNK):
+        cursor.executemany(sql, rows[i:i + INSERT_CHUNK])
+
+def backfill_batch(task):
+    # One worker's share of a backfill, on its own connection: bars for its
+    # assets every `interval` seconds after `start` up to `until`, simulated
+    # in memory-sized blocks. Price gets the bars from price_since on (older
+    # ones would only be dropped with their partition), and PriceCandle gets
+    # every candle still inside its retention. Each block commits together
+    # with its assets' LatestPrice rows, so a backfill that dies partway
+    # leaves nothing past LatestPrice and a rerun resumes after the last
+    # committed block without duplicate bars or twice-counted volume.
+    # Returns the bars from price_since on, for the price store.
+    aids, prices, asset_types, start, steps, interval, until, price_since, seed = task
+    simulator = PriceSimulator(seed)
+    aids = np.array(aids, dtype=np.int64)
+    volume_low, volume_high = volume_ranges(asset_types)
+    candle_since = {resolution: None if retention is None else until - retention
+                    for resolution, retention in CANDLE_RETENTION.items()}
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    tail_times, tail_bars = [], []
+    try:
+        for first, bars in simulator.simulate_chunks(prices, asset_volatility(aids), steps,
+                                                     volume_low, volume_high, interval):
+            timestamps = [start + timedelta(seconds=(first + i + 1) * interval) for i in range(bars.close.shape[1])]
+            write_chunked(cursor, UPSERT_CANDLES_SQL, aggregate_candles(aids, timestamps, bars, candle_since))
+
+            keep = 0 if price_since is None else int(np.searchsorted(price_store.to_ms(timestamps),
+                                                                price_store.to_ms([price_since])[0]))
+            if keep < len(timestamps):
+                kept = Bars(*(values[:, keep:] for values in bars))
+                write_chunked(cursor, INSERT_PRICE_SQL, bar_rows(aids, timestamps[keep:], kept))
+            cursor.executemany(UPSERT_LATEST_SQL,
+                               bar_rows(aids, timestamps[-1:], Bars(*(values[:, -1:] for values in bars))))
+            conn.commit()
+            if keep < len(timestamps):
+                tail_times.extend(timestamps[keep:])
+                tail_bars.append(Bars(*(np.round(values, 2) if values.dtype.kind == 'f' else values
+                                        for values in kept)))
+    finally:
+        cursor.close()
+        conn.close()
+
+    tail = Bars(*(np.concatenate(columns, axis=1) for columns in zip(*tail_bars))) if tail_bars else None
+    return aids, tail_times, tail
+
+def append_tails(store, results):
+    # The store shares one time axis across assets: lay every task's tail
+    # on the union of their times, zeros where an asset has no bar
+    parts = [(aids, times, tail) for aids, times, tail in results if tail is not None]
+    if not parts:
+        return
+    times = sorted(set().union(*(times for _, times, _ in parts)))
+    times_ms = price_store.to_ms(times)
+    aids = np.concatenate([aids for aids, _, _ in parts])
+    columns = []
+    for k, values in enumerate(parts[0][2]):
+        column = np.zeros((len(aids), len(times)), dtype=values.dtype)
+        row = 0
+        for part_aids, part_times, tail in parts:
+            column[row:row + len(part_aids), np.searchsorted(times_ms, price_store.to_ms(part_times))] = tail[k]
+            row += len(part_aids)
+        columns.append(column)
+    store.append(times, aids, *columns)
+
+def backfill(until, interval, seed=None, price_since=None, store=None, workers=BACKFILL_WORKERS):
+    """
+    Catch every asset up from its latest bar to `until` with one bar per
+    `interval` seconds. Assets are split across a process pool; each worker
+    simulates its share in vectorized blocks and commits each block with
+    its LatestPrice rows, so a failed backfill can simply be run again.
+    TickSequence moves once at the end, after the price store has the bars.
+    Returns the number of bars generated.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        tasks = []
+        step = timedelta(seconds=interval)
+        for start, members in sorted(fetch_gaps(cursor).items()):
+            steps = (until - start) // step
+            if steps <= 0:
+                continue
+            # One task per worker, so a single gap still uses every process
+            share = -(-len(members) // max(1, workers))
+            for i in range(0, len(members), share):
+                aids, prices, asset_types = zip(*members[i:i + share])
+                tasks.append([aids, prices, asset_types, start, steps, interval, until, price_since])
+        if not tasks:
+            return 0
+
+        # Independent, reproducible random streams per task
+        for task, task_seed in zip(tasks, np.random.SeedSequence(seed).spawn(len(tasks))):
+            task.append(task_seed)
+
+        total = sum(len(task[0]) * task[4] for task in tasks)
+        if workers > 1 and len(tasks) > 1 and total >= BACKFILL_POOL_MIN:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(backfill_batch, tasks))
+        else:
+            results = [backfill_batch(task) for task in tasks]
+
+        if store is not None:
+            try:
+                append_tails(store, results)
+            except OSError as e:
+                logging.error(f"Price store error: {e}")
+        bump_sequence(conn, cursor)
+    finally:
+        cursor.close()
+        conn.close()
+    return total
+
+class Ticker:
+    """
+    Resident ticker: one persistent connection, the latest prices kept in
+    memory between ticks, and a schedule anchored to its start time so ticks
+    do not drift by their own run time. A tick that falls more than one
+    interval behind is skipped rather than run back to back. On start it
+    backfills the bars missed while it was down.
+    """
+
+    def __init__(self, interval=TICK_INTERVAL, seed=None):
+        self.interval = interval
+        self.seed = seed
+        self.simulator = PriceSimulator(seed)
+        self.store = price_store.open_writer(interval)
+        self.conn = None
+        self.latest = None
+        self.last_maintenance = 0.0
+
+    def connect(self):
+        self.conn = get_db_connection()
+        self.conn.autocommit = False
+        self.latest = None
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except mysql.connector.Error:
+                pass
+        self.conn = None
+
+    def run_tick(self, timestamp):
+        started = time.perf_counter()
+        if self.conn is None:
+            self.connect()
+        cursor = None
+        try:
+            cursor = self.conn.cursor()
+            maintenance = time.monotonic() - self.last_maintenance >= MAINTENANCE_INTERVAL
+            if self.latest is None or maintenance:
+                # Pick up assets added and prices written by anyone else
+                self.latest = fetch_latest_prices(cursor)
+            fetched = time.perf_counter()
+
+            new_entries = next_bars(self.latest, timestamp, self.simulator, self.interval)
+            generated = time.perf_counter()
+
+            if new_entries:
+                insert_bars(cursor, new_entries)
+            self.conn.commit()
+            committed = time.perf_counter()
+            if self.store is not None and new_entries:
+                try:
+                    store_bars(self.store, timestamp, new_entries)
+                    if maintenance:
+                        self.store.drop_before(timestamp - RETENTION)
+                except OSError as e:
+                    logging.error(f"Price store error: {e}")
+            if new_entries:
+                bump_sequence(self.conn, cursor)
+            cleanup = ""
+            if maintenance:
+                dropped, added = roll_partitions(cursor, timestamp)
+                delete_expired_candles(cursor, timestamp)
+                self.conn.commit()
+                self.last_maintenance = time.monotonic()
+                cleanup = f", partitions -{dropped}/+{added} in {(time.perf_counter() - committed) * 1000:.1f} ms"
+        except mysql.connector.Error:
+            # Drop the connection and the cached prices; reconnect next tick
+            cursor = None
+            self.close()
+            raise
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+        logging.info(
+            "Tick %s: %d assets | fetch %.1f ms, generate %.1f ms, write %.1f ms, total %.1f ms%s",
+            timestamp.isoformat(sep=' ', timespec='milliseconds'), len(new_entries),
+            (fetched - started) * 1000, (generated - fetched) * 1000,
+            (committed - generated) * 1000, (committed - started) * 1000,
+            cleanup
+        )
+
+    def catch_up(self):
+        # Fill the gap since the last bar before ticking; only its last
+        # RETENTION of raw bars is kept, the candles cover all of it. A
+        # failed attempt is retried, resuming from its last committed block:
+        # ticking first would leave the rest of the gap empty for good
+        started = time.perf_counter()
+        while True:
+            until = datetime.now()
+            try:
+                bars = backfill(until, self.interval, self.seed, until - RETENTION, self.store)
+                break
+            except (mysql.connector.Error, OSError) as err:
+                logging.error(f"Backfill failed, retrying in {BACKFILL_RETRY_DELAY} s: {err}")
+                time.sleep(BACKFILL_RETRY_DELAY)
+        if bars:
+            logging.info("Backfilled %d bars up to %s in %.1f s", bars,
+                         until.isoformat(sep=' ', timespec='seconds'), time.perf_counter() - started)
+
+    def run(self):
+        self.catch_up()
+        logging.info("Ticker started: one tick every %.3f s", self.interval)
+        start_wall = time.time()
+        start = time.monotonic()
+        ticks = 0
+
+        while True:
+            due = start + ticks * self.interval
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            lag = time.monotonic() - due
+            if lag > self.interval:
+                # Fell behind (slow database, paused container): skip to the
+                # next slot instead of bursting through the missed ticks
+                missed = int(lag // self.interval)
+                logging.warning("Ticker %.0f ms behind, skipping %d ticks", lag * 1000, missed)
+                ticks += missed
+                continue
+
+            # Bars are stamped with their scheduled time, to the millisecond
+            scheduled = datetime.fromtimestamp(start_wall + ticks * self.interval)
+            timestamp = scheduled.replace(microsecond=scheduled.microsecond // 1000 * 1000)
+            try:
+                self.run_tick(timestamp)
+                if lag > 0.001:
+                    logging.info("Tick started %.1f ms late", lag * 1000)
+            except mysql.connector.Error as err:
+                logging.error(f"Database Error: {err}")
+            ticks += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate simulated price bars.")
+    parser.add_argument('--interval', type=float, default=TICK_INTERVAL,
+                        help="Seconds between ticks (TICK_INTERVAL, default 10)")
+    parser.add_argument('--once', action='store_true', help="Run a single tick and exit")
+    parser.add_argument('--seed', type=int, help="Random seed, for reproducible price paths")
+    args = parser.parse_args()
+
+    if args.once:
+        tick(args.seed)
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    Ticker(args.interval, args.seed).run()
+
 if __name__ == "__main__":
-    tick()
\ No newline at end of file
+    main()
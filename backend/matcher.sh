@@ -0,0 +1,12 @@
+#!/bin/bash
+
+echo "Starting Matching Worker..."
+
+# Runs MATCHING_SHARDS shard processes (default 1). Each drains its slice of
+# OrderIntake and serves place/cancel requests from the API; restart on exit
+while true; do
+    python3 flaskapp/matching_worker.py
+
+    echo "Matching worker exited, restarting in 5 seconds..."
+    sleep 5
+done
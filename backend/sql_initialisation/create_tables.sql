@@ -32,32 +32,64 @@ CREATE TABLE Asset (
 );
 
 -- 4. Price Table
+-- Range partitioned by time so retention drops whole partitions, and the ticker
+-- splits new partitions off pmax ahead of time and drops expired ones.
+-- MySQL does not allow foreign keys on partitioned tables, so aid is not
+-- constrained to Asset here.
 CREATE TABLE Price (
     aid INT,
-    date DATETIME,
+    date DATETIME(3), -- millisecond precision for sub-second ticks
     open_price DECIMAL(10, 2),
     close_price DECIMAL(10, 2),
     high DECIMAL(10, 2),
     low DECIMAL(10, 2),
     volume BIGINT,
-    PRIMARY KEY (aid, date),
-    CONSTRAINT fk_price_asset FOREIGN KEY (aid) REFERENCES Asset(aid)
+    PRIMARY KEY (aid, date)
+)
+PARTITION BY RANGE COLUMNS(date) (
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
 );
 
--- 5. AssetPriceView (Needed for Procedures)
+-- 4b. LatestPrice Table (each asset's most recent bar, upserted in the same transaction as the Price insert)
+CREATE TABLE LatestPrice (
+    aid INT PRIMARY KEY,
+    date DATETIME(3),
+    open_price DECIMAL(10, 2),
+    close_price DECIMAL(10, 2),
+    high DECIMAL(10, 2),
+    low DECIMAL(10, 2),
+    volume BIGINT,
+    CONSTRAINT fk_latest_price_asset FOREIGN KEY (aid) REFERENCES Asset(aid)
+);
+
+-- 4c. PriceCandle Table (OHLCV rollups per resolution, updated by the ticker as each bar closes)
+CREATE TABLE PriceCandle (
+    aid INT NOT NULL,
+    resolution ENUM('1m', '5m', '15m', '1h', '1d') NOT NULL,
+    bucket DATETIME NOT NULL, -- start of the candle
+    open_price DECIMAL(10, 2),
+    high DECIMAL(10, 2),
+    low DECIMAL(10, 2),
+    close_price DECIMAL(10, 2),
+    volume BIGINT,
+    open_date DATETIME(3), -- first and last bar merged into the candle
+    close_date DATETIME(3),
+    PRIMARY KEY (aid, resolution, bucket),
+    INDEX idx_candle_retention (resolution, bucket),
+    CONSTRAINT fk_candle_asset FOREIGN KEY (aid) REFERENCES Asset(aid)
+);
+
+-- 5. AssetPriceView (Needed for Procedures): one primary key lookup per asset
 CREATE OR REPLACE VIEW AssetPriceView AS
 SELECT 
     a.aid, 
     a.name, 
     a.asset_type,
-    p.close_price AS current_price
+    lp.close_price AS current_price
 FROM 
     Asset a
 JOIN 
-    Price p ON a.aid = p.aid
-JOIN 
-    (SELECT aid, MAX(date) AS latest_date FROM Price GROUP BY aid) AS latest_prices
-        ON p.aid = latest_prices.aid AND p.date = latest_prices.latest_date;
+    LatestPrice lp ON a.aid = lp.aid;
 
 -- 6. Orders Table (Added aid)
 CREATE TABLE Orders (
@@ -65,17 +97,20 @@ CREATE TABLE Orders (
     uid INT,
     aid INT,
     price DECIMAL(10, 2),
-    qty INT,
+    qty INT, -- quantity still open
+    filled_qty INT NOT NULL DEFAULT 0, -- quantity executed so far (fills are in Transaction)
     date DATE,
     time TIME,
     otype VARCHAR(50),
-    status VARCHAR(20) DEFAULT 'Pending',
+    status VARCHAR(20) DEFAULT 'Pending', -- 'Completed' once nothing is left open
+    INDEX idx_orders_status_aid (status, aid),
     CONSTRAINT fk_orders_user FOREIGN KEY (uid) REFERENCES User(uid),
     CONSTRAINT fk_orders_asset FOREIGN KEY (aid) REFERENCES Asset(aid)
 );
 
 -- 7. Transaction Table 
 -- CRITICAL FIX: Updated columns to match your MatchOrders procedure
+-- One row per fill, and buy_oid / sell_oid are the orders that traded
 CREATE TABLE Transaction (
     tid INT AUTO_INCREMENT PRIMARY KEY,
     date DATE,
@@ -141,4 +176,64 @@ JOIN
 JOIN 
     AssetPriceView apv ON pa.aid = apv.aid
 GROUP BY 
-    p.pid, p.uid, p.pname;
\ No newline at end of file
+    p.pid, p.uid, p.pname;
+
+-- 13. OrderIntake Table (orders accepted by the API, drained by the matching worker)
+CREATE TABLE OrderIntake (
+    qid INT AUTO_INCREMENT PRIMARY KEY,
+    action ENUM('Place', 'Cancel') NOT NULL DEFAULT 'Place',
+    uid INT,
+    aid INT,
+    qty INT,
+    otype VARCHAR(50),
+    price DECIMAL(10, 2),
+    oid INT, -- Orders row once placed, or the order to cancel
+    status ENUM('Queued', 'Pending', 'Filled', 'Cancelled', 'Rejected') NOT NULL DEFAULT 'Queued',
+    filled_qty INT NOT NULL DEFAULT 0,
+    error VARCHAR(255),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    processed_at DATETIME,
+    INDEX idx_intake_status (status, qid),
+    INDEX idx_intake_oid (oid),
+    CONSTRAINT fk_intake_user FOREIGN KEY (uid) REFERENCES User(uid),
+    CONSTRAINT fk_intake_asset FOREIGN KEY (aid) REFERENCES Asset(aid)
+);
+
+
+-- 14. MatchingWatermark Table (sequence of committed matching units per shard, checked by every unit and on journal recovery)
+CREATE TABLE MatchingWatermark (
+    id TINYINT PRIMARY KEY,
+    seq BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO MatchingWatermark (id, seq) VALUES (1, 0);
+
+
+-- 15. FundsLedger Table (per user and asset class: value of pending orders and of all orders, kept by the Orders triggers)
+CREATE TABLE FundsLedger (
+    uid INT NOT NULL,
+    asset_type ENUM('Equity', 'Commodity') NOT NULL,
+    reserved DECIMAL(15, 2) NOT NULL DEFAULT 0, -- SUM(price * qty) of Pending orders
+    spent DECIMAL(15, 2) NOT NULL DEFAULT 0,    -- SUM(price * (qty + filled_qty)) of all orders
+    PRIMARY KEY (uid, asset_type),
+    CONSTRAINT fk_ledger_user FOREIGN KEY (uid) REFERENCES User(uid) ON DELETE CASCADE
+);
+
+
+-- 16. TickSequence Table (bumped after each batch of LatestPrice writes is committed and in the price store, and price caches reload when it moves)
+CREATE TABLE TickSequence (
+    id TINYINT PRIMARY KEY,
+    seq BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO TickSequence (id, seq) VALUES (1, 0);
+
+
+-- 17. DataVersion Table (per-user versions of the data behind the conditional GET routes, bumped by triggers in the writing transaction)
+CREATE TABLE DataVersion (
+    scope ENUM('portfolio', 'watchlists', 'watchlist') NOT NULL, -- id is a uid, a uid and a wid respectively
+    id INT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated DATETIME(3) NOT NULL,
+    PRIMARY KEY (scope, id)
+);
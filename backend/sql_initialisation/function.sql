@@ -33,55 +33,51 @@ BEGIN
     RETURN total_value;
 END$$
 
--- 2. Pending Cost Equity
+-- 2. Pending Cost Equity (maintained in FundsLedger by the Orders triggers)
 CREATE FUNCTION GetTotalPendingCostEquity(uid INT)
 RETURNS DECIMAL(10,2)
 DETERMINISTIC
 BEGIN
     DECLARE total_cost DECIMAL(10,2);
-    SELECT COALESCE(SUM(price * qty), 0) INTO total_cost
-    FROM Orders
-    JOIN Asset ON Orders.aid = Asset.aid
-    WHERE Orders.uid = uid AND Orders.status = 'Pending' AND Asset.asset_type = 'Equity';
+    SELECT COALESCE(MAX(reserved), 0) INTO total_cost
+    FROM FundsLedger
+    WHERE FundsLedger.uid = uid AND FundsLedger.asset_type = 'Equity';
     RETURN total_cost;
 END$$
 
--- 3. Pending Cost Commodity
+-- 3. Pending Cost Commodity (maintained in FundsLedger by the Orders triggers)
 CREATE FUNCTION GetTotalPendingCostCommodity(uid INT)
 RETURNS DECIMAL(10,2)
 DETERMINISTIC
 BEGIN
     DECLARE total_cost DECIMAL(10,2);
-    SELECT COALESCE(SUM(price * qty), 0) INTO total_cost
-    FROM Orders
-    JOIN Asset ON Orders.aid = Asset.aid
-    WHERE Orders.uid = uid AND Orders.status = 'Pending' AND Asset.asset_type = 'Commodity';
+    SELECT COALESCE(MAX(reserved), 0) INTO total_cost
+    FROM FundsLedger
+    WHERE FundsLedger.uid = uid AND FundsLedger.asset_type = 'Commodity';
     RETURN total_cost;
 END$$
 
--- 4. Total Cost Equity
+-- 4. Total Cost Equity (maintained in FundsLedger by the Orders triggers)
 CREATE FUNCTION GetTotalCostEquity(uid INT)
 RETURNS DECIMAL(10,2)
 DETERMINISTIC
 BEGIN
     DECLARE total_cost DECIMAL(10,2);
-    SELECT COALESCE(SUM(price * qty), 0) INTO total_cost
-    FROM Orders
-    JOIN Asset ON Orders.aid = Asset.aid
-    WHERE Orders.uid = uid AND Asset.asset_type = 'Equity';
+    SELECT COALESCE(MAX(spent), 0) INTO total_cost
+    FROM FundsLedger
+    WHERE FundsLedger.uid = uid AND FundsLedger.asset_type = 'Equity';
     RETURN total_cost;
 END$$
 
--- 5. Total Cost Commodity
+-- 5. Total Cost Commodity (maintained in FundsLedger by the Orders triggers)
 CREATE FUNCTION GetTotalCostCommodity(uid INT)
 RETURNS DECIMAL(10,2)
 DETERMINISTIC
 BEGIN
     DECLARE total_cost DECIMAL(10,2);
-    SELECT COALESCE(SUM(price * qty), 0) INTO total_cost
-    FROM Orders
-    JOIN Asset ON Orders.aid = Asset.aid
-    WHERE Orders.uid = uid AND Asset.asset_type = 'Commodity';
+    SELECT COALESCE(MAX(spent), 0) INTO total_cost
+    FROM FundsLedger
+    WHERE FundsLedger.uid = uid AND FundsLedger.asset_type = 'Commodity';
     RETURN total_cost;
 END$$
 
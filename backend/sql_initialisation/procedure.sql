@@ -21,10 +21,13 @@ BEGIN
     VALUES (uid, asset_id, qty, asset_price, otype, 'Pending', CURDATE(), CURTIME());
 END$$
 
--- 2. Match Orders
-CREATE PROCEDURE MatchOrders()
+-- 2. Match one asset's orders. Only this asset's pending orders and the
+-- User rows of their owners are locked, so assets match in parallel.
+CREATE PROCEDURE MatchAssetOrders(IN p_aid INT)
 BEGIN
     DECLARE done INT DEFAULT 0;
+    DECLARE locked_rows INT;
+    DECLARE lock_uid INT;
     
     -- Cursor variables
     DECLARE c_buy_oid INT; DECLARE c_sell_oid INT;
@@ -37,8 +40,6 @@ BEGIN
     
     -- Transaction variables
     DECLARE trans_qty INT;
-    DECLARE new_buy_oid INT;
-    DECLARE new_sell_oid INT;
 
     -- Cursor: Find all POTENTIAL matches based on price.
     -- We assume price priority logic is satisfied by the query conditions.
@@ -50,10 +51,51 @@ BEGIN
            AND b.otype = 'Buy' AND s.otype = 'Sell'
            AND b.status = 'Pending' AND s.status = 'Pending'
            AND b.price >= s.price
+        WHERE b.aid = p_aid
         ORDER BY b.date ASC, b.time ASC; -- FIFO processing
 
+    -- Cursor: this asset's traders, in the order their User rows are locked
+    DECLARE user_cur CURSOR FOR
+        SELECT DISTINCT uid FROM Orders
+        WHERE aid = p_aid AND status = 'Pending'
+        ORDER BY uid;
+
     DECLARE CONTINUE HANDLER FOR NOT FOUND SET done = 1;
 
+    -- Position and fund deltas of this pass, netted per (user, asset) and
+    -- settled in two statements after the loop
+    DROP TEMPORARY TABLE IF EXISTS match_settlement;
+    CREATE TEMPORARY TABLE match_settlement (
+        uid INT NOT NULL,
+        aid INT NOT NULL,
+        buy_qty INT NOT NULL DEFAULT 0,
+        buy_cost DECIMAL(15,2) NOT NULL DEFAULT 0,
+        sell_qty INT NOT NULL DEFAULT 0,
+        sell_price DECIMAL(10,2),
+        amount DECIMAL(15,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (uid, aid)
+    );
+
+    -- Lock this asset's book, then its traders' User rows one at a time in
+    -- ascending uid order, the same order the application uses, so
+    -- concurrent passes queue instead of deadlocking. A single
+    -- WHERE uid IN (...) FOR UPDATE leaves the lock order to the join plan
+    SELECT COUNT(*) INTO locked_rows
+    FROM Orders WHERE aid = p_aid AND status = 'Pending'
+    FOR UPDATE;
+
+    OPEN user_cur;
+
+    lock_loop: LOOP
+        FETCH user_cur INTO lock_uid;
+        IF done THEN LEAVE lock_loop; END IF;
+
+        SELECT uid INTO lock_uid FROM `User` WHERE uid = lock_uid FOR UPDATE;
+    END LOOP;
+
+    CLOSE user_cur;
+    SET done = 0;
+
     OPEN order_cur;
 
     match_loop: LOOP
@@ -62,12 +104,17 @@ BEGIN
 
         -- CRITICAL FIX: Re-fetch current quantities to ensure they haven't been used up
         -- by a previous iteration of this loop.
+        SET cur_buy_qty = NULL, cur_sell_qty = NULL;
         SELECT qty, price, uid, aid INTO cur_buy_qty, cur_buy_price, cur_buy_uid, cur_buy_aid
         FROM Orders WHERE oid = c_buy_oid AND status = 'Pending';
 
         SELECT qty, price, uid, aid INTO cur_sell_qty, cur_sell_price, cur_sell_uid, cur_sell_aid
         FROM Orders WHERE oid = c_sell_oid AND status = 'Pending';
 
+        -- A Completed order matches no row above, which fires the NOT FOUND
+        -- handler; that must not end the cursor loop
+        SET done = 0;
+
         -- If either order is fully filled (NULL or 0), skip this match
         IF cur_buy_qty IS NULL OR cur_sell_qty IS NULL OR cur_buy_qty <= 0 OR cur_sell_qty <= 0 THEN
             ITERATE match_loop;
@@ -76,42 +123,105 @@ BEGIN
         -- Calculate transaction quantity
         SET trans_qty = LEAST(cur_buy_qty, cur_sell_qty);
 
-        -- Insert completed Buy order
-        INSERT INTO Orders (uid, price, qty, date, time, otype, status, aid)
-        VALUES (cur_buy_uid, cur_buy_price, trans_qty, CURDATE(), CURTIME(), 'Buy', 'Completed', cur_buy_aid);
-        SET new_buy_oid = LAST_INSERT_ID();
-
-        -- Insert completed Sell order
-        INSERT INTO Orders (uid, price, qty, date, time, otype, status, aid)
-        VALUES (cur_sell_uid, cur_sell_price, trans_qty, CURDATE(), CURTIME(), 'Sell', 'Completed', cur_sell_aid);
-        SET new_sell_oid = LAST_INSERT_ID();
-
-        -- Update Portfolio (Buyer)
-        INSERT INTO Portfolio_Asset (pid, aid, qty, buy_price)
-        VALUES ((SELECT pid FROM Portfolio WHERE uid = cur_buy_uid), cur_buy_aid, trans_qty, cur_buy_price)
-        ON DUPLICATE KEY UPDATE 
-            buy_price = ((buy_price * qty) + (trans_qty * VALUES(buy_price))) / (qty + trans_qty),
-            qty = qty + trans_qty;
-
-        -- Update Portfolio (Seller)
-        INSERT INTO Portfolio_Asset (pid, aid, qty, buy_price)
-        VALUES ((SELECT pid FROM Portfolio WHERE uid = cur_sell_uid), cur_sell_aid, -trans_qty, cur_sell_price)
-        ON DUPLICATE KEY UPDATE qty = qty - trans_qty;
-
-        -- Record Transaction
+        -- Stage the buyer's and seller's position and fund deltas
+        INSERT INTO match_settlement (uid, aid, buy_qty, buy_cost, sell_qty, sell_price, amount)
+        VALUES (cur_buy_uid, cur_buy_aid, trans_qty, trans_qty * cur_buy_price, 0, NULL, -(trans_qty * cur_sell_price)),
+               (cur_sell_uid, cur_sell_aid, 0, 0, trans_qty, cur_sell_price, trans_qty * cur_sell_price)
+        ON DUPLICATE KEY UPDATE
+            buy_qty = buy_qty + VALUES(buy_qty),
+            buy_cost = buy_cost + VALUES(buy_cost),
+            sell_qty = sell_qty + VALUES(sell_qty),
+            sell_price = COALESCE(VALUES(sell_price), sell_price),
+            amount = amount + VALUES(amount);
+
+        -- Record Transaction against the orders that traded
         INSERT INTO Transaction (date, buy_oid, sell_oid, buy_uid, sell_uid, price, qty)
-        VALUES (CURDATE(), new_buy_oid, new_sell_oid, cur_buy_uid, cur_sell_uid, cur_sell_price, trans_qty);
+        VALUES (CURDATE(), c_buy_oid, c_sell_oid, cur_buy_uid, cur_sell_uid, cur_sell_price, trans_qty);
 
-        -- Update original pending orders
-        UPDATE Orders SET qty = qty - trans_qty WHERE oid = c_buy_oid;
-        UPDATE Orders SET qty = qty - trans_qty WHERE oid = c_sell_oid;
-
-        -- Cleanup 0 qty pending orders
-        DELETE FROM Orders WHERE qty = 0 AND status = 'Pending' AND (oid = c_buy_oid OR oid = c_sell_oid);
+        -- Track the fill on the original orders; an order with nothing left
+        -- open is Completed in place
+        UPDATE Orders
+        SET qty = qty - trans_qty,
+            filled_qty = filled_qty + trans_qty,
+            status = IF(qty = 0, 'Completed', status)
+        WHERE oid IN (c_buy_oid, c_sell_oid);
 
     END LOOP;
 
     CLOSE order_cur;
+
+    -- Settle positions: buys move the average price, sells only reduce qty
+    INSERT INTO Portfolio_Asset (pid, aid, qty, buy_price)
+    SELECT p.pid, s.aid, s.buy_qty - s.sell_qty, IF(s.buy_qty > 0, s.buy_cost / s.buy_qty, s.sell_price)
+    FROM match_settlement s
+    JOIN Portfolio p ON p.uid = s.uid
+    ON DUPLICATE KEY UPDATE
+        buy_price = IF(s.buy_qty > 0,
+            ((Portfolio_Asset.buy_price * Portfolio_Asset.qty) + s.buy_cost) / (Portfolio_Asset.qty + s.buy_qty),
+            Portfolio_Asset.buy_price),
+        qty = Portfolio_Asset.qty + s.buy_qty - s.sell_qty;
+
+    -- Settle funds: one update per user, netted by asset class
+    UPDATE `User` u
+    JOIN (
+        SELECT s.uid,
+               SUM(IF(a.asset_type = 'Equity', s.amount, 0)) AS equity_delta,
+               SUM(IF(a.asset_type = 'Commodity', s.amount, 0)) AS commodity_delta
+        FROM match_settlement s
+        JOIN Asset a ON a.aid = s.aid
+        GROUP BY s.uid
+    ) d ON d.uid = u.uid
+    SET u.equity_funds = u.equity_funds + d.equity_delta,
+        u.commodity_funds = u.commodity_funds + d.commodity_delta;
+
+    DROP TEMPORARY TABLE match_settlement;
+END$$
+
+-- 3. Match Orders: one MatchAssetOrders pass per asset with crossing orders
+CREATE PROCEDURE MatchOrders()
+BEGIN
+    DECLARE done INT DEFAULT 0;
+    DECLARE matched INT DEFAULT 0;
+    DECLARE c_aid INT;
+
+    DECLARE aid_cur CURSOR FOR
+        SELECT DISTINCT b.aid
+        FROM Orders b
+        JOIN Orders s
+            ON b.aid = s.aid
+           AND b.otype = 'Buy' AND s.otype = 'Sell'
+           AND b.status = 'Pending' AND s.status = 'Pending'
+           AND b.price >= s.price
+        ORDER BY b.aid;
+
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET done = 1;
+
+    OPEN aid_cur;
+
+    aid_loop: LOOP
+        FETCH aid_cur INTO c_aid;
+        IF done THEN LEAVE aid_loop; END IF;
+        CALL MatchAssetOrders(c_aid);
+        SET matched = 1;
+    END LOOP;
+
+    CLOSE aid_cur;
+
+    -- Tell the in-memory order books of every shard that Orders changed
+    -- under them, so they reload before their next unit
+    IF matched THEN
+        UPDATE MatchingWatermark SET seq = seq + 1;
+    END IF;
+END$$
+
+-- 4. Bump the version of one user's data set (see DataVersion)
+CREATE PROCEDURE BumpDataVersion(IN p_scope VARCHAR(20), IN p_id INT)
+BEGIN
+    IF p_id IS NOT NULL THEN
+        INSERT INTO DataVersion (scope, id, version, updated)
+        VALUES (p_scope, p_id, 1, NOW(3))
+        ON DUPLICATE KEY UPDATE version = version + 1, updated = VALUES(updated);
+    END IF;
 END$$
 
 DELIMITER ;
\ No newline at end of file
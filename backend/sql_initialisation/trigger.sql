@@ -1,35 +1,152 @@
 DELIMITER $$
 
--- 1. Update Funds after Transaction
-CREATE TRIGGER update_funds_after_transaction
-AFTER INSERT ON Transaction
+-- Funds for fills are moved by the settlement stage (settlement.py and the
+-- end of MatchOrders), netted per pass, rather than by a Transaction trigger
+
+-- 1. Create Portfolio after User Registration
+CREATE TRIGGER insert_portfolio_after_user
+AFTER INSERT ON `User`
 FOR EACH ROW
 BEGIN
-    DECLARE asset_type_var VARCHAR(20);
-    DECLARE aid_var INT;
+    INSERT INTO `Portfolio` (uid, pname)
+    VALUES (NEW.uid, CONCAT(NEW.uname, "'s Portfolio"));
+END$$
+
+-- 2. Seed the funds ledger from any orders loaded before the triggers below exist
+INSERT INTO FundsLedger (uid, asset_type, reserved, spent)
+SELECT o.uid, a.asset_type,
+       SUM(IF(o.status = 'Pending', o.price * o.qty, 0)),
+       SUM(o.price * (o.qty + o.filled_qty))
+FROM Orders o
+JOIN Asset a ON o.aid = a.aid
+WHERE o.uid IS NOT NULL
+GROUP BY o.uid, a.asset_type$$
 
-    -- Get Asset ID from the Buy Order
-    SELECT aid INTO aid_var FROM Orders WHERE oid = NEW.buy_oid LIMIT 1;
+-- 3. Funds Ledger after Order Insert (placement)
+CREATE TRIGGER ledger_after_order_insert
+AFTER INSERT ON Orders
+FOR EACH ROW
+BEGIN
+    INSERT INTO FundsLedger (uid, asset_type, reserved, spent)
+    SELECT NEW.uid, asset_type, IF(NEW.status = 'Pending', NEW.price * NEW.qty, 0), NEW.price * (NEW.qty + NEW.filled_qty)
+    FROM Asset WHERE aid = NEW.aid
+    ON DUPLICATE KEY UPDATE
+        reserved = reserved + VALUES(reserved),
+        spent = spent + VALUES(spent);
+END$$
 
-    -- Get Asset Type
-    SELECT asset_type INTO asset_type_var FROM Asset WHERE aid = aid_var LIMIT 1;
+-- 4. Funds Ledger after Order Update (fills, cancels of partly filled orders)
+CREATE TRIGGER ledger_after_order_update
+AFTER UPDATE ON Orders
+FOR EACH ROW
+BEGIN
+    IF NEW.uid = OLD.uid AND NEW.aid = OLD.aid THEN
+        -- Usual case: apply the difference to the one ledger row
+        UPDATE FundsLedger l
+        JOIN Asset a ON a.aid = NEW.aid
+        SET l.reserved = l.reserved
+                + IF(NEW.status = 'Pending', NEW.price * NEW.qty, 0)
+                - IF(OLD.status = 'Pending', OLD.price * OLD.qty, 0),
+            l.spent = l.spent + NEW.price * (NEW.qty + NEW.filled_qty) - OLD.price * (OLD.qty + OLD.filled_qty)
+        WHERE l.uid = NEW.uid AND l.asset_type = a.asset_type;
+    ELSE
+        UPDATE FundsLedger l
+        JOIN Asset a ON a.aid = OLD.aid
+        SET l.reserved = l.reserved - IF(OLD.status = 'Pending', OLD.price * OLD.qty, 0),
+            l.spent = l.spent - OLD.price * (OLD.qty + OLD.filled_qty)
+        WHERE l.uid = OLD.uid AND l.asset_type = a.asset_type;
 
-    IF asset_type_var = 'Equity' THEN
-        UPDATE `User` SET equity_funds = equity_funds - (NEW.qty * NEW.price) WHERE uid = NEW.buy_uid;
-        UPDATE `User` SET equity_funds = equity_funds + (NEW.qty * NEW.price) WHERE uid = NEW.sell_uid;
-    ELSEIF asset_type_var = 'Commodity' THEN
-        UPDATE `User` SET commodity_funds = commodity_funds - (NEW.qty * NEW.price) WHERE uid = NEW.buy_uid;
-        UPDATE `User` SET commodity_funds = commodity_funds + (NEW.qty * NEW.price) WHERE uid = NEW.sell_uid;
+        INSERT INTO FundsLedger (uid, asset_type, reserved, spent)
+        SELECT NEW.uid, asset_type, IF(NEW.status = 'Pending', NEW.price * NEW.qty, 0), NEW.price * (NEW.qty + NEW.filled_qty)
+        FROM Asset WHERE aid = NEW.aid
+        ON DUPLICATE KEY UPDATE
+            reserved = reserved + VALUES(reserved),
+            spent = spent + VALUES(spent);
     END IF;
 END$$
 
--- 2. Create Portfolio after User Registration
-CREATE TRIGGER insert_portfolio_after_user
-AFTER INSERT ON `User`
+-- 5. Funds Ledger after Order Delete (cancels)
+CREATE TRIGGER ledger_after_order_delete
+AFTER DELETE ON Orders
 FOR EACH ROW
 BEGIN
-    INSERT INTO `Portfolio` (uid, pname)
-    VALUES (NEW.uid, CONCAT(NEW.uname, "'s Portfolio"));
+    UPDATE FundsLedger l
+    JOIN Asset a ON a.aid = OLD.aid
+    SET l.reserved = l.reserved - IF(OLD.status = 'Pending', OLD.price * OLD.qty, 0),
+        l.spent = l.spent - OLD.price * (OLD.qty + OLD.filled_qty)
+    WHERE l.uid = OLD.uid AND l.asset_type = a.asset_type;
+END$$
+
+-- 6. Data versions for conditional GETs. Fills reach Portfolio_Asset already
+-- netted per user and asset, so these add one row write per changed position.
+-- Foreign key cascades fire no triggers, hence the parent delete triggers.
+CREATE TRIGGER version_after_portfolio_asset_insert
+AFTER INSERT ON Portfolio_Asset
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('portfolio', (SELECT uid FROM Portfolio WHERE pid = NEW.pid));
+END$$
+
+CREATE TRIGGER version_after_portfolio_asset_update
+AFTER UPDATE ON Portfolio_Asset
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('portfolio', (SELECT uid FROM Portfolio WHERE pid = NEW.pid));
+    IF NEW.pid <> OLD.pid THEN
+        CALL BumpDataVersion('portfolio', (SELECT uid FROM Portfolio WHERE pid = OLD.pid));
+    END IF;
+END$$
+
+CREATE TRIGGER version_after_portfolio_asset_delete
+AFTER DELETE ON Portfolio_Asset
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('portfolio', (SELECT uid FROM Portfolio WHERE pid = OLD.pid));
+END$$
+
+CREATE TRIGGER version_after_portfolio_delete
+AFTER DELETE ON Portfolio
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('portfolio', OLD.uid);
+END$$
+
+CREATE TRIGGER version_after_watchlist_insert
+AFTER INSERT ON Watchlist
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('watchlists', NEW.uid);
+END$$
+
+CREATE TRIGGER version_after_watchlist_update
+AFTER UPDATE ON Watchlist
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('watchlists', NEW.uid);
+    CALL BumpDataVersion('watchlists', IF(NEW.uid <> OLD.uid, OLD.uid, NULL));
+    CALL BumpDataVersion('watchlist', NEW.wid);
+END$$
+
+CREATE TRIGGER version_after_watchlist_delete
+AFTER DELETE ON Watchlist
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('watchlists', OLD.uid);
+    CALL BumpDataVersion('watchlist', OLD.wid);
+END$$
+
+CREATE TRIGGER version_after_watchlist_asset_insert
+AFTER INSERT ON Watchlist_Asset
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('watchlist', NEW.wid);
+END$$
+
+CREATE TRIGGER version_after_watchlist_asset_delete
+AFTER DELETE ON Watchlist_Asset
+FOR EACH ROW
+BEGIN
+    CALL BumpDataVersion('watchlist', OLD.wid);
 END$$
 
 DELIMITER ;
\ No newline at end of file
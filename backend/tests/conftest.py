@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app's modules are imported flat from flaskapp, as app.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flaskapp'))
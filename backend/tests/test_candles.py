@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from candles import RESOLUTIONS, aggregate_candles, bucket_start, candle_rows
+from price_simulator import Bars, PriceSimulator, bar_rows
+
+AIDS = [3, 8]
+
+# 10 second bars from just before midnight: buckets of every resolution
+# start and end inside the series, some on a bar's exact timestamp
+START = datetime(2026, 3, 1, 23, 54, 30)
+STEPS = 600
+
+
+def series(steps=STEPS, start=START):
+    timestamps = [start + timedelta(seconds=10 * i) for i in range(steps)]
+    bars = PriceSimulator(11).simulate([100.0, 42.0], [0.002, 0.004], steps, [10, 10], [500, 500])
+    return timestamps, bars
+
+
+def merge(existing, row):
+    # The row effects of CANDLE_UPDATE_SQL on a (aid, resolution, bucket) key
+    if existing is None:
+        return row
+    aid, resolution, bucket, open_p, high, low, close_p, volume, open_date, close_date = existing
+    _, _, _, new_open, new_high, new_low, new_close, new_volume, new_open_date, new_close_date = row
+    return (
+        aid, resolution, bucket,
+        new_open if new_open_date < open_date else open_p,
+        max(high, new_high),
+        min(low, new_low),
+        new_close if new_close_date >= close_date else close_p,
+        volume + new_volume,
+        min(open_date, new_open_date),
+        max(close_date, new_close_date)
+    )
+
+
+def upsert(table, rows):
+    for row in rows:
+        key = row[:3]
+        table[key] = merge(table.get(key), row)
+    return table
+
+
+def reference_candles(aids, timestamps, bars):
+    # Plain-Python rollup of the rounded bars, one bar at a time
+    candles = {}
+    for aid, date, open_p, close_p, high, low, volume in bar_rows(aids, timestamps, bars):
+        for resolution in RESOLUTIONS:
+            key = (aid, resolution, bucket_start(date, resolution))
+            candle = candles.get(key)
+            if candle is None:
+                candles[key] = [open_p, high, low, close_p, volume, date, date]
+            else:
+                candle[1] = max(candle[1], high)
+                candle[2] = min(candle[2], low)
+                candle[3] = close_p
+                candle[4] += volume
+                candle[6] = date
+    return {key: key + tuple(value) for key, value in candles.items()}
+
+
+def as_table(rows):
+    table = {}
+    for row in rows:
+        key = row[:3]
+        assert key not in table, f"duplicate candle {key}"
+        table[key] = tuple(row)
+    return table
+
+
+def test_aggregate_matches_the_reference_rollup():
+    timestamps, bars = series()
+    assert as_table(aggregate_candles(AIDS, timestamps, bars)) == reference_candles(AIDS, timestamps, bars)
+
+
+def test_buckets_align_to_local_midnight():
+    timestamps, bars = series()
+    table = as_table(aggregate_candles(AIDS, timestamps, bars))
+    days = sorted(bucket for aid, resolution, bucket in table if aid == 3 and resolution == '1d')
+    assert days == [datetime(2026, 3, 1), datetime(2026, 3, 2)]
+    # The bar at exactly 00:00:00 opens the new day and hour
+    hour = table[(3, '1h', datetime(2026, 3, 2))]
+    assert hour[8] == datetime(2026, 3, 2)
+    assert table[(3, '1h', datetime(2026, 3, 1, 23))][9] == datetime(2026, 3, 1, 23, 59, 50)
+    # A partial first bucket starts at the first bar, not at the bucket start
+    first = table[(3, '5m', datetime(2026, 3, 1, 23, 50))]
+    assert first[8] == START
+
+
+def test_since_skips_earlier_candles():
+    timestamps, bars = series()
+    since = {'1m': datetime(2026, 3, 2, 0, 30), '1d': datetime(2026, 3, 2)}
+    table = as_table(aggregate_candles(AIDS, timestamps, bars, since=since))
+    full = as_table(aggregate_candles(AIDS, timestamps, bars))
+    for key, row in full.items():
+        cutoff = since.get(key[1])
+        assert (key in table) == (cutoff is None or key[2] >= cutoff)
+        if key in table:
+            assert table[key] == row
+
+
+@pytest.mark.parametrize('seam', [1, 37, 330, 599])
+def test_partial_candles_merge_into_the_whole(seam):
+    # A history rolled up in two calls and upserted equals one call
+    timestamps, bars = series()
+    first = Bars(*(column[:, :seam] for column in bars))
+    second = Bars(*(column[:, seam:] for column in bars))
+    table = upsert({}, aggregate_candles(AIDS, timestamps[seam:], second))
+    table = upsert(table, aggregate_candles(AIDS, timestamps[:seam], first))
+    assert table == as_table(aggregate_candles(AIDS, timestamps, bars))
+
+
+def test_per_bar_candle_rows_merge_into_the_rollup():
+    # The ticker's per-bar upserts and the backfill's rollups agree
+    timestamps, bars = series(steps=90)
+    table = upsert({}, candle_rows(bar_rows(AIDS, timestamps, bars)))
+    assert table == as_table(aggregate_candles(AIDS, timestamps, bars))
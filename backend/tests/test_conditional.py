@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip('flask_sqlalchemy')
+
+from flask import Flask, jsonify
+
+import conditional
+import price_cache
+
+
+@pytest.fixture
+def state(monkeypatch):
+    state = {
+        'seq': 5,
+        'tick': datetime(2026, 1, 1, 0, 0, 1, tzinfo=timezone.utc),
+        'versions': {('portfolio', 7): (2, datetime(2026, 1, 1, 0, 0, 3, 500000, tzinfo=timezone.utc))}
+    }
+    monkeypatch.setattr(price_cache, 'current_tick', lambda: (state['seq'], state['tick']))
+    monkeypatch.setattr(conditional, 'data_version',
+                        lambda scope, id: state['versions'].get((scope, id), (0, None)))
+    return state
+
+
+@pytest.fixture
+def client(state):
+    app = Flask(__name__)
+    app.calls = []
+
+    @app.route('/portfolio/<int:uid>')
+    @conditional.conditional_get('prices', 'portfolio')
+    def portfolio(uid):
+        app.calls.append(uid)
+        return jsonify({'uid': uid})
+
+    @app.route('/missing/<int:uid>')
+    @conditional.conditional_get('portfolio')
+    def missing(uid):
+        return jsonify({'error': 'Not found'}), 404
+
+    client = app.test_client()
+    client.calls = app.calls
+    return client
+
+
+def test_first_response_carries_validators(client):
+    response = client.get('/portfolio/7')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == 'W/"prices.5-portfolio.2"'
+    assert response.headers['Last-Modified'] == 'Thu, 01 Jan 2026 00:00:03 GMT'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+def test_current_copy_gets_304_without_running_the_view(client):
+    etag = client.get('/portfolio/7').headers['ETag']
+    response = client.get('/portfolio/7', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert client.calls == [7]
+
+
+def test_if_modified_since(client):
+    last_modified = client.get('/portfolio/7').headers['Last-Modified']
+    assert client.get('/portfolio/7', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert client.get('/portfolio/7', headers={'If-Modified-Since': 'Thu, 01 Jan 2026 00:00:02 GMT'}).status_code == 200
+
+
+def test_new_tick_or_version_changes_the_tag(client, state):
+    etag = client.get('/portfolio/7').headers['ETag']
+    state['seq'] = 6
+    response = client.get('/portfolio/7', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == 'W/"prices.6-portfolio.2"'
+    state['versions'][('portfolio', 7)] = (3, state['tick'])
+    assert client.get('/portfolio/7', headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+
+def test_errors_get_no_validators(client):
+    response = client.get('/missing/7')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
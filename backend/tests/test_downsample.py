@@ -0,0 +1,51 @@
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from downsample import lttb
+
+
+def reference_lttb(x, y, threshold):
+    # Plain-Python port of the reference LTTB implementation
+    n = len(x)
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    selected = [0]
+    for i in range(threshold - 2):
+        avg_start = math.floor((i + 1) * every) + 1
+        avg_end = min(math.floor((i + 2) * every) + 1, n)
+        avg_x = sum(x[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(y[avg_start:avg_end]) / (avg_end - avg_start)
+
+        max_area, next_a = -1, None
+        for j in range(math.floor(i * every) + 1, math.floor((i + 1) * every) + 1):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a])) * 0.5
+            if area > max_area:
+                max_area, next_a = area, j
+        selected.append(next_a)
+        a = next_a
+    selected.append(n - 1)
+    return selected
+
+
+def test_lttb_known_series():
+    # 17 points down to 13: the last inner bucket is floor(10 * every) + 1 to
+    # floor(11 * every) + 1, i.e. only point 14, so the spike at 15 is dropped
+    y = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5, 8, 9, 7, 1, 20, 2]
+    assert lttb(list(range(17)), y, 13).tolist() == [0, 1, 2, 3, 5, 6, 7, 9, 10, 12, 13, 14, 16]
+
+
+def test_lttb_matches_reference():
+    rng = np.random.default_rng(7)
+    for _ in range(200):
+        n = int(rng.integers(5, 300))
+        threshold = int(rng.integers(3, n))
+        x = np.cumsum(rng.random(n))
+        y = rng.normal(size=n)
+        assert lttb(x, y, threshold).tolist() == reference_lttb(x.tolist(), y.tolist(), threshold)
+
+
+def test_lttb_keeps_short_series():
+    assert lttb([0, 1, 2], [5, 6, 7], 10).tolist() == [0, 1, 2]
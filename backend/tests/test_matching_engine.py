@@ -0,0 +1,100 @@
+from matching_engine import MatchingEngine, OrderBook, RestingOrder
+
+
+def order(oid, otype, price, qty, uid=None, aid=1):
+    return RestingOrder(oid, uid if uid is not None else oid, aid, otype, price, qty)
+
+
+def test_submit_fills_best_price_first_at_sell_price():
+    book = OrderBook(1)
+    book.add(order(1, 'Sell', 101, 5))
+    book.add(order(2, 'Sell', 100, 5))
+    fills = book.submit(order(3, 'Buy', 102, 7))
+    assert [(f.sell_oid, f.qty, f.price) for f in fills] == [(2, 5, 100), (1, 2, 101)]
+    assert book.asks.depth(5) == [(101, 3, 1)]
+    assert not book.bids.prices
+
+
+def test_time_priority_within_a_level():
+    book = OrderBook(1)
+    book.add(order(1, 'Buy', 100, 3))
+    book.add(order(2, 'Buy', 100, 3))
+    fills = book.submit(order(3, 'Sell', 100, 4))
+    assert [(f.buy_oid, f.qty) for f in fills] == [(1, 3), (2, 1)]
+    assert book.bids.depth(1) == [(100, 2, 1)]
+
+
+def test_submit_stops_at_first_level_that_does_not_cross():
+    book = OrderBook(1)
+    book.add(order(1, 'Sell', 100, 1))
+    book.add(order(2, 'Sell', 105, 1))
+    incoming = order(3, 'Buy', 101, 5)
+    fills = book.submit(incoming)
+    assert [f.sell_oid for f in fills] == [1]
+    # The remainder rests at its own price
+    assert incoming.qty == 4
+    assert book.depth(5) == {'bids': [(101, 4, 1)], 'asks': [(105, 1, 1)]}
+
+
+def test_match_uncrosses_a_loaded_book():
+    book = OrderBook(1)
+    book.add(order(1, 'Buy', 102, 2))
+    book.add(order(2, 'Buy', 99, 2))
+    book.add(order(3, 'Sell', 98, 1))
+    book.add(order(4, 'Sell', 100, 3))
+    fills = book.match()
+    assert [(f.buy_oid, f.sell_oid, f.qty, f.price) for f in fills] == [(1, 3, 1, 98), (1, 4, 1, 100)]
+    assert not book.is_crossed()
+    assert book.depth(5) == {'bids': [(99, 2, 1)], 'asks': [(100, 2, 1)]}
+
+
+def test_engine_matches_every_book():
+    engine = MatchingEngine()
+    engine.load([
+        order(1, 'Sell', 100, 2), order(2, 'Buy', 100, 2),
+        order(3, 'Sell', 50, 1, aid=2), order(4, 'Buy', 49, 1, aid=2)
+    ])
+    fills = engine.match()
+    assert [(f.aid, f.buy_oid, f.sell_oid) for f in fills] == [(1, 2, 1)]
+    assert engine.book(2).is_crossed() is False
+
+
+def test_cancel_unlinks_from_the_middle_of_a_level():
+    engine = MatchingEngine()
+    engine.load([order(1, 'Buy', 100, 1), order(2, 'Buy', 100, 2), order(3, 'Buy', 100, 3)])
+    assert engine.cancel(2).oid == 2
+    assert engine.cancel(2) is None
+    assert engine.depth(1, 1) == {'bids': [(100, 4, 2)], 'asks': []}
+    assert [o.oid for o in engine.resting_orders()] == [1, 3]
+    assert [o.oid for o in engine.cancel_many([1, 3, 99])] == [1, 3]
+    assert engine.depth(1, 1) == {'bids': [], 'asks': []}
+
+
+def test_engine_forgets_filled_orders_and_keeps_the_rest():
+    engine = MatchingEngine()
+    engine.add(order(1, 'Sell', 100, 2))
+    engine.add(order(2, 'Sell', 100, 2, aid=2))
+    fills = engine.submit(order(3, 'Buy', 100, 3))
+    assert [(f.sell_oid, f.qty) for f in fills] == [(1, 2)]
+    assert set(engine.orders) == {2, 3}
+    # Other assets' books are untouched by an incremental submit
+    assert engine.depth(2, 1)['asks'] == [(100, 2, 1)]
+
+
+def test_resting_orders_rebuild_identical_books():
+    engine = MatchingEngine()
+    engine.load([order(1, 'Buy', 100, 1), order(2, 'Buy', 101, 1), order(3, 'Buy', 100, 2), order(4, 'Sell', 103, 1)])
+    copy = MatchingEngine()
+    copy.load(order(o.oid, o.otype, o.price, o.qty) for o in engine.resting_orders())
+    assert copy.depth(1, 10) == engine.depth(1, 10)
+    fills = copy.submit(order(5, 'Sell', 100, 3))
+    assert [f.buy_oid for f in fills] == [2, 1, 3]
+
+
+def test_replace_book_drops_the_old_orders():
+    engine = MatchingEngine()
+    engine.load([order(1, 'Buy', 100, 1), order(2, 'Sell', 110, 1, aid=2)])
+    engine.replace_book(1, [order(3, 'Buy', 99, 1)])
+    assert set(engine.orders) == {2, 3}
+    assert engine.cancel(1) is None
+    assert engine.depth(1, 5)['bids'] == [(99, 1, 1)]
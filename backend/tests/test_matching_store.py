@@ -0,0 +1,151 @@
+from datetime import date, time
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+matching_store = pytest.importorskip('matching_store')
+
+
+class Database:
+    """The Orders rows and watermark that open_books reads and advances."""
+
+    def __init__(self):
+        self.seq = 0
+        self.pending = []   # rows in PENDING_ORDER_COLUMNS order
+        self.loads = 0
+
+    def add_order(self, oid, aid, otype, price, qty):
+        self.pending.append((oid, 1, aid, otype, Decimal(price), qty, date(2026, 1, 1), time(9, oid)))
+
+    def commit_elsewhere(self):
+        # Another API worker, the matcher or CALL MatchOrders() committing
+        self.seq += 1
+
+    def execute(self, statement, params=None):
+        sql = ' '.join(str(statement).split())
+        if sql.startswith('SELECT seq FROM MatchingWatermark'):
+            return SimpleNamespace(scalar=lambda: self.seq)
+        if sql.startswith('UPDATE MatchingWatermark'):
+            if self.seq != params['seq']:
+                return SimpleNamespace(rowcount=0)
+            self.seq = params['next']
+            return SimpleNamespace(rowcount=1)
+        assert 'FROM Orders' in sql, sql
+        self.loads += 1
+        if 'aid IN' in sql:
+            return [row for row in self.pending if row[2] in params['aids']]
+        return list(self.pending)
+
+
+class Connection:
+    def __init__(self, database):
+        self.database = database
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        return self.database.execute(statement, params)
+
+    def commit(self):
+        pass
+
+
+class Session(Connection):
+    def __init__(self, database):
+        super().__init__(database)
+        self.rollbacks = 0
+
+    def get_bind(self):
+        return SimpleNamespace(connect=lambda: Connection(self.database))
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def database(monkeypatch):
+    monkeypatch.setattr(matching_store, 'JOURNAL_DIR', None)
+    monkeypatch.setattr(matching_store, '_journal', None)
+    matching_store.reset_engine()
+    yield Database()
+    matching_store.reset_engine()
+
+
+def resting_oids(aid):
+    return sorted(order.oid for order in matching_store._engine.resting_orders() if order.aid == aid)
+
+
+def test_every_unit_advances_the_watermark(database):
+    session = Session(database)
+    database.add_order(1, 5, 'Buy', '100', 2)
+    with matching_store.open_books(session, [5]):
+        pass
+    with matching_store.open_books(session, [5]):
+        pass
+    assert database.seq == 2
+    # The book was loaded once and then trusted
+    assert database.loads == 1
+    assert resting_oids(5) == [1]
+
+
+def test_books_reload_when_another_writer_commits(database):
+    session = Session(database)
+    database.add_order(1, 5, 'Buy', '100', 2)
+    with matching_store.open_books(session, [5]):
+        pass
+
+    database.add_order(2, 5, 'Buy', '99', 1)
+    database.add_order(3, 6, 'Sell', '50', 1)
+    database.commit_elsewhere()
+    with matching_store.open_books(session, [5]):
+        pass
+    assert resting_oids(5) == [1, 2]
+    assert database.seq == 3
+    # Books outside the unit are reloaded on their own next use
+    assert matching_store.needs_load(6)
+    with matching_store.open_books(session, [6]):
+        pass
+    assert resting_oids(6) == [3]
+
+
+def test_commit_fails_if_the_watermark_moved_during_the_unit(database):
+    session = Session(database)
+    with pytest.raises(matching_store.StaleBooks):
+        with matching_store.open_books(session, [5]):
+            database.commit_elsewhere()
+    assert session.rollbacks == 1
+    assert matching_store.needs_load(5)
+
+
+def test_units_on_other_books_fail_after_a_reload(database):
+    # A unit still running when another unit finds the watermark moved may
+    # have matched a stale book
+    outer, inner = Session(database), Session(database)
+    with pytest.raises(matching_store.StaleBooks):
+        with matching_store.open_books(outer, [5]):
+            database.commit_elsewhere()
+            with matching_store.open_books(inner, [6]):
+                pass
+    assert (outer.rollbacks, inner.rollbacks) == (1, 0)
+    assert database.seq == 2
+
+
+def test_stale_units_are_retried(database):
+    attempts = []
+
+    @matching_store.retry_on_deadlock
+    def unit(session):
+        with matching_store.open_books(session, [5]):
+            attempts.append(database.seq)
+            if len(attempts) == 1:
+                database.commit_elsewhere()
+        return len(attempts)
+
+    assert unit(Session(database)) == 2
+    assert attempts == [0, 1]
+    assert database.seq == 2
@@ -0,0 +1,93 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('flask_sqlalchemy')
+
+from flask import Flask
+
+import matching_client
+import matching_store
+from routes import orders_routes
+
+
+class MarginSession:
+    """Answers check_margins' two queries and records them."""
+
+    def __init__(self, asset_types, margins):
+        self.asset_types = asset_types
+        self.margins = margins
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+        if len(self.statements) == 1:
+            return SimpleNamespace(fetchall=lambda: list(self.asset_types.items()))
+        return [
+            SimpleNamespace(uid=uid, equity_margin=equity, commodity_margin=commodity)
+            for uid, (equity, commodity) in self.margins.items()
+        ]
+
+
+def priced(uid, aid, qty, price):
+    return {'uid': uid, 'aid': aid, 'qty': qty, 'otype': 'Buy', 'price': Decimal(price)}
+
+
+def test_check_margins_totals_cost_per_user_and_asset_class():
+    session = MarginSession({1: 'Equity', 2: 'Commodity'}, {7: (Decimal(1000), Decimal(100))})
+    errors = matching_store.check_margins(session, [
+        priced(7, 1, 5, 100),
+        priced(7, 1, 5, 100),
+        priced(7, 2, 3, 50),
+        priced(8, 1, 1, 1),
+        priced(7, 3, 1, 1)
+    ])
+    assert errors == [
+        None, None,
+        'Order exceeds available margin',
+        'User not found',
+        'Asset not found'
+    ]
+    # The ledger rows are read locked
+    assert 'FOR UPDATE' in session.statements[1]
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    app = Flask(__name__)
+    app.config['MATCHING_SHARDS'] = 2
+    monkeypatch.setattr(orders_routes, 'db', SimpleNamespace(session=SimpleNamespace(rollback=lambda: None)))
+    with app.app_context():
+        yield monkeypatch
+
+
+def test_failed_shard_keeps_the_other_shards_results(sharded):
+    def call(aid, shard_count, request):
+        if aid % shard_count == 1:
+            raise matching_client.ShardError("Matching shard 1 unavailable: connection reset")
+        oids = [100 + i for i in range(len(request['orders']))]
+        return {'oids': oids, 'errors': [None] * len(oids), 'filled': {100: 2}}
+
+    sharded.setattr(matching_client, 'call', call)
+    results = orders_routes.place_priced_orders([
+        priced(7, 2, 5, 10),
+        priced(7, 3, 5, 10),
+        priced(7, 4, 5, 10)
+    ])
+    assert results == [
+        {'status': 'placed', 'oid': 100, 'filled_qty': 2},
+        {'status': 'failed', 'error': "Matching shard 1 unavailable: connection reset"},
+        {'status': 'placed', 'oid': 101, 'filled_qty': 0}
+    ]
+
+
+def test_shard_rejections_come_back_per_order(sharded):
+    sharded.setattr(matching_client, 'call', lambda aid, shard_count, request: {
+        'oids': [None, 100], 'errors': ['Order exceeds available margin', None], 'filled': {}
+    })
+    results = orders_routes.place_priced_orders([priced(7, 2, 5, 10), priced(7, 4, 5, 10)])
+    assert results == [
+        {'status': 'rejected', 'error': 'Order exceeds available margin'},
+        {'status': 'placed', 'oid': 100, 'filled_qty': 0}
+    ]
@@ -0,0 +1,174 @@
+import glob
+import os
+from decimal import Decimal
+
+import pytest
+
+from matching_engine import MatchingEngine, RestingOrder
+from order_journal import OrderJournal, apply_op, order_to_record
+
+
+def order(oid, otype, price, qty, aid=1):
+    return RestingOrder(oid, oid, aid, otype, Decimal(price), qty)
+
+
+def book_state(engine):
+    return [order_to_record(o) for o in engine.resting_orders()]
+
+
+# Units of journaled operations, as BookSession records them
+UNITS = [
+    [['batch', [order_to_record(order(1, 'Buy', '100', 5)), order_to_record(order(2, 'Sell', '101', 3))]]],
+    [['submit', order_to_record(order(3, 'Sell', '99', 2)), True]],
+    [['submit', order_to_record(order(4, 'Buy', '102', 4, aid=2)), False]],
+    [['batch', [order_to_record(order(5, 'Sell', '100', 9)), order_to_record(order(6, 'Buy', '100', 1, aid=2))]]],
+    [['cancel', 2]],
+    [['cancel_many', [4, 6, 99]]],
+    [['submit', order_to_record(order(7, 'Buy', '100.5', 2)), True]]
+]
+
+
+def run(engine, journal, units, first_seq=1):
+    # Apply each unit to the live engine and journal it, as open_books does
+    for seq, ops in enumerate(units, first_seq):
+        for op in ops:
+            apply_op(engine, op)
+        journal.append(seq, ops, [])
+
+
+def segments(directory):
+    return sorted(os.path.basename(path) for path in glob.glob(os.path.join(str(directory), 'journal-*.log')))
+
+
+def test_recover_without_snapshot_starts_empty(tmp_path):
+    assert OrderJournal(str(tmp_path)).recover() == (None, None)
+
+
+def test_snapshot_plus_tail_replays_to_the_live_books(tmp_path):
+    live = MatchingEngine()
+    journal = OrderJournal(str(tmp_path))
+    run(live, journal, UNITS[:3])
+    journal.write_snapshot(live, 3)
+    run(live, journal, UNITS[3:], first_seq=4)
+
+    engine, seq = OrderJournal(str(tmp_path)).recover()
+    assert seq == len(UNITS)
+    assert book_state(engine) == book_state(live)
+    assert engine.depth(1, 10) == live.depth(1, 10)
+    # Both books keep matching identically
+    assert engine.submit(order(8, 'Sell', '90', 10)) == live.submit(order(8, 'Sell', '90', 10))
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    live = MatchingEngine()
+    journal = OrderJournal(str(tmp_path))
+    journal.write_snapshot(live, 0)
+    run(live, journal, UNITS[:2])
+    expected = book_state(live)
+    # A crash in the middle of writing unit 3
+    with open(os.path.join(str(tmp_path), segments(tmp_path)[-1]), 'a') as f:
+        f.write('{"seq":3,"ops":[["cancel",')
+
+    engine, seq = OrderJournal(str(tmp_path)).recover()
+    assert seq == 2
+    assert book_state(engine) == expected
+
+
+def test_gap_in_the_journal_stops_replay(tmp_path):
+    live = MatchingEngine()
+    journal = OrderJournal(str(tmp_path))
+    journal.write_snapshot(live, 0)
+    run(live, journal, UNITS[:2])
+    expected = book_state(live)
+    # Unit 3 never reached the journal
+    run(live, journal, UNITS[3:4], first_seq=4)
+
+    engine, seq = OrderJournal(str(tmp_path)).recover()
+    assert seq == 2
+    assert book_state(engine) == expected
+
+
+def test_snapshot_drops_older_segments(tmp_path):
+    live = MatchingEngine()
+    journal = OrderJournal(str(tmp_path))
+    run(live, journal, UNITS[:2])
+    assert segments(tmp_path) == ['journal-000000000001.log']
+
+    journal.write_snapshot(live, 2)
+    assert segments(tmp_path) == []
+    run(live, journal, UNITS[2:4], first_seq=3)
+    assert segments(tmp_path) == ['journal-000000000003.log']
+
+    engine, seq = OrderJournal(str(tmp_path)).recover()
+    assert seq == 4
+    assert book_state(engine) == book_state(live)
+
+
+def test_append_asks_for_a_snapshot_every_n_units(tmp_path):
+    journal = OrderJournal(str(tmp_path), snapshot_every=3)
+    assert [journal.append(seq, [], []) for seq in range(1, 7)] == [False, False, True, True, True, True]
+    journal.write_snapshot(MatchingEngine(), 6)
+    assert journal.append(7, [], []) is False
+
+
+def test_lines_are_fsynced_in_groups(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, 'fsync', lambda fd: synced.append(fd))
+    journal = OrderJournal(str(tmp_path), fsync_interval=3600, fsync_batch=3)
+    for seq in range(1, 8):
+        journal.append(seq, [], [])
+    assert len(synced) == 2
+    # A snapshot syncs the rest of the segment before dropping it
+    journal.write_snapshot(MatchingEngine(), 7)
+    assert len(synced) == 4
+
+
+class WatermarkSession:
+    """Answers read_watermark with a fixed committed sequence."""
+
+    def __init__(self, seq):
+        self.seq = seq
+
+    def execute(self, statement, params=None):
+        return self
+
+    def scalar(self):
+        return self.seq
+
+
+@pytest.fixture
+def store(monkeypatch):
+    matching_store = pytest.importorskip('matching_store')
+    rebuilt = MatchingEngine()
+    rebuilt.add(order(42, 'Buy', '1', 1))
+    monkeypatch.setattr(matching_store, 'load_engine', lambda session: rebuilt)
+    return matching_store, rebuilt
+
+
+def test_journal_at_the_watermark_is_trusted(tmp_path, store):
+    matching_store, _ = store
+    live = MatchingEngine()
+    journal = OrderJournal(str(tmp_path))
+    journal.write_snapshot(live, 0)
+    run(live, journal, UNITS)
+
+    engine, seq, rebuilt = matching_store.recover_engine(WatermarkSession(len(UNITS)), journal)
+    assert (seq, rebuilt) == (len(UNITS), False)
+    assert book_state(engine) == book_state(live)
+
+
+@pytest.mark.parametrize('db_seq', [len(UNITS) - 1, len(UNITS) + 1])
+def test_watermark_mismatch_rebuilds_from_orders(tmp_path, store, db_seq):
+    matching_store, rebuilt = store
+    journal = OrderJournal(str(tmp_path))
+    journal.write_snapshot(MatchingEngine(), 0)
+    run(MatchingEngine(), journal, UNITS)
+
+    engine, seq, from_orders = matching_store.recover_engine(WatermarkSession(db_seq), journal)
+    assert (engine, seq, from_orders) == (rebuilt, db_seq, True)
+
+
+def test_missing_journal_rebuilds_from_orders(tmp_path, store):
+    matching_store, rebuilt = store
+    engine, seq, from_orders = matching_store.recover_engine(WatermarkSession(0), OrderJournal(str(tmp_path)))
+    assert (engine, seq, from_orders) == (rebuilt, 0, True)
@@ -0,0 +1,108 @@
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+import price_export
+import price_store
+from price_store import PriceStoreReader, PriceStoreWriter
+
+T0 = datetime(2026, 1, 1, 9, 30)
+STEPS = 50
+
+
+def tick(i):
+    return T0 + timedelta(seconds=10 * i)
+
+
+class PriceCursor:
+    """DB-API cursor over in-memory Price rows, answering the export's queries."""
+
+    def __init__(self, aids, rows):
+        self.aids = aids
+        self.rows = sorted(rows)   # (aid, date, open, high, low, close, volume)
+        self.pages = []
+        self.result = []
+
+    def execute(self, sql, params=None):
+        if sql == price_export.ASSETS_SQL:
+            self.result = [(aid,) for aid in self.aids]
+            return
+        assert sql == price_export.PRICES_PAGE_SQL
+        self.pages.append(params['after'])
+        matching = [row[1:] for row in self.rows
+                    if row[0] == params['aid'] and params['after'] < row[1] <= params['end']]
+        self.result = matching[:params['limit']]
+
+    def fetchall(self):
+        return self.result
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Assets 1 and 2 in the price store; asset 3 only in Price
+    writer = PriceStoreWriter(str(tmp_path), 20)
+    times = [tick(i) for i in range(STEPS)]
+    close = np.array([[aid * 100 + i for i in range(STEPS)] for aid in (1, 2)], dtype=float)
+    writer.append(times, [1, 2], close - 1, close + 1, close - 2, close, np.full(close.shape, 7, dtype=np.int64))
+    monkeypatch.setattr(price_store, 'get_reader', lambda: PriceStoreReader(str(tmp_path)))
+    return PriceCursor([1, 2, 3], [(3, tick(i), 1.0, 2.0, 0.5, 300.0 + i, 9) for i in range(STEPS)])
+
+
+def read_back(data, fmt):
+    if fmt == 'parquet':
+        return pq.read_table(io.BytesIO(data))
+    return pa.ipc.open_stream(data).read_all()
+
+
+@pytest.mark.parametrize('fmt', sorted(price_export.FORMATS))
+def test_round_trip(store, fmt):
+    data = b''.join(price_export.stream(price_export.export_batches(store), fmt))
+    table = read_back(data, fmt)
+    assert table.schema == price_export.schema()
+    assert table.num_rows == 3 * STEPS
+    assert table.column('aid').to_pylist() == [1] * STEPS + [2] * STEPS + [3] * STEPS
+    assert table.column('date').to_pylist()[:3] == [tick(0), tick(1), tick(2)]
+    assert table.column('close_price').to_pylist()[STEPS:STEPS + 2] == [200.0, 201.0]
+    assert table.column('close_price').to_pylist()[-1] == 300.0 + STEPS - 1
+    assert set(table.column('volume').to_pylist()) == {7, 9}
+
+
+@pytest.mark.parametrize('fmt', sorted(price_export.FORMATS))
+def test_from_and_to_are_inclusive(store, fmt):
+    batches = price_export.export_batches(store, aids=[2, 3], start=tick(5), end=tick(24))
+    table = read_back(b''.join(price_export.stream(batches, fmt)), fmt)
+    assert table.num_rows == 2 * 20
+    for aid in (2, 3):
+        dates = [d for a, d in zip(table.column('aid').to_pylist(), table.column('date').to_pylist()) if a == aid]
+        assert dates == [tick(i) for i in range(5, 25)]
+
+
+def test_sql_pages_follow_the_keyset(store, monkeypatch):
+    monkeypatch.setattr(price_export, 'BATCH_ROWS', 8)
+    batches = list(price_export.sql_batches(store, 3, tick(3), tick(40), None))
+    assert [batch.num_rows for batch in batches] == [8, 8, 8, 8, 6]
+    dates = [d for batch in batches for d in batch.column(1).to_pylist()]
+    assert dates == [tick(i) for i in range(3, 41)]
+    # Each page starts after the last date of the one before
+    assert store.pages[1:] == [tick(10), tick(18), tick(26), tick(34)]
+
+
+def test_write_batches_to_a_parquet_file(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(price_export, 'BATCH_ROWS', 16)
+    path = str(tmp_path / 'prices.parquet')
+    for _ in price_export.write_batches(price_export.export_batches(store, aids=[1, 3]), path, 'parquet'):
+        pass
+    parquet = pq.ParquetFile(path)
+    assert parquet.metadata.num_rows == 2 * STEPS
+    # Row groups of about BATCH_ROWS rows
+    assert max(parquet.metadata.row_group(i).num_rows for i in range(parquet.num_row_groups)) <= 2 * 16
+
+
+def test_unknown_interval_is_rejected(store):
+    with pytest.raises(ValueError):
+        list(price_export.export_batches(store, interval='7m'))
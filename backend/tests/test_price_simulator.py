@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import price_simulator
+from price_simulator import PriceSimulator, asset_volatility, bar_rows, volume_ranges
+
+START = [100.0, 2500.0, 7.5]
+TYPES = ['Equity', 'Commodity', 'Equity']
+
+
+def simulate(seed, steps, interval=price_simulator.BASE_INTERVAL):
+    low, high = volume_ranges(TYPES)
+    return PriceSimulator(seed).simulate(START, asset_volatility([1, 2, 3]), steps, low, high, interval)
+
+
+def assert_bars_equal(a, b):
+    for column in a._fields:
+        np.testing.assert_array_equal(getattr(a, column), getattr(b, column))
+
+
+def test_same_seed_replays_the_same_paths():
+    assert_bars_equal(simulate(42, 50), simulate(42, 50))
+    assert not np.array_equal(simulate(42, 50).close, simulate(43, 50).close)
+
+
+def test_bars_are_well_formed():
+    bars = simulate(7, 200, interval=60)
+    assert bars.close.shape == (3, 200)
+    assert (bars.high >= np.maximum(bars.open, bars.close)).all()
+    assert (bars.low <= np.minimum(bars.open, bars.close)).all()
+    assert (bars.low > 0).all()
+    # Volume stays within the class range scaled to the bar length
+    assert bars.volume[1].min() >= 10 * 6 and bars.volume[1].max() <= 500 * 6
+
+
+def test_asset_volatility_is_fixed_per_asset():
+    vol = asset_volatility([1, 2, 3])
+    np.testing.assert_array_equal(vol, asset_volatility([1, 2, 3]))
+    assert ((vol >= 0.5 * price_simulator.BASE_VOLATILITY) & (vol < 1.5 * price_simulator.BASE_VOLATILITY)).all()
+
+
+def test_one_chunk_equals_simulate():
+    low, high = volume_ranges(TYPES)
+    chunks = list(PriceSimulator(42).simulate_chunks(START, asset_volatility([1, 2, 3]), 50, low, high))
+    assert [first for first, _ in chunks] == [0]
+    assert_bars_equal(chunks[0][1], simulate(42, 50))
+
+
+def test_chunks_continue_from_the_last_close(monkeypatch):
+    # 3 assets x 20 steps per chunk: 50 steps in chunks of 20, 20 and 10
+    monkeypatch.setattr(price_simulator, 'CHUNK_VALUES', 60)
+    low, high = volume_ranges(TYPES)
+    volatility = asset_volatility([1, 2, 3])
+    chunks = list(PriceSimulator(42).simulate_chunks(START, volatility, 50, low, high))
+    assert [(first, bars.close.shape[1]) for first, bars in chunks] == [(0, 20), (20, 20), (40, 10)]
+
+    # The same draws as simulate() called block by block on one generator
+    simulator = PriceSimulator(42)
+    prices = START
+    for (_, bars), steps in zip(chunks, (20, 20, 10)):
+        expected = simulator.simulate(prices, volatility, steps, low, high)
+        assert_bars_equal(bars, expected)
+        prices = expected.close[:, -1]
+
+
+def test_bar_rows_flatten_per_asset_in_time_order():
+    bars = simulate(1, 2)
+    timestamps = [datetime(2026, 1, 1), datetime(2026, 1, 1) + timedelta(seconds=10)]
+    rows = bar_rows([5, 6, 7], timestamps, bars)
+    assert [(aid, date) for aid, date, *_ in rows] == [(aid, t) for aid in (5, 6, 7) for t in timestamps]
+    aid, date, open_p, close_p, high, low, volume = rows[3]
+    assert (open_p, close_p, high, low) == tuple(round(float(getattr(bars, c)[1, 1]), 2)
+                                                 for c in ('open', 'close', 'high', 'low'))
+    assert volume == bars.volume[1, 1]
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import price_store
+from price_store import PriceStoreReader, PriceStoreWriter, Segment, segment_paths, to_ms
+
+T0 = datetime(2026, 1, 1, 9, 30)
+
+
+def ticks(first, count):
+    return [T0 + timedelta(seconds=i) for i in range(first, first + count)]
+
+
+def bars(aids, first, count):
+    # Distinct prices per asset and tick: close = aid * 1000 + tick index
+    close = np.array([[aid * 1000 + i for i in range(first, first + count)] for aid in aids], dtype=float)
+    volume = np.full(close.shape, 10, dtype=np.int64)
+    return close - 1, close + 1, close - 2, close, volume
+
+
+def append(writer, aids, first, count):
+    writer.append(ticks(first, count), aids, *bars(aids, first, count))
+
+
+def test_append_then_read_back(tmp_path):
+    writer = PriceStoreWriter(str(tmp_path), 100)
+    append(writer, [1, 2], 0, 5)
+    times, values = PriceStoreReader(str(tmp_path)).read_bars(2)
+    assert times.tolist() == to_ms(ticks(0, 5)).tolist()
+    assert values['close'].tolist() == [2000, 2001, 2002, 2003, 2004]
+    assert values['high'].tolist() == [2001, 2002, 2003, 2004, 2005]
+    assert values['volume'].tolist() == [10] * 5
+
+
+def test_readers_only_see_ticks_counted_in_meta(tmp_path):
+    writer = PriceStoreWriter(str(tmp_path), 100)
+    append(writer, [1], 0, 3)
+    reader = PriceStoreReader(str(tmp_path))
+
+    # A tick whose values are written but whose count is not yet bumped
+    segment = writer.segment
+    segment.times[3] = to_ms(ticks(3, 1))[0]
+    segment.columns['close'][0, 3] = 1003
+    assert reader.read(1)[1].tolist() == [1000, 1001, 1002]
+
+    segment.meta[price_store.COUNT] = 4
+    assert reader.read(1)[1].tolist() == [1000, 1001, 1002, 1003]
+
+
+def test_append_skips_ticks_already_stored(tmp_path):
+    writer = PriceStoreWriter(str(tmp_path), 100)
+    append(writer, [1], 0, 3)
+    append(writer, [1], 1, 4)
+    times, closes = PriceStoreReader(str(tmp_path)).read(1)
+    assert times.tolist() == to_ms(ticks(0, 5)).tolist()
+    assert closes.tolist() == [1000, 1001, 1002, 1003, 1004]
+
+
+def test_range_reads_across_segment_boundaries(tmp_path):
+    writer = PriceStoreWriter(str(tmp_path), 3)
+    append(writer, [1, 2], 0, 8)
+    assert len(segment_paths(str(tmp_path))) == 3
+    reader = PriceStoreReader(str(tmp_path))
+
+    # Bounds are inclusive and may fall on either side of a boundary
+    times, closes = reader.read(1, start=T0 + timedelta(seconds=2), end=T0 + timedelta(seconds=6))
+    assert closes.tolist() == [1002, 1003, 1004, 1005, 1006]
+    assert times.tolist() == to_ms(ticks(2, 5)).tolist()
+    assert reader.read(2, start=T0 + timedelta(seconds=3), end=T0 + timedelta(seconds=5))[1].tolist() == [2003, 2004, 2005]
+    # Bounds between ticks
+    assert reader.read(1, start=T0 + timedelta(seconds=5.5))[1].tolist() == [1006, 1007]
+    assert reader.read(1, end=T0 + timedelta(seconds=0.5))[1].tolist() == [1000]
+    # A range outside the stored history
+    times, closes = reader.read(1, start=T0 + timedelta(hours=1))
+    assert times.tolist() == [] and closes.tolist() == []
+
+
+def test_missing_ticks_are_skipped(tmp_path):
+    writer = PriceStoreWriter(str(tmp_path), 100)
+    append(writer, [1], 0, 3)
+    # Asset 2 joins the segment at tick 3; its earlier rows hold zeros
+    append(writer, [1, 2], 3, 2)
+    reader = PriceStoreReader(str(tmp_path))
+
+    times, values = reader.read_bars(2)
+    assert times.tolist() == to_ms(ticks(3, 2)).tolist()
+    assert values['close'].tolist() == [2003, 2004]
+    assert values['volume'].tolist() == [10, 10]
+    assert reader.read(1)[1].tolist() == [1000, 1001, 1002, 1003, 1004]
+    assert reader.read(3) is None
+
+
+def test_drop_before_expires_whole_segments(tmp_path):
+    writer = PriceStoreWriter(str(tmp_path), 3)
+    append(writer, [1], 0, 8)
+    reader = PriceStoreReader(str(tmp_path))
+    assert len(reader.read(1)[0]) == 8
+
+    # Segment 0-2 ends before the cutoff, 3-5 holds a tick at it
+    assert writer.drop_before(T0 + timedelta(seconds=5)) == 1
+    assert reader.read(1)[1].tolist() == [1003, 1004, 1005, 1006, 1007]
+
+    # The segment being written is never dropped
+    assert writer.drop_before(T0 + timedelta(hours=1)) == 1
+    assert reader.read(1)[1].tolist() == [1006, 1007]
+    assert segment_paths(str(tmp_path)) == [writer.segment.path]
+
+
+def test_writer_resumes_the_newest_segment(tmp_path):
+    append(PriceStoreWriter(str(tmp_path), 5), [1], 0, 3)
+    writer = PriceStoreWriter(str(tmp_path), 5)
+    append(writer, [1], 0, 6)
+    assert [Segment(path).count for path in segment_paths(str(tmp_path))] == [5, 1]
+    assert PriceStoreReader(str(tmp_path)).read(1)[1].tolist() == [1000, 1001, 1002, 1003, 1004, 1005]
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from matching_engine import Fill
+from settlement import net_fills, rows_table, settle_fills
+
+
+def fill(buy_oid, buy_uid, sell_oid, sell_uid, qty, price, buy_price=None, aid=1):
+    return Fill(aid, buy_oid, buy_uid, buy_price or price, sell_oid, sell_uid, price, qty, price)
+
+
+class RecordingSession:
+    """
+    Stands in for a SQLAlchemy session and records each statement. Each
+    statement reports `rowcount` rows, by default one per filled order.
+    """
+
+    def __init__(self, rowcount=None):
+        self.statements = []
+        self.rowcount = rowcount
+
+    def execute(self, statement, params=None):
+        self.statements.append((str(statement), params))
+        rows = sum(1 for key in params or {} if key.startswith('f_oid'))
+        return SimpleNamespace(rowcount=rows if self.rowcount is None else self.rowcount)
+
+
+def test_rows_table_inlines_rows():
+    sql, params = rows_table('f', ('oid', 'qty'), [(1, 5), (2, 7)])
+    assert sql == "(SELECT :f_oid0 AS oid, :f_qty0 AS qty UNION ALL SELECT :f_oid1, :f_qty1) AS f"
+    assert params == {'f_oid0': 1, 'f_qty0': 5, 'f_oid1': 2, 'f_qty1': 7}
+
+
+def test_net_fills_nets_per_user_and_asset():
+    fills = [
+        fill(10, 1, 20, 2, 3, 100, buy_price=105),
+        fill(10, 1, 21, 3, 2, 101, buy_price=105),
+        fill(11, 2, 22, 1, 1, 99, aid=2)
+    ]
+    positions, funds, filled = net_fills(fills)
+    assert positions[(1, 1)] == [5, 5 * 105, 0, None]
+    assert positions[(2, 1)] == [0, 0, 3, 100]
+    assert positions[(1, 2)] == [0, 0, 1, 99]
+    assert funds[(1, 1)] == -(3 * 100 + 2 * 101)
+    assert funds[(2, 1)] == 300
+    assert funds[(3, 1)] == 202
+    assert filled == {10: 5, 20: 3, 21: 2, 11: 1, 22: 1}
+
+
+def test_settle_fills_is_a_fixed_number_of_statements():
+    session = RecordingSession()
+    settle_fills(session, [fill(10 + i, 1, 20 + i, 2, 1, 100) for i in range(50)])
+    statements = [sql.split()[0] for sql, _ in session.statements]
+    assert statements == ['SELECT', 'INSERT', 'INSERT', 'UPDATE', 'UPDATE', 'UPDATE']
+    assert session.statements[0][1] == {'uids': [1, 2]}
+
+
+def test_settle_fills_without_fills_does_nothing():
+    session = RecordingSession()
+    settle_fills(session, [])
+    assert session.statements == []
+
+
+def test_settle_fills_rejects_orders_the_books_overfilled():
+    # One of the two filled orders is missing or short in Orders
+    session = RecordingSession(rowcount=1)
+    with pytest.raises(RuntimeError):
+        settle_fills(session, [fill(10, 1, 20, 2, 5, 100)])
+    assert 'WHERE o.qty >= f.qty' in session.statements[-1][0]
@@ -0,0 +1,23 @@
+import os
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sql_initialisation')
+
+
+def statements(name, delimiter):
+    # Split the way test_system.py and full_reset.py run the scripts
+    with open(os.path.join(SQL_DIR, name)) as f:
+        content = f.read().replace("DELIMITER $$", "").replace("DELIMITER ;", "")
+    return [statement.strip() for statement in content.split(delimiter) if statement.strip()]
+
+
+def test_create_tables_splits_into_whole_statements():
+    for statement in statements('create_tables.sql', ';'):
+        assert statement.count('(') == statement.count(')'), statement[:80]
+        code = [line for line in statement.splitlines() if not line.strip().startswith('--')]
+        assert code, f"statement is only comments: {statement[:80]}"
+
+
+def test_routines_split_into_whole_statements():
+    for name in ('function.sql', 'procedure.sql', 'trigger.sql'):
+        for statement in statements(name, '$$'):
+            assert statement.count('(') == statement.count(')'), statement[:80]
@@ -2,11 +2,11 @@
 
 echo "Starting Ticker Service..."
 
-# Loop forever
+# One resident process ticks every TICK_INTERVAL seconds (default 10) on a
+# persistent connection; restart it if it exits
 while true; do
-    echo "Ticking..."
     python3 flaskapp/updateprices_catchup.py
-    
-    # Sleep for 10 seconds
-    sleep 10
+
+    echo "Ticker exited, restarting in 5 seconds..."
+    sleep 5
 done
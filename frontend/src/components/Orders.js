@@ -96,7 +96,7 @@ const Orders = ({ userData }) => {
           </thead>
           <tbody>
             {completedOrders.map((order, index) => (
-              <tr key={order.oid}>
+              <tr key={order.tid ? `${order.tid}-${order.otype}` : order.oid}>
                 <td>{index + 1}</td> {/* Row number */}
                 <td>{order.asset_name}</td>
                 <td>{order.otype}</td>